@@ -0,0 +1,194 @@
+"""
+Local stand-ins for the services the backend talks to, shared by the benchmarks.
+
+- FakeChatModel answers after a fixed latency, calling a tool on every n-th
+  turn, so runs are deterministic and cost nothing.
+- fake_tool is a tool that takes a fixed time, like a search API would.
+- FakeTelegramServer serves the few Bot API methods the backend calls and
+  records the messages sent to each chat.
+- CallCounter counts the statements an engine executes.
+"""
+
+import asyncio
+import math
+import time
+from collections import defaultdict
+from typing import Any, Sequence
+
+import uvicorn
+from fastapi import FastAPI, Request
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import BaseTool, StructuredTool
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+FAKE_TOOL_NAME = "fake_lookup"
+ANSWER_PREFIX = "Answer to"
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.2
+    # Every n-th question of a thread is answered after a tool call, 0 never.
+    tool_every: int = 2
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        questions = [m for m in messages if isinstance(m, HumanMessage)]
+        question = questions[-1].text() if questions else ""
+        if (
+            isinstance(messages[-1], HumanMessage)
+            and self.tool_every
+            and len(questions) % self.tool_every == 0
+        ):
+            message = AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": FAKE_TOOL_NAME,
+                        "args": {"query": question},
+                        "id": f"call_{self.calls}",
+                    }
+                ],
+            )
+        else:
+            message = AIMessage(content=f"{ANSWER_PREFIX} {question}")
+        message.response_metadata["model_name"] = "fake"
+        message.usage_metadata = {
+            "input_tokens": sum(len(m.text()) for m in messages) // 4,
+            "output_tokens": len(message.text()) // 4,
+            "total_tokens": 0,
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def fake_tool(latency: float = 0.1) -> BaseTool:
+    async def lookup(query: str) -> str:
+        await asyncio.sleep(latency)
+        return f"Results for {query}"
+
+    return StructuredTool.from_function(
+        coroutine=lookup, name=FAKE_TOOL_NAME, description="Looks things up"
+    )
+
+
+class FakeTelegramServer:
+    """
+    The Bot API methods the backend calls, served on a local port.
+
+    Point the bot at `base_url`. The messages sent to a chat are put on its
+    queue with the time they arrived.
+    """
+
+    def __init__(self, port: int):
+        self.port = port
+        self.calls: dict[str, int] = defaultdict(int)
+        self._chats: dict[int, asyncio.Queue[tuple[float, str]]] = defaultdict(
+            asyncio.Queue
+        )
+        app = FastAPI()
+        app.add_api_route("/bot{token}/{method}", self._handle, methods=["POST"])
+        self._server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+        )
+        self._task: asyncio.Task | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def chat(self, chat_id: int) -> asyncio.Queue[tuple[float, str]]:
+        return self._chats[chat_id]
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        self._server.should_exit = True
+        if self._task:
+            await self._task
+
+    async def _handle(self, method: str, request: Request) -> dict[str, Any]:
+        self.calls[method] += 1
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = await request.json()
+        else:
+            params = dict(await request.form())
+        if method == "getMe":
+            return {"ok": True, "result": bot_user()}
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self._chats[chat_id].put_nowait((time.perf_counter(), params["text"]))
+            return {
+                "ok": True,
+                "result": {
+                    "message_id": self.calls[method],
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": bot_user(),
+                    "text": params["text"],
+                },
+            }
+        return {"ok": True, "result": True}
+
+
+def bot_user() -> dict[str, Any]:
+    return {"id": 1, "is_bot": True, "first_name": "ragpile", "username": "ragpile"}
+
+
+def text_update(update_id: int, telegram_id: int, text: str) -> dict[str, Any]:
+    """The JSON of an update with a text message from a user."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "user"},
+            "text": text,
+        },
+    }
+
+
+class CallCounter:
+    """Counts the statements executed by an engine."""
+
+    def __init__(self, engine: AsyncEngine | Engine):
+        self.statements = 0
+        if isinstance(engine, AsyncEngine):
+            engine = engine.sync_engine
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *_args: Any) -> None:
+        self.statements += 1
+
+
+def percentile(values: list[float], p: float) -> float:
+    """The nearest-rank percentile, nan for no values."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
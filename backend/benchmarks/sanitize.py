@@ -0,0 +1,76 @@
+"""
+Times the HTML repair and the chunking of outgoing Telegram messages.
+
+Runs sanitize_html, remove_unclosed_tags, html_to_text and
+split_message_to_chunks on generated messages of each size: well formed
+HTML, HTML with unclosed and misnested tags, and text full of stray < and &.
+The chunks are split from the sanitized message. The time per KB stays flat
+as the size grows when the work is linear.
+
+Run from the backend directory:
+
+    python benchmarks/sanitize.py [--sizes 10000 100000 1000000] [--repeat 5]
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# pylint: disable-next=wrong-import-position
+from telegram_bot.application import (
+    html_to_text,
+    remove_unclosed_tags,
+    sanitize_html,
+    split_message_to_chunks,
+)
+
+SAMPLES = {
+    "clean": '<b>bold</b> text <i>it <code>x</code></i> <a href="https://x.y">link</a> ',
+    "broken": "<b>open <i>misnested</b></i> <ul><li>item</li></ul> unclosed <u>",
+    "stray": "if a < b && List<int> > c: x = &nbsp; &amp; <3 ",
+}
+
+FUNCTIONS: dict[str, Callable[[str], str]] = {
+    "sanitize_html": sanitize_html,
+    "remove_unclosed_tags": remove_unclosed_tags,
+    "html_to_text": html_to_text,
+    "split_message_to_chunks": lambda text: "".join(split_message_to_chunks(text)),
+}
+
+
+def message(sample: str, size: int) -> str:
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'function':<24} {'input':<8} {'size':>9} {'ms':>9} {'us/KB':>7}")
+    for name, function in FUNCTIONS.items():
+        for kind, sample in SAMPLES.items():
+            for size in args.sizes:
+                text = message(sample, size)
+                if name == "split_message_to_chunks":
+                    text = sanitize_html(text)
+                seconds = min(
+                    timeit.repeat(lambda: function(text), number=1, repeat=args.repeat)
+                )
+                print(
+                    f"{name:<24} {kind:<8} {size:>9} {seconds * 1000:>9.2f}"
+                    f" {seconds * 1e6 / (size / 1000):>7.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
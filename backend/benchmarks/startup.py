@@ -0,0 +1,122 @@
+"""
+Profiles the startup of the backend.
+
+Prints the import time of `app` grouped by top level package, using
+`python -X importtime`, and the time it takes uvicorn to answer its first
+request on /health.
+
+Run from the backend directory:
+
+    python benchmarks/startup.py [--skip-serve] [--top 15]
+"""
+
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+IMPORT_TIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _env() -> dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(SRC), env.get("PYTHONPATH", "")])
+    )
+    return env
+
+
+def import_times(module: str) -> tuple[float, dict[str, float]]:
+    """Returns the total import time of `module` and the time per top level package."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0.0
+    packages: dict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        # Self times add up to the total without counting nested imports twice.
+        packages[name.split(".")[0]] += int(self_us) / 1e6
+        if name == module and not indent.strip(" "):
+            total = int(cumulative_us) / 1e6
+    return total, dict(packages)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_request(timeout: float = 60.0) -> float:
+    """Starts uvicorn and returns the seconds until /health answers."""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=SRC,
+        env=_env(),
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {process.returncode}")
+            try:
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{port}/health", timeout=1
+                ):
+                    return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        raise TimeoutError(f"/health did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--skip-serve",
+        action="store_true",
+        help="only measure imports, the server needs the databases to start",
+    )
+    args = parser.parse_args()
+
+    total, packages = import_times(args.module)
+    print(f"import {args.module}: {total:.3f}s")
+    for package, seconds in sorted(packages.items(), key=lambda p: -p[1])[: args.top]:
+        print(f"  {package:<30} {seconds:.3f}s")
+
+    if not args.skip_serve:
+        print(f"time to first request: {time_to_first_request():.3f}s")
+
+
+if __name__ == "__main__":
+    main()
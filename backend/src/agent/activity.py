@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncContextManager, Callable
+from uuid import uuid4
+
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Thread, ThreadActivity
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 100
+
+
+@dataclass
+class _Activity:
+    thread_id: str
+    last_message_at: datetime
+
+
+class ThreadActivityTracker:
+    """
+    Tracks the current thread of each user.
+
+    A message only moves `last_message_at` forward, so it is kept in memory
+    and written every `flush_interval` seconds, in one statement for all users.
+    The database is written right away only when a thread is started. A thread
+    idle for longer than `idle_timeout` is over, the next message starts a new
+    one.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        idle_timeout: timedelta = timedelta(hours=2),
+        flush_interval: float = 30.0,
+    ):
+        self.session_factory = session_factory
+        self.idle_timeout = idle_timeout
+        self.flush_interval = flush_interval
+        self._activities: dict[str, _Activity] = {}
+        self._dirty: set[str] = set()
+        self._lock = asyncio.Lock()
+        self._stop = asyncio.Event()
+
+    async def current_thread_id(self, user_id: str, preview: str = "") -> str:
+        """`preview` is the start of the message, kept if it starts a thread."""
+        now = datetime.now(tz=timezone.utc)
+        activity = self._activities.get(user_id)
+        if activity is None or self._expired(activity, now):
+            async with self._lock:
+                activity = await self._load_or_start(user_id, now, preview)
+        activity.last_message_at = now
+        self._dirty.add(user_id)
+        return activity.thread_id
+
+    async def reset(self, user_id: str) -> None:
+        """Makes the next message of the user start a new thread."""
+        async with self._lock:
+            self._activities.pop(user_id, None)
+            self._dirty.discard(user_id)
+            async with self.session_factory() as session:
+                await session.execute(
+                    delete(ThreadActivity).where(ThreadActivity.user_id == user_id)
+                )
+
+    async def flush(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        rows = [
+            {
+                "user_id": user_id,
+                "last_message_at": self._activities[user_id].last_message_at,
+            }
+            for user_id in dirty
+            if user_id in self._activities
+        ]
+        if rows:
+            try:
+                async with self.session_factory() as session:
+                    await session.execute(update(ThreadActivity), rows)
+            except Exception:
+                self._dirty |= dirty
+                raise
+        now = datetime.now(tz=timezone.utc)
+        for user_id, activity in list(self._activities.items()):
+            if user_id not in self._dirty and self._expired(activity, now):
+                del self._activities[user_id]
+
+    async def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Could not flush the thread activity")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _expired(self, activity: _Activity, now: datetime) -> bool:
+        return activity.last_message_at < now - self.idle_timeout
+
+    async def _load_or_start(
+        self, user_id: str, now: datetime, preview: str
+    ) -> _Activity:
+        activity = self._activities.get(user_id)
+        if activity is not None and not self._expired(activity, now):
+            return activity
+        async with self.session_factory() as session:
+            if activity is None:
+                row = await session.get(ThreadActivity, user_id)
+                if row is not None:
+                    activity = _Activity(row.thread_id, row.last_message_at)
+            if activity is None or self._expired(activity, now):
+                activity = _Activity(uuid4().hex, now)
+                session.add(
+                    Thread(
+                        id=activity.thread_id,
+                        user_id=user_id,
+                        created_at=datetime.now(),
+                        preview=preview[:PREVIEW_LENGTH] or None,
+                    )
+                )
+                await session.merge(
+                    ThreadActivity(
+                        user_id=user_id,
+                        thread_id=activity.thread_id,
+                        last_message_at=now,
+                    )
+                )
+        self._activities[user_id] = activity
+        return activity
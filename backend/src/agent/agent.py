@@ -1,12 +1,58 @@
-from datetime import datetime, timedelta, timezone
-from typing import AsyncContextManager, Callable
-from uuid import uuid4
-from langchain_core.messages import BaseMessage
+import asyncio
+import logging
+import time
+from typing import AsyncContextManager, Awaitable, Callable
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph.state import CompiledStateGraph
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from message_queue import MessageQueue, MessageWithUserId
-from models import Thread, User
+from agent.activity import ThreadActivityTracker
+from memory.retrieval import MemoryContext, MemoryRetriever
+from message_queue import TELEGRAM_CHANNEL, MessageQueue, MessageWithUserId
+from metrics import Counter, Histogram
+from models import User
+from tracing import current_span_context, get_tracer
+
+logger = logging.getLogger(__name__)
+
+MEMORY_RETRIEVAL_TIMEOUT = 2.0
+
+TURNS = Counter("ragpile_agent_turns", "Agent turns", ["status"])
+TURN_DURATION = Histogram(
+    "ragpile_agent_turn_duration_seconds",
+    "Duration of agent turns, from the message to the last response",
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+
+
+def last_human_text(messages: list[BaseMessage]) -> str:
+    return next(
+        (m.text() for m in reversed(messages) if isinstance(m, HumanMessage)), ""
+    )
+
+
+async def retrieve_memory(
+    retriever: MemoryRetriever, group_id: str, messages: list[BaseMessage]
+) -> MemoryContext | None:
+    query = last_human_text(messages)
+    if not query:
+        return None
+    try:
+        return await asyncio.wait_for(
+            retriever.retrieve(group_id=group_id, query=query),
+            MEMORY_RETRIEVAL_TIMEOUT,
+        )
+    except TimeoutError:
+        logger.warning(
+            "Memory retrieval took longer than %.1fs, answering without it",
+            MEMORY_RETRIEVAL_TIMEOUT,
+        )
+        return None
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Memory retrieval failed, answering without it")
+        return None
 
 
 class Agent:
@@ -15,47 +61,134 @@ class Agent:
         graph: CompiledStateGraph,
         session_factory: Callable[[], AsyncContextManager[AsyncSession]],
         queue: MessageQueue,
+        retriever: MemoryRetriever | None = None,
+        activity: ThreadActivityTracker | None = None,
     ) -> None:
         self.session_factory = session_factory
+        self.activity = activity or ThreadActivityTracker(session_factory)
         self.graph = graph
         self.queue = queue
+        self.retriever = retriever
+
+    async def get_current_thread_id(self, user: User, preview: str = "") -> str:
+        return await self.activity.current_thread_id(user.id, preview)
 
-    async def get_current_thread_id(self, user: User) -> str:
-        async with self.session_factory() as session:
-            thread_id = user.integrations["telegram"].get("thread_id")
-            last_message_at = user.integrations["telegram"].get("last_message_at")
-            if (
-                not thread_id
-                or not last_message_at
-                or (
-                    datetime.fromisoformat(last_message_at)
-                    < datetime.now(tz=timezone.utc) - timedelta(hours=2)
+    async def send_message(
+        self,
+        messages: list[BaseMessage],
+        user: User,
+        thread_id: str | None = None,
+        channel: str = TELEGRAM_CHANNEL,
+        on_token: Callable[[str], Awaitable[None]] | None = None,
+    ) -> None:
+        """
+        Runs a turn and publishes its messages on the queue.
+
+        The turn continues the current thread of the user unless `thread_id` is
+        given. `channel` tells the consumers of the queue where the turn came
+        from. `on_token` receives the text of the answers as it is generated.
+        """
+        start = time.perf_counter()
+        status = "error"
+        try:
+            await self._send_message(messages, user, thread_id, channel, on_token)
+            status = "ok"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            TURN_DURATION.observe(time.perf_counter() - start)
+            TURNS.inc(status=status)
+
+    async def _send_message(
+        self,
+        messages: list[BaseMessage],
+        user: User,
+        thread_id: str | None,
+        channel: str,
+        on_token: Callable[[str], Awaitable[None]] | None,
+    ) -> None:
+        tracer = get_tracer()
+        # The memory lookup only needs the new messages, so it runs while the
+        # thread is looked up and its checkpoint is loaded. The completions of
+        # the turn await it through the config.
+        memory = (
+            asyncio.create_task(retrieve_memory(self.retriever, user.id, messages))
+            if self.retriever
+            else None
+        )
+        try:
+            with tracer.span("agent.turn", user_id=user.id) as turn:
+                if thread_id is None:
+                    with tracer.span("thread.lookup"):
+                        thread_id = await self.get_current_thread_id(
+                            user, last_human_text(messages)
+                        )
+                turn.set_attribute("thread_id", thread_id)
+                config = RunnableConfig(
+                    configurable={
+                        "thread_id": thread_id,
+                        "user_id": user.id,
+                        "memory": memory,
+                    }
                 )
-            ):
-                thread_id = uuid4().hex
-                session.add(
-                    Thread(
-                        id=thread_id,
-                        user_id=user.id,
-                        created_at=datetime.now(),
+                try:
+                    # Token streaming makes the model stream its answers, so
+                    # it is only asked for when someone listens.
+                    async for mode, event in self.graph.astream(
+                        {"messages": messages},
+                        config,
+                        stream_mode=(
+                            ["updates", "messages"] if on_token else ["updates"]
+                        ),
+                    ):
+                        if mode == "messages":
+                            token, metadata = event
+                            if (
+                                on_token
+                                and metadata.get("langgraph_node") == "completion"
+                                and token.text()
+                            ):
+                                await on_token(token.text())
+                            continue
+                        # The tool node answers all tool calls of a
+                        # completion in one update, each is published.
+                        for value in event.values():
+                            for message in value["messages"]:
+                                await self.queue.put(
+                                    MessageWithUserId(
+                                        user_id=user.id,
+                                        message=message,
+                                        trace_context=current_span_context(),
+                                        thread_id=thread_id,
+                                        channel=channel,
+                                    )
+                                )
+                except asyncio.CancelledError:
+                    await self._answer_pending_tool_calls(config)
+                    raise
+        finally:
+            if memory:
+                memory.cancel()
+
+    async def _answer_pending_tool_calls(self, config: RunnableConfig) -> None:
+        # A turn cancelled while its tools ran leaves tool calls without results
+        # in the thread, which the model refuses in the next turn.
+        snapshot = await self.graph.aget_state(config)
+        messages = snapshot.values.get("messages", [])
+        if not messages or not isinstance(messages[-1], AIMessage):
+            return
+        if not messages[-1].tool_calls:
+            return
+        await self.graph.aupdate_state(
+            config,
+            {
+                "messages": [
+                    ToolMessage(
+                        content="Cancelled by the user", tool_call_id=call["id"]
                     )
-                )
-                user.integrations["telegram"]["thread_id"] = thread_id
-            user.integrations["telegram"]["last_message_at"] = datetime.now(
-                tz=timezone.utc
-            ).isoformat()
-
-            await session.execute(User.update_integrations(user))
-        return thread_id
-
-    async def send_message(self, messages: list[BaseMessage], user: User) -> None:
-        thread_id = await self.get_current_thread_id(user)
-        async for event in self.graph.astream(
-            {"messages": messages},
-            {"configurable": {"thread_id": thread_id, "user_id": user.id}},
-        ):
-            for value in event.values():
-                message = value["messages"][-1]
-                await self.queue.put(
-                    MessageWithUserId(user_id=user.id, message=message)
-                )
+                    for call in messages[-1].tool_calls
+                ]
+            },
+            as_node="tools",
+        )
@@ -0,0 +1,173 @@
+import dataclasses
+import json
+import logging
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, Callable
+from uuid import uuid4
+
+from tools.tool_results import ToolResultStore
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class CompactionPolicy:
+    budget_tokens: int = 4000
+    max_field_chars: int = 4000
+    drop_fields: tuple[str, ...] = ()
+
+
+@dataclass
+class OmittedResults:
+    count: int
+    ref: str
+
+
+DEFAULT_POLICIES = {
+    "browse_website": CompactionPolicy(budget_tokens=4000, max_field_chars=12000),
+    "gmail_read_unread": CompactionPolicy(
+        budget_tokens=6000,
+        max_field_chars=1000,
+        drop_fields=("thread_id", "recipient", "labels"),
+    ),
+    "reddit_search": CompactionPolicy(budget_tokens=3000, max_field_chars=500),
+    "reddit_details": CompactionPolicy(budget_tokens=3000, max_field_chars=1000),
+    "google_maps_places_search": CompactionPolicy(
+        budget_tokens=2000, drop_fields=("review_summary",)
+    ),
+    "calendar_list_events": CompactionPolicy(
+        budget_tokens=4000, max_field_chars=500, drop_fields=("created", "updated")
+    ),
+    "tool_result_fetch": CompactionPolicy(budget_tokens=3000, max_field_chars=12000),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def to_content(output: Any) -> str:
+    if isinstance(output, str):
+        return output
+    try:
+        return json.dumps(output, ensure_ascii=False)
+    except TypeError:
+        return str(output)
+
+
+@cache
+def _reduced_dataclass(cls: type, drop_fields: tuple[str, ...]) -> type:
+    # Keeps the class name, so the repr stays parseable by the frontend.
+    return dataclasses.make_dataclass(
+        cls.__name__,
+        [
+            (field.name, field.type)
+            for field in dataclasses.fields(cls)
+            if field.name not in drop_fields
+        ],
+    )
+
+
+def compact_value(
+    value: Any, policy: CompactionPolicy, stash: Callable[[str], str]
+) -> Any:
+    if isinstance(value, str):
+        if len(value) <= policy.max_field_chars:
+            return value
+        ref = stash(value)
+        return (
+            f"{value[: policy.max_field_chars]}... "
+            f"[truncated {len(value) - policy.max_field_chars} chars, ref={ref}]"
+        )
+    if isinstance(value, list):
+        return [compact_value(item, policy, stash) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: compact_value(item, policy, stash)
+            for key, item in value.items()
+            if key not in policy.drop_fields
+        }
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        dropped = tuple(
+            field.name
+            for field in dataclasses.fields(value)
+            if field.name in policy.drop_fields
+        )
+        cls = _reduced_dataclass(type(value), dropped) if dropped else type(value)
+        return cls(
+            **{
+                field.name: compact_value(getattr(value, field.name), policy, stash)
+                for field in dataclasses.fields(cls)
+            }
+        )
+    return value
+
+
+class ToolResultCompactor:
+    """
+    Shrinks tool results before they become ToolMessages.
+
+    Long strings are truncated, unneeded fields are dropped and lists are cut to fit
+    the per-tool token budget. Everything that is cut is saved in the ToolResultStore
+    and referenced in the content, so the tool_result_fetch tool can read it back.
+    """
+
+    def __init__(
+        self,
+        store: ToolResultStore,
+        policies: dict[str, CompactionPolicy] | None = None,
+        default_policy: CompactionPolicy = CompactionPolicy(),
+    ) -> None:
+        self.store = store
+        self.policies = DEFAULT_POLICIES if policies is None else policies
+        self.default_policy = default_policy
+
+    async def compact(self, tool_name: str, output: Any, user_id: str) -> str:
+        policy = self.policies.get(tool_name, self.default_policy)
+        stashed: dict[str, str] = {}
+
+        def stash(text: str) -> str:
+            ref = uuid4().hex
+            stashed[ref] = text
+            return ref
+
+        content = self._fit(compact_value(output, policy, stash), policy, stash)
+        try:
+            await self.store.save_many(user_id, tool_name, stashed)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # The truncated result is still useful, only its refs cannot be read.
+            logger.exception("Failed to store the full result of %s", tool_name)
+        return content
+
+    def _fit(
+        self, value: Any, policy: CompactionPolicy, stash: Callable[[str], str]
+    ) -> str:
+        content = to_content(value)
+        if estimate_tokens(content) <= policy.budget_tokens:
+            return content
+
+        if isinstance(value, list) and len(value) > 1:
+            budget_chars = policy.budget_tokens * CHARS_PER_TOKEN
+            kept: list[Any] = []
+            used = 0
+            for item in value:
+                item_chars = len(to_content(item)) + 2
+                if kept and used + item_chars > budget_chars:
+                    break
+                kept.append(item)
+                used += item_chars
+            omitted = value[len(kept) :]
+            if omitted:
+                ref = stash(to_content(omitted))
+                content = to_content(kept + [OmittedResults(len(omitted), ref)])
+                if estimate_tokens(content) <= policy.budget_tokens:
+                    return content
+
+        return compact_value(
+            content,
+            CompactionPolicy(max_field_chars=policy.budget_tokens * CHARS_PER_TOKEN),
+            stash,
+        )
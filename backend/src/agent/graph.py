@@ -1,26 +1,32 @@
+import time
 from datetime import datetime
-from typing import Annotated, AsyncContextManager, Callable
+from typing import Annotated, AsyncContextManager, Awaitable, Callable
 
 from apscheduler.schedulers.base import BaseScheduler
 from asyncpraw import Reddit
-from graphiti_core import Graphiti
 from langchain_core.language_models.base import LanguageModelInput
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import AIMessage, BaseMessage
 from langchain_core.messages.system import SystemMessage
-from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 from langchain_core.tools.base import BaseTool
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.graph.state import CompiledStateGraph
-from langgraph.prebuilt import ToolNode
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing_extensions import TypedDict
 
 from agent.agent import Agent
+from agent.compaction import ToolResultCompactor
+from agent.tool_node import ParallelToolNode
+from memory.retrieval import MemoryContext, MemoryRetriever
+from memory.runtime import GraphitiRuntime
 from message_queue import MessageQueue
+from metrics import Counter, Histogram
+from tools.tool_results import ToolResultStore
 from tools.toolkit import ToolDependencies, Toolkit
+from tracing import Span, get_tracer
 
 
 class State(TypedDict):
@@ -39,19 +45,86 @@ In the background, there are scheduled jobs running that may send messages in th
 """
 
 
+LLM_LATENCY = Histogram(
+    "ragpile_llm_latency_seconds", "Latency of chat completions", ["model"]
+)
+LLM_TOKENS = Counter("ragpile_llm_tokens", "Tokens used", ["model", "type"])
+
+TOOL_CONCURRENCY = {
+    "browse_website": 4,
+    "reddit_search": 2,
+    "reddit_details": 4,
+    "google_search": 4,
+    "graphiti_add_episode": 1,
+    "scheduler_create": 1,
+}
+
+
 def get_system_message() -> SystemMessage:
     return SystemMessage(DEFAULT_SYSTEM_PROMPT.format(now=datetime.now().isoformat()))
 
 
+def record_usage(span: Span, response: AIMessage) -> None:
+    span.set_attributes(
+        {
+            "gen_ai.response.model": response.response_metadata.get("model_name"),
+            "gen_ai.response.tool_calls": len(response.tool_calls),
+        }
+    )
+    usage = response.usage_metadata
+    if not usage:
+        return
+    model = response.response_metadata.get("model_name", "unknown")
+    LLM_TOKENS.inc(usage["input_tokens"], model=model, type="input")
+    LLM_TOKENS.inc(usage["output_tokens"], model=model, type="output")
+    cache_read = usage.get("input_token_details", {}).get("cache_read")
+    if cache_read:
+        LLM_TOKENS.inc(cache_read, model=model, type="cache_read")
+    span.set_attributes(
+        {
+            "gen_ai.usage.input_tokens": usage["input_tokens"],
+            "gen_ai.usage.output_tokens": usage["output_tokens"],
+            "gen_ai.usage.cache_read_tokens": cache_read,
+        }
+    )
+
+
 def completion(
     llm: Runnable[LanguageModelInput, BaseMessage],
-) -> Callable[[State], State]:
-    def _completion(state: State) -> State:
+) -> Callable[[State, RunnableConfig], Awaitable[State]]:
+    async def _completion(state: State, config: RunnableConfig) -> State:
         last_message = state["messages"][-1]
         if last_message.type == "ai":
             return state
-        system_prompt = get_system_message()
-        response = llm.invoke([system_prompt] + state["messages"])
+        # Started by the Agent when the turn began, see Agent._send_message.
+        memory_task: Awaitable[MemoryContext | None] | None = config.get(
+            "configurable", {}
+        ).get("memory")
+        messages: list[BaseMessage] = [get_system_message()] + state["messages"]
+        with get_tracer().span("llm.completion", messages=len(messages)) as span:
+            memory = await memory_task if memory_task else None
+            if memory and memory.facts:
+                messages.insert(1, SystemMessage(memory.to_prompt()))
+            start = time.perf_counter()
+            response = await llm.ainvoke(messages, config)
+            LLM_LATENCY.observe(
+                time.perf_counter() - start,
+                model=response.response_metadata.get("model_name", "unknown"),
+            )
+            if memory:
+                response.response_metadata["memory_retrieval_ms"] = round(
+                    memory.latency * 1000
+                )
+                response.response_metadata["memory_cache_hit"] = memory.cached
+                span.set_attributes(
+                    {
+                        "memory.facts": len(memory.facts),
+                        "memory.retrieval_ms": round(memory.latency * 1000),
+                        "memory.cache_hit": memory.cached,
+                    }
+                )
+            if isinstance(response, AIMessage):
+                record_usage(span, response)
         return {"messages": [response]}
 
     return _completion
@@ -66,7 +139,6 @@ def should_continue(state: State) -> str:
 
 
 def create_tools(
-    graphiti: Graphiti,
     session_factory: Callable[[], AsyncContextManager[AsyncSession]],
     client_id: str,
     client_secret: str,
@@ -82,7 +154,6 @@ def create_tools(
         google_search_api_key=google_search_api_key,
         google_search_engine_id=google_search_engine_id,
         scheduler=scheduler,
-        graphiti=graphiti,
         reddit_client=reddit_client,
     )
 
@@ -96,11 +167,17 @@ def create_agent(
     tools: list[BaseTool],
     session_factory: Callable[[], AsyncContextManager[AsyncSession]],
     queue: MessageQueue,
+    graphiti_runtime: GraphitiRuntime | None = None,
 ) -> Agent:
 
     llm_with_tools = llm.bind_tools(tools)
 
-    tool_node = ToolNode(tools)
+    tool_node = ParallelToolNode(
+        tools,
+        tool_concurrency=TOOL_CONCURRENCY,
+        compactor=ToolResultCompactor(ToolResultStore(session_factory)),
+        events=queue,
+    )
 
     graph_builder = StateGraph(State)
     graph_builder.add_node("completion", RunnableLambda(completion(llm_with_tools)))
@@ -109,4 +186,5 @@ def create_agent(
     graph_builder.add_conditional_edges("completion", should_continue)
     graph_builder.add_edge("tools", "completion")
     graph = graph_builder.compile(checkpointer)
-    return Agent(graph, session_factory, queue)
+    retriever = MemoryRetriever(graphiti_runtime) if graphiti_runtime else None
+    return Agent(graph, session_factory, queue, retriever)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+from langchain_core.messages import HumanMessage
+
+from agent.agent import Agent
+from metrics import Counter
+from models import User
+from tracing import SpanContext, current_span_context, get_tracer
+
+logger = logging.getLogger(__name__)
+
+INBOX_COALESCED = Counter(
+    "ragpile_inbox_coalesced", "Messages merged into the turn of an earlier message"
+)
+INBOX_CANCELLED = Counter("ragpile_inbox_cancelled", "Turns cancelled by the user")
+
+
+@dataclass
+class _Mailbox:
+    user: User
+    pending: list[str] = field(default_factory=list)
+    trace_context: SpanContext | None = None
+    arrived: asyncio.Event = field(default_factory=asyncio.Event)
+    turn: asyncio.Task | None = None
+
+
+class UserInbox:
+    """
+    Runs the turns of each user one at a time.
+
+    Messages that arrive within `debounce` seconds of each other, or while a
+    turn is running, are sent to the agent together as one message, so a user
+    typing several short messages costs one turn instead of several racing on
+    the same thread. A turn waits at most `max_delay` seconds for more messages.
+    """
+
+    def __init__(self, agent: Agent, debounce: float = 0.5, max_delay: float = 3.0):
+        self.agent = agent
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._mailboxes: dict[str, _Mailbox] = {}
+        self._workers: set[asyncio.Task] = set()
+
+    def submit(self, user: User, text: str) -> None:
+        mailbox = self._mailboxes.get(user.id)
+        if mailbox is None:
+            mailbox = self._mailboxes[user.id] = _Mailbox(user)
+            worker = asyncio.create_task(self._drain(mailbox))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        mailbox.user = user
+        mailbox.pending.append(text)
+        mailbox.trace_context = current_span_context()
+        mailbox.arrived.set()
+
+    def cancel(self, user_id: str) -> bool:
+        """Drops the waiting messages and cancels the running turn, if any."""
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is None:
+            return False
+        mailbox.pending.clear()
+        if mailbox.turn:
+            mailbox.turn.cancel()
+            INBOX_CANCELLED.inc()
+        return True
+
+    async def close(self) -> None:
+        for user_id in list(self._mailboxes):
+            self.cancel(user_id)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _drain(self, mailbox: _Mailbox) -> None:
+        try:
+            while True:
+                await self._settle(mailbox)
+                if not mailbox.pending:
+                    return
+                texts, mailbox.pending = mailbox.pending, []
+                INBOX_COALESCED.inc(len(texts) - 1)
+                with get_tracer().span(
+                    "inbox.turn", parent=mailbox.trace_context, messages=len(texts)
+                ):
+                    mailbox.turn = asyncio.create_task(
+                        self.agent.send_message(
+                            [HumanMessage(content="\n\n".join(texts))], mailbox.user
+                        )
+                    )
+                    # Waiting instead of awaiting, so cancelling the turn does
+                    # not cancel this loop.
+                    await asyncio.wait([mailbox.turn])
+                turn, mailbox.turn = mailbox.turn, None
+                if not turn.cancelled() and turn.exception():
+                    logger.error(
+                        "Turn of %s failed",
+                        mailbox.user.id,
+                        exc_info=turn.exception(),
+                    )
+        finally:
+            del self._mailboxes[mailbox.user.id]
+
+    async def _settle(self, mailbox: _Mailbox) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while True:
+            mailbox.arrived.clear()
+            timeout = min(self.debounce, deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                await asyncio.wait_for(mailbox.arrived.wait(), timeout)
+            except TimeoutError:
+                return
@@ -1,7 +1,13 @@
+from typing import Any, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from psycopg import AsyncConnection
 from psycopg.rows import dict_row
 
+from tracing import get_tracer
+
 
 class LazyAsyncPostgresSaver(AsyncPostgresSaver):
     def __init__(self, conn_string: str):
@@ -15,3 +21,23 @@ class LazyAsyncPostgresSaver(AsyncPostgresSaver):
 
     async def close(self) -> None:
         await self.conn.close()
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with get_tracer().span("checkpoint.write", step=metadata.get("step")):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        with get_tracer().span("checkpoint.write_pending", writes=len(writes)):
+            await super().aput_writes(config, writes, task_id, task_path)
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Sequence
+
+from langchain_core.messages import AIMessage, ToolCall, ToolMessage
+from langchain_core.runnables.config import RunnableConfig
+from langchain_core.tools.base import BaseTool
+from langgraph.errors import GraphBubbleUp
+
+from agent.compaction import ToolResultCompactor, to_content
+from message_queue import AgentEvent, MessageQueue
+from tracing import current_span_context, get_tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ParallelToolNode:
+    """
+    Runs all the tool calls of the last AIMessage concurrently.
+
+    Every call is bounded by a per-tool semaphore, a per-user semaphore and a timeout.
+    A failing or timed out call produces an error ToolMessage, the rest of the calls
+    still return their results. When a compactor is given, the raw tool outputs are
+    compacted before they are turned into ToolMessages. When an event queue is
+    given, the start and the end of every call are published on it.
+    """
+
+    def __init__(
+        self,
+        tools: Sequence[BaseTool],
+        tool_concurrency: dict[str, int] | None = None,
+        default_tool_concurrency: int = 4,
+        user_concurrency: int = 8,
+        timeout: float = 60.0,
+        compactor: ToolResultCompactor | None = None,
+        events: MessageQueue | None = None,
+    ) -> None:
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.tool_concurrency = tool_concurrency or {}
+        self.default_tool_concurrency = default_tool_concurrency
+        self.user_concurrency = user_concurrency
+        self.timeout = timeout
+        self.compactor = compactor
+        self.events = events
+        self._tool_semaphores: dict[str, asyncio.Semaphore] = {}
+        # The semaphore of a user and the number of calls holding or waiting
+        # for it. Entries are dropped when the last call finishes.
+        self._user_semaphores: dict[str, tuple[asyncio.Semaphore, int]] = {}
+
+    def _tool_semaphore(self, name: str) -> asyncio.Semaphore:
+        if name not in self._tool_semaphores:
+            self._tool_semaphores[name] = asyncio.Semaphore(
+                self.tool_concurrency.get(name, self.default_tool_concurrency)
+            )
+        return self._tool_semaphores[name]
+
+    @asynccontextmanager
+    async def _user_slot(self, user_id: str) -> AsyncIterator[None]:
+        semaphore, calls = self._user_semaphores.get(user_id, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.user_concurrency)
+        self._user_semaphores[user_id] = (semaphore, calls + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, calls = self._user_semaphores[user_id]
+            if calls == 1:
+                del self._user_semaphores[user_id]
+            else:
+                self._user_semaphores[user_id] = (semaphore, calls - 1)
+
+    async def __call__(
+        self, state: dict[str, Any], config: RunnableConfig
+    ) -> dict[str, list[ToolMessage]]:
+        last_message = state["messages"][-1]
+        if not isinstance(last_message, AIMessage):
+            return {"messages": []}
+        user_id = str(config.get("configurable", {}).get("user_id", ""))
+        outputs = await asyncio.gather(
+            *(self._run_one(call, user_id, config) for call in last_message.tool_calls)
+        )
+        return {"messages": list(outputs)}
+
+    async def _run_one(
+        self, call: ToolCall, user_id: str, config: RunnableConfig
+    ) -> ToolMessage:
+        with get_tracer().span("tool.call", tool=call["name"]) as span:
+            event = {
+                "thread_id": config.get("configurable", {}).get("thread_id"),
+                "tool": call["name"],
+                "tool_call_id": call["id"],
+            }
+            await self._publish(user_id, "tool.start", event)
+            message = await self._call_tool(call, user_id, config)
+            await self._publish(
+                user_id, "tool.end", {**event, "status": message.status}
+            )
+            span.set_attribute("tool.content_chars", len(str(message.content)))
+            if message.status == "error":
+                span.set_error(str(message.content))
+            return message
+
+    async def _publish(self, user_id: str, type_: str, data: dict[str, Any]) -> None:
+        if self.events:
+            await self.events.put(
+                AgentEvent(user_id, type_, data, current_span_context())
+            )
+
+    async def _call_tool(
+        self, call: ToolCall, user_id: str, config: RunnableConfig
+    ) -> ToolMessage:
+        tool = self.tools_by_name.get(call["name"])
+        if tool is None:
+            return ToolMessage(
+                content=f"Error: {call['name']} is not a valid tool, "
+                f"try one of [{', '.join(self.tools_by_name)}].",
+                name=call["name"],
+                tool_call_id=call["id"],
+                status="error",
+            )
+
+        try:
+            async with self._user_slot(user_id), self._tool_semaphore(tool.name):
+                async with asyncio.timeout(self.timeout):
+                    output = await tool.ainvoke(call["args"], config)
+                if self.compactor:
+                    content = await self.compactor.compact(tool.name, output, user_id)
+                else:
+                    content = to_content(output)
+        except GraphBubbleUp:
+            raise
+        except TimeoutError:
+            logger.warning("Tool %s timed out after %ss", tool.name, self.timeout)
+            return ToolMessage(
+                content=f"Error: {tool.name} timed out after {self.timeout} seconds.",
+                name=tool.name,
+                tool_call_id=call["id"],
+                status="error",
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.exception("Tool %s failed", tool.name)
+            return ToolMessage(
+                content=f"Error: {e!r}",
+                name=tool.name,
+                tool_call_id=call["id"],
+                status="error",
+            )
+
+        return ToolMessage(content=content, name=tool.name, tool_call_id=call["id"])
@@ -1,117 +1,226 @@
 import asyncio
+import functools
 import logging
 import os
-import threading
 from contextlib import asynccontextmanager
-from typing import Annotated, Optional
+from typing import TYPE_CHECKING, Annotated, AsyncContextManager, Callable, Optional
 
-import debugpy  # type: ignore
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from dependencies import (
-    CHECKPOINTER,
-    ENGINE,
-    MESSAGE_QUEUE,
-    TELEGRAM_APPLICATION_TOKEN,
-    create_engine,
-    create_session_factory,
+    configure_langchain_debug,
+    get_agent,
+    get_checkpointer,
+    get_engine,
+    get_graphiti_runtime,
+    get_message_queue,
     get_scheduler,
     get_session,
-    new_checkpointer,
-    new_agent,
-    new_graphiti,
-    new_tools,
+    get_session_factory,
+    get_telegram_application_token,
+    get_tools,
 )
+from leader import LeaderElection, advisory_lock
 from log import init_logger
+from metrics import REGISTRY
 from models import User
 from routers.auth import auth_router
+from routers.events import events_router
 from routers.openai_wrapper import openai_router
 from routers.schedules import schedules_router
 from routers.threads import threads_router
-from telegram_bot.application import new_telegram_application
+from tracing import configure_tracing
+
+if TYPE_CHECKING:
+    from apscheduler.schedulers.base import BaseScheduler  # type: ignore
+    from telegram.ext import Updater
+
+    from memory.ingestion import EpisodeIngestionWorker
+    from memory.runtime import GraphitiRuntime
 
 init_logger()
 logger = logging.getLogger(__name__)
 
 
-def run_telegram_application(stop_event: threading.Event):
-    async def _run() -> None:
-        graphiti = new_graphiti()
-        await graphiti.build_indices_and_constraints()
-        session_factory = asynccontextmanager(create_session_factory(create_engine()))
-        checkpointer = new_checkpointer()
-        await checkpointer.connect()
-        telegram_application = new_telegram_application(
-            TELEGRAM_APPLICATION_TOKEN,
-            session_factory,
-            new_agent(
-                checkpointer=checkpointer,
-                tools=new_tools(graphiti=graphiti, session_factory=session_factory),
-                session_factory=session_factory,
-                queue=MESSAGE_QUEUE,
-            ),
-            MESSAGE_QUEUE,
-        )
-        application = telegram_application.application
+# Jobs added or changed by other replicas are only seen when the scheduler of
+# the leader wakes up.
+SCHEDULER_WAKEUP_INTERVAL = 30.0
+
+
+class LeaderDuties:
+    """
+    The work only the leader replica does: polling Telegram, running scheduled
+    jobs and ingesting memory.
+
+    The scheduler of the other replicas is started paused, so their API can
+    still add and change jobs without running them.
+    """
+
+    def __init__(
+        self,
+        updater: "Updater",
+        scheduler: "BaseScheduler",
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        graphiti_runtime: "GraphitiRuntime",
+    ):
+        self.updater = updater
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.graphiti_runtime = graphiti_runtime
+        self._ingestion_worker: "EpisodeIngestionWorker | None" = None
+        # Stopped by the worker itself, so it can finish the episode at hand.
+        self._ingestion_task: asyncio.Task | None = None
+        # Cancelled on stop.
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        # pylint: disable-next=import-outside-toplevel
+        from memory.ingestion import EpisodeIngestionWorker
 
-        await application.initialize()
-        assert application.updater is not None
-        await application.updater.start_polling(poll_interval=10.0, timeout=30)
-        await application.start()
+        await self.updater.start_polling(poll_interval=10.0, timeout=30)
+        self.scheduler.resume()
+        self._ingestion_worker = EpisodeIngestionWorker(
+            self.session_factory, self.graphiti_runtime
+        )
+        self._ingestion_task = asyncio.create_task(self._ingestion_worker.run())
+        self._tasks = [asyncio.create_task(self._wake_scheduler())]
 
-        while not stop_event.is_set():
-            await telegram_application.send_pending_messages()
-        await application.updater.stop()
-        await application.stop()
-        await application.shutdown()
-        await checkpointer.close()
-        await graphiti.close()
+    async def stop(self) -> None:
+        if self.updater.running:
+            await self.updater.stop()
+        self.scheduler.pause()
+        if self._ingestion_worker:
+            self._ingestion_worker.stop()
+        for task in self._tasks:
+            task.cancel()
+        tasks = self._tasks + ([self._ingestion_task] if self._ingestion_task else [])
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._ingestion_task = None
+        self._tasks = []
 
-    loop = asyncio.new_event_loop()
-    loop.run_until_complete(_run())
+    async def _wake_scheduler(self) -> None:
+        while True:
+            await asyncio.sleep(SCHEDULER_WAKEUP_INTERVAL)
+            self.scheduler.wakeup()
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    # The API, the telegram bot, the scheduler and the memory ingestion share
+    # this event loop and one set of pooled resources: the engine, the
+    # checkpointer, the tools and the agent. Blocking job code runs on the job
+    # executor. The bot and the agent are only needed from here on, so their
+    # imports are kept out of the import of the app.
+    # pylint: disable=import-outside-toplevel
+    from langchain.chat_models import init_chat_model
+
+    from telegram_bot.application import new_telegram_application
+    from tools.scheduler import JOB_EXECUTOR, JobDependencies, set_job_dependencies
+    from tools.toolkit import close_tools
+
+    configure_langchain_debug()
+    tracer = configure_tracing()
+    checkpointer = get_checkpointer()
     logger.info("Starting up checkpointer")
-    await CHECKPOINTER.connect()
-    await CHECKPOINTER.setup()
-    logger.info("Starting up telegram application")
-    stop_event = threading.Event()
-    telegram_thread = threading.Thread(
-        target=run_telegram_application, args=(stop_event,)
-    )
-    telegram_thread.start()
+    await checkpointer.connect()
+    await checkpointer.setup()
     if os.environ.get("ENABLE_DEBUGPY") == "1":
+        import debugpy  # type: ignore
+
         debug_port = 5678
         print(f"Debugger listening on port {debug_port} ...")
         debugpy.listen(("0.0.0.0", debug_port))
+
+    session_factory = get_session_factory()
+    message_queue = get_message_queue()
+    graphiti_runtime = get_graphiti_runtime()
+    tools = get_tools()
+    agent = get_agent()
+    bootstrap_task = asyncio.create_task(graphiti_runtime.bootstrap())
+    activity_task = asyncio.create_task(agent.activity.run())
+
+    logger.info("Starting up telegram application")
+    telegram_application = new_telegram_application(
+        get_telegram_application_token(), session_factory, agent, message_queue
+    )
+    application = telegram_application.application
+    await application.initialize()
+    assert application.updater is not None
+    await application.start()
+    # Every replica sends the messages of the turns and jobs it runs.
+    sender_task = asyncio.create_task(telegram_application.send_pending_messages())
+
     logger.info("Starting up scheduler")
     scheduler = get_scheduler()
-    scheduler.start()
+    set_job_dependencies(
+        JobDependencies(
+            tools=tools,
+            agent=agent,
+            llm=init_chat_model("gpt-4.1"),
+            session_factory=session_factory,
+            scheduler=scheduler,
+            job_lock=functools.partial(advisory_lock, get_engine()),
+            events=message_queue,
+        )
+    )
+    scheduler.start(paused=True)
+
+    duties = LeaderDuties(
+        application.updater, scheduler, session_factory, graphiti_runtime
+    )
+    election = LeaderElection(get_engine(), duties.start, duties.stop)
+    election_task = asyncio.create_task(election.run())
     yield
-    logger.info("Shutting down telegram application")
-    await MESSAGE_QUEUE.shutdown()
-    stop_event.set()
-    telegram_thread.join()
+    logger.info("Stepping down as leader")
+    election.stop()
+    await election_task
     logger.info("Shutting down scheduler")
-    scheduler.shutdown()
-    logger.info("Shutting down postgres engine")
-    await ENGINE.dispose()
+    scheduler.shutdown(wait=False)
+    # Running jobs still call back into this loop, so it keeps running while
+    # they finish.
+    await asyncio.to_thread(JOB_EXECUTOR.shutdown)
+    logger.info("Shutting down telegram application")
+    await application.stop()
+    await telegram_application.inbox.close()
+    await message_queue.shutdown()
+    await sender_task
+    await application.shutdown()
+    # The last flush writes the activity of the turns that just finished.
+    agent.activity.stop()
+    await activity_task
+    bootstrap_task.cancel()
+    await close_tools(tools)
     logger.info("Shutting down checkpointer")
-    await CHECKPOINTER.close()
+    await checkpointer.close()
     logger.info("Shutting down graphiti")
+    await graphiti_runtime.close()
+    logger.info("Shutting down postgres engine")
+    await get_engine().dispose()
+    logger.info("Flushing traces")
+    tracer.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(auth_router, prefix="/ragpile/api")
+app.include_router(events_router, prefix="/ragpile/api")
 app.include_router(openai_router, prefix="/ragpile/api")
 app.include_router(threads_router, prefix="/ragpile/api")
 app.include_router(schedules_router, prefix="/ragpile/api")
 
 
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 class Webhook(BaseModel):
     action: str
     message: str
@@ -1,21 +1,18 @@
-import asyncio
+"""
+Providers for the shared resources of the backend.
+
+Everything here is constructed lazily on first use, and the heavy SDKs are
+imported inside the providers, so importing this module is cheap and does not
+need any environment variables.
+"""
+
+from __future__ import annotations
+
 import os
 from contextlib import asynccontextmanager
-from typing import AsyncContextManager, AsyncIterator, Callable
+from functools import cache
+from typing import TYPE_CHECKING, AsyncContextManager, AsyncIterator, Callable, cast
 
-from apscheduler.executors.pool import ThreadPoolExecutor  # type: ignore
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore  # type: ignore
-from apscheduler.schedulers.background import (  # type: ignore
-    BackgroundScheduler,
-    BaseScheduler,
-)
-from asyncpraw import Reddit
-from graphiti_core import Graphiti
-from langchain.chat_models import init_chat_model
-from langchain.globals import set_debug
-from langchain_core.tools.base import BaseTool
-from langgraph.graph.state import CompiledStateGraph
-from openai import OpenAI
 from sqlalchemy.engine import URL
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -23,14 +20,20 @@ from sqlalchemy.ext.asyncio import (
     async_sessionmaker,
     create_async_engine,
 )
-from telegram import Bot
+from sqlalchemy.pool import QueuePool
 
-from agent.agent import Agent
-from agent.graph import create_agent, create_tools
-from agent.postgres_saver import LazyAsyncPostgresSaver
 from jwt_token import TokenManager, get_current_user_factory
+from memory.runtime import GraphitiRuntime
 from message_queue import MessageQueue
-from tools.scheduler import local
+from metrics import Gauge
+
+if TYPE_CHECKING:
+    from apscheduler.schedulers.base import BaseScheduler  # type: ignore
+    from langchain_core.tools.base import BaseTool
+    from openai import AsyncOpenAI
+
+    from agent.agent import Agent
+    from agent.postgres_saver import LazyAsyncPostgresSaver
 
 
 ######### DATABASE #########
@@ -48,7 +51,26 @@ def create_engine() -> AsyncEngine:
     return create_async_engine(url, echo=True)
 
 
-ENGINE = create_engine()
+@cache
+def get_engine() -> AsyncEngine:
+    engine = create_engine()
+    instrument_pool(engine, "main")
+    return engine
+
+
+DB_POOL_CONNECTIONS = Gauge(
+    "ragpile_db_pool_connections",
+    "Connections of a database pool, by state",
+    ["pool", "state"],
+)
+
+
+def instrument_pool(engine: AsyncEngine, name: str) -> None:
+    pool = cast(QueuePool, engine.pool)
+    DB_POOL_CONNECTIONS.set_function(pool.checkedout, pool=name, state="checked_out")
+    DB_POOL_CONNECTIONS.set_function(pool.checkedin, pool=name, state="idle")
+    DB_POOL_CONNECTIONS.set_function(pool.overflow, pool=name, state="overflow")
+    DB_POOL_CONNECTIONS.set_function(pool.size, pool=name, state="size")
 
 
 def create_session_factory(
@@ -64,70 +86,85 @@ def create_session_factory(
     return _session_factory
 
 
-get_session = create_session_factory(ENGINE)
-get_session_factory = asynccontextmanager(get_session)
+@cache
+def get_session_factory() -> Callable[[], AsyncContextManager[AsyncSession]]:
+    return asynccontextmanager(create_session_factory(get_engine()))
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with get_session_factory()() as session:
+        yield session
 
 
 ######## JWT ########
-get_current_user = get_current_user_factory(
-    TokenManager(os.environ["JWT_SECRET"]), get_session
-)
+@cache
+def get_token_manager() -> TokenManager:
+    return TokenManager(os.environ["JWT_SECRET"])
+
+
+get_current_user = get_current_user_factory(get_token_manager, get_session)
+
 
 ###### LLMs ######
-CLIENT = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+@cache
+def get_openai_client() -> AsyncOpenAI:
+    from openai import AsyncOpenAI  # pylint: disable=import-outside-toplevel
+
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 
-def get_openai_client() -> OpenAI:
-    return CLIENT
+def configure_langchain_debug() -> None:
+    # Dumping every prompt and response is expensive, so it is opt-in.
+    if os.environ.get("LANGCHAIN_DEBUG") == "1":
+        from langchain.globals import (  # pylint: disable=import-outside-toplevel
+            set_debug,
+        )
+
+        set_debug(True)
 
 
 ####### APScheduler #######
-def new_scheduler() -> BaseScheduler:
-    url = URL.create(
-        drivername="postgresql",
-        username=os.environ["POSTGRES_USER"],
-        password=os.environ["POSTGRES_PASSWORD"],
-        host="db",
-        port=5432,
-        database=os.environ["POSTGRES_SCHEDULER_DB"],
+def new_scheduler(url: URL | None = None) -> BaseScheduler:
+    """A scheduler keeping its jobs in `url`, the scheduler database by default."""
+    # pylint: disable=import-outside-toplevel
+    from apscheduler.events import (  # type: ignore
+        EVENT_JOB_MISSED,
+        EVENT_JOB_SUBMITTED,
     )
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore  # type: ignore
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler  # type: ignore
+
+    from tools.scheduler import on_job_event
+
+    if url is None:
+        url = URL.create(
+            drivername="postgresql",
+            username=os.environ["POSTGRES_USER"],
+            password=os.environ["POSTGRES_PASSWORD"],
+            host="db",
+            port=5432,
+            database=os.environ["POSTGRES_SCHEDULER_DB"],
+        )
     jobstores = {"default": SQLAlchemyJobStore(url=url)}
 
     job_defaults = {"max_instances": 1, "coalesce": True, "misfire_grace_time": None}
-    scheduler = BackgroundScheduler(jobstores=jobstores, job_defaults=job_defaults)
-
-    def _init():
-        asyncio.set_event_loop(asyncio.new_event_loop())
-        session_factory = asynccontextmanager(create_session_factory(create_engine()))
-        tools = new_tools(graphiti=new_graphiti(), session_factory=session_factory)
-
-        local.tools = {tool.name: tool for tool in tools}
-        local.scheduler = scheduler
-        local.session_factory = session_factory
-        local.agent = new_agent(
-            tools=tools,
-            session_factory=session_factory,
-            queue=MESSAGE_QUEUE,
-            checkpointer=CHECKPOINTER,
-        )
-        local.bot = Bot(token=get_telegram_application_token())
-        local.llm = init_chat_model("gpt-4.1")
-
-    scheduler.add_executor(
-        ThreadPoolExecutor(1, pool_kwargs={"initializer": _init}), alias="default"
-    )
+    # Jobs are started on the event loop the scheduler is started on, their
+    # code runs on tools.scheduler.JOB_EXECUTOR.
+    scheduler = AsyncIOScheduler(jobstores=jobstores, job_defaults=job_defaults)
+    scheduler.add_listener(on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
     return scheduler
 
 
-SCHEDULER = new_scheduler()
-
-
+@cache
 def get_scheduler() -> BaseScheduler:
-    return SCHEDULER
+    return new_scheduler()
 
 
 ######## Langgraph Checkpointer ########
 def new_checkpointer() -> LazyAsyncPostgresSaver:
+    # pylint: disable-next=import-outside-toplevel
+    from agent.postgres_saver import LazyAsyncPostgresSaver
+
     url = URL.create(
         drivername="postgresql",
         username=os.environ["POSTGRES_USER"],
@@ -139,29 +176,43 @@ def new_checkpointer() -> LazyAsyncPostgresSaver:
     return LazyAsyncPostgresSaver(url.render_as_string(False))
 
 
-CHECKPOINTER = new_checkpointer()
-
-
+@cache
 def get_checkpointer() -> LazyAsyncPostgresSaver:
-    return CHECKPOINTER
+    return new_checkpointer()
 
 
 ######## Graphs ########
-
-set_debug(True)
+@cache
+def get_tools() -> list[BaseTool]:
+    return new_tools(session_factory=get_session_factory())
+
+
+@cache
+def get_agent() -> Agent:
+    return new_agent(
+        tools=get_tools(),
+        checkpointer=get_checkpointer(),
+        session_factory=get_session_factory(),
+        queue=get_message_queue(),
+        graphiti_runtime=get_graphiti_runtime(),
+    )
 
 
 def new_tools(
-    graphiti: Graphiti, session_factory: Callable[[], AsyncContextManager[AsyncSession]]
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]],
 ) -> list[BaseTool]:
+    # pylint: disable=import-outside-toplevel
+    from asyncpraw import Reddit
+
+    from agent.graph import create_tools
+
     return create_tools(
-        graphiti=graphiti,
         session_factory=session_factory,
         client_id=os.environ["GOOGLE_CLIENT_ID"],
         client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
         google_search_api_key=os.environ["GOOGLE_SEARCH_API_KEY"],
         google_search_engine_id=os.environ["GOOGLE_SEARCH_ENGINE_ID"],
-        scheduler=SCHEDULER,
+        scheduler=get_scheduler(),
         reddit_client=Reddit(
             client_id=os.environ["REDDIT_CLIENT_ID"],
             client_secret=os.environ["REDDIT_CLIENT_SECRET"],
@@ -177,31 +228,42 @@ def new_agent(
     checkpointer: LazyAsyncPostgresSaver,
     session_factory: Callable[[], AsyncContextManager[AsyncSession]],
     queue: MessageQueue,
+    graphiti_runtime: GraphitiRuntime | None = None,
 ) -> Agent:
+    # pylint: disable=import-outside-toplevel
+    from langchain.chat_models import init_chat_model
+
+    from agent.graph import create_agent
+
     return create_agent(
         tools=tools,
         checkpointer=checkpointer,
         llm=init_chat_model("gpt-4.1"),
         session_factory=session_factory,
         queue=queue,
+        graphiti_runtime=graphiti_runtime,
     )
 
 
 ######### Telegram ########
+def get_telegram_application_token() -> str:
+    return os.environ["TELEGRAM_APPLICATION_TOKEN"]
 
-TELEGRAM_APPLICATION_TOKEN = os.environ["TELEGRAM_APPLICATION_TOKEN"]
 
+@cache
+def get_message_queue() -> MessageQueue:
+    return MessageQueue()
 
-def get_telegram_application_token() -> str:
-    return TELEGRAM_APPLICATION_TOKEN
 
+######## Open WebUI ########
+def get_openwebui_api_key() -> str:
+    return os.environ["OPENWEBUI_API_KEY"]
 
-MESSAGE_QUEUE = MessageQueue()
-######## Graphiti ########
 
-
-def new_graphiti() -> Graphiti:
-    return Graphiti(
+######## Graphiti ########
+@cache
+def get_graphiti_runtime() -> GraphitiRuntime:
+    return GraphitiRuntime(
         os.environ["NEO4J_URI"],
         os.environ["NEO4J_USERNAME"],
         os.environ["NEO4J_PASSWORD"],
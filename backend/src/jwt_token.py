@@ -1,14 +1,37 @@
+import copy
 import datetime
+import hashlib
 from calendar import timegm
 from typing import Annotated, AsyncIterator, Awaitable, Callable
 
 import jwt
 from fastapi import Cookie, Depends, HTTPException, Response
-from jwt.exceptions import PyJWTError
+from jwt.exceptions import ExpiredSignatureError, PyJWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import TTLCache
 from models import User
 
+# Snapshots of the authenticated users, so polling the API does not load the
+# user on every request. Code changing a user invalidates its snapshot, the
+# TTL bounds how stale the snapshots of other replicas get.
+USER_CACHE: TTLCache[str, User] = TTLCache(maxsize=1024, ttl=30.0)
+
+
+def invalidate_cached_user(user_id: str) -> None:
+    USER_CACHE.invalidate(user_id)
+
+
+def _snapshot(user: User) -> User:
+    # A detached copy, so a request changing its user does not change the
+    # cached one.
+    return User(
+        id=user.id,
+        email=user.email,
+        name=user.name,
+        integrations=copy.deepcopy(user.integrations),
+    )
+
 
 class Token:
     def __init__(self, user_id: str, exp: int | None = None):
@@ -31,13 +54,20 @@ class Token:
             ).timetuple()
         )
 
+    def expired(self) -> bool:
+        return self.exp < timegm(
+            datetime.datetime.now(tz=datetime.timezone.utc).timetuple()
+        )
+
     def payload(self) -> dict:
         return {"user_id": self.user_id, "exp": self.exp}
 
 
 class TokenManager:
-    def __init__(self, secret: str):
+    def __init__(self, secret: str, cache_ttl: float = 60.0):
         self.secret = secret
+        # Keyed by the hash of the token, so the cache does not hold tokens.
+        self._decoded: TTLCache[bytes, Token] = TTLCache(maxsize=1024, ttl=cache_ttl)
 
     def sign_token(self, token: Token) -> str:
         return jwt.encode(
@@ -47,12 +77,22 @@ class TokenManager:
         )
 
     def decode_token(self, token: str) -> Token:
+        key = hashlib.sha256(token.encode()).digest()
+        cached = self._decoded.get(key)
+        if cached is not None:
+            if cached.expired():
+                self._decoded.invalidate(key)
+                raise ExpiredSignatureError("Signature has expired")
+            return cached
         decoded = jwt.decode(token, self.secret, algorithms=["HS256"])
-        return Token(user_id=decoded["id"], exp=decoded.get("exp"))
+        decoded_token = Token(user_id=decoded["id"], exp=decoded.get("exp"))
+        self._decoded.set(key, decoded_token)
+        return decoded_token
 
 
 def get_current_user_factory(
-    token_manager: TokenManager, get_session: Callable[[], AsyncIterator[AsyncSession]]
+    get_token_manager: Callable[[], TokenManager],
+    get_session: Callable[[], AsyncIterator[AsyncSession]],
 ) -> Callable[[Response, AsyncSession, str | None], Awaitable[User]]:
     async def _get_current_user(
         response: Response,
@@ -61,6 +101,7 @@ def get_current_user_factory(
     ) -> User:
         if not token:
             raise HTTPException(status_code=401, detail="Not authenticated")
+        token_manager = get_token_manager()
         try:
             token_decoded = token_manager.decode_token(token)
         except PyJWTError as exc:
@@ -69,6 +110,10 @@ def get_current_user_factory(
         if token_decoded.expires_soon():
             set_current_user(response, token_manager, token_decoded.user_id)
 
+        cached = USER_CACHE.get(token_decoded.user_id)
+        if cached is not None:
+            return _snapshot(cached)
+
         user = await session.get(User, token_decoded.user_id)
         if not user:
             user = User(
@@ -76,7 +121,9 @@ def get_current_user_factory(
             )
             session.add(user)
             await session.commit()
-        return user
+        snapshot = _snapshot(user)
+        USER_CACHE.set(user.id, snapshot)
+        return _snapshot(snapshot)
 
     return _get_current_user
 
@@ -0,0 +1,143 @@
+"""
+Leader election between replicas of the backend.
+
+Any replica serves the API and sends messages, but polling Telegram, running
+scheduled jobs and ingesting memory must happen once. The replica holding a
+Postgres advisory lock does them. Session level advisory locks are released
+when their connection closes, so a replica that dies hands over leadership.
+"""
+
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+IS_LEADER = Gauge("ragpile_leader", "1 when this replica is the leader")
+
+
+def advisory_lock_key(name: str) -> int:
+    """Maps a name to the signed 64 bit key of a Postgres advisory lock."""
+    digest = hashlib.sha256(name.encode()).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+async def _connect(engine: AsyncEngine) -> AsyncConnection:
+    connection = await engine.connect()
+    # Without a transaction, the connection does not sit idle in one while it
+    # holds the lock.
+    await connection.execution_options(isolation_level="AUTOCOMMIT")
+    return connection
+
+
+async def _release(connection: AsyncConnection, key: int) -> None:
+    try:
+        await connection.execute(select(func.pg_advisory_unlock(key)))
+        await connection.close()
+    except Exception:  # pylint: disable=broad-exception-caught
+        # A pooled connection must not keep the lock, so it is discarded.
+        await connection.invalidate()
+
+
+@asynccontextmanager
+async def advisory_lock(engine: AsyncEngine, name: str) -> AsyncIterator[bool]:
+    """Tries to take a lock for the duration of the block, yields whether it did."""
+    key = advisory_lock_key(name)
+    connection = await _connect(engine)
+    try:
+        acquired = await connection.scalar(select(func.pg_try_advisory_lock(key)))
+    except BaseException:
+        await connection.invalidate()
+        raise
+    if not acquired:
+        await connection.close()
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        await _release(connection, key)
+
+
+class LeaderElection:
+    """
+    Keeps trying to become the leader, and checks that it still is.
+
+    `on_elected` runs when this replica takes the lock and `on_demoted` when it
+    loses the connection holding it or stops.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        on_elected: Callable[[], Awaitable[None]],
+        on_demoted: Callable[[], Awaitable[None]],
+        name: str = "ragpile-leader",
+        interval: float = 5.0,
+    ):
+        self.engine = engine
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.key = advisory_lock_key(name)
+        self.interval = interval
+        self._connection: AsyncConnection | None = None
+        self._stop = asyncio.Event()
+        IS_LEADER.set(0)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._connection is not None
+
+    async def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._connection is None:
+                    await self._try_acquire()
+                else:
+                    await self._connection.execute(select(1))
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Leader election failed")
+                await self._demote()
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except TimeoutError:
+                pass
+        await self._demote()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def _try_acquire(self) -> None:
+        connection = await _connect(self.engine)
+        try:
+            acquired = await connection.scalar(
+                select(func.pg_try_advisory_lock(self.key))
+            )
+        except BaseException:
+            await connection.invalidate()
+            raise
+        if not acquired:
+            await connection.close()
+            return
+        logger.info("This replica is the leader")
+        self._connection = connection
+        IS_LEADER.set(1)
+        await self.on_elected()
+
+    async def _demote(self) -> None:
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        IS_LEADER.set(0)
+        logger.info("This replica is no longer the leader")
+        try:
+            await self.on_demoted()
+        finally:
+            await _release(connection, self.key)
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncContextManager, Callable
+from uuid import uuid4
+
+from graphiti_core.nodes import EpisodeType
+from graphiti_core.utils.bulk_utils import RawEpisode
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from memory.runtime import GraphitiRuntime
+from metrics import Gauge
+from models import Episode
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+FAILED = "failed"
+
+EPISODE_QUEUE_DEPTH = Gauge(
+    "ragpile_episode_queue_depth", "Episodes waiting to be ingested", ["group"]
+)
+EPISODE_QUEUE_FAILED = Gauge(
+    "ragpile_episode_queue_failed", "Episodes that failed to be ingested", ["group"]
+)
+EPISODE_QUEUE_LAG = Gauge(
+    "ragpile_episode_queue_lag_seconds",
+    "Age of the oldest episode waiting to be ingested",
+    ["group"],
+)
+
+
+class EpisodeQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class GroupQueueStats:
+    group_id: str
+    depth: int
+    failed: int
+    lag_seconds: float
+
+
+class EpisodeQueue:
+    """
+    A durable queue of Graphiti episodes, stored in postgres.
+
+    Producers enqueue and return immediately, the EpisodeIngestionWorker
+    ingests them in the background.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        max_pending_per_group: int = 100,
+    ):
+        self.session_factory = session_factory
+        self.max_pending_per_group = max_pending_per_group
+
+    async def enqueue(
+        self,
+        group_id: str,
+        name: str,
+        body: str,
+        source: EpisodeType,
+        source_description: str = "",
+        reference_time: datetime | None = None,
+    ) -> int:
+        """Adds an episode to the queue and returns the queue depth of the group."""
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as session:
+            depth = await session.scalar(
+                select(func.count())
+                .select_from(Episode)
+                .where(Episode.group_id == group_id, Episode.status != FAILED)
+            )
+            if depth is not None and depth >= self.max_pending_per_group:
+                raise EpisodeQueueFullError(
+                    f"{depth} episodes are already waiting to be ingested for {group_id}"
+                )
+            session.add(
+                Episode(
+                    id=uuid4().hex,
+                    group_id=group_id,
+                    name=name,
+                    body=body,
+                    source=source.value,
+                    source_description=source_description,
+                    reference_time=reference_time or now,
+                    created_at=now,
+                    status=PENDING,
+                    attempts=0,
+                    next_attempt_at=now,
+                )
+            )
+        return (depth or 0) + 1
+
+    async def stats(self) -> list[GroupQueueStats]:
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as session:
+            rows = await session.execute(
+                select(
+                    Episode.group_id,
+                    func.count().filter(Episode.status != FAILED),
+                    func.count().filter(Episode.status == FAILED),
+                    func.min(Episode.created_at).filter(Episode.status != FAILED),
+                ).group_by(Episode.group_id)
+            )
+            return [
+                GroupQueueStats(
+                    group_id=group_id,
+                    depth=depth,
+                    failed=failed,
+                    lag_seconds=(now - oldest).total_seconds() if oldest else 0.0,
+                )
+                for group_id, depth, failed, oldest in rows
+            ]
+
+
+class EpisodeIngestionWorker:
+    """
+    Ingests queued episodes into Graphiti.
+
+    Groups are processed concurrently, but the episodes of one group are ingested
+    one batch at a time, in the order they were enqueued. Batches of more than one
+    episode go through Graphiti's bulk ingestion. Failed batches are retried with
+    exponential backoff and are marked as failed after `max_attempts`, failed
+    episodes are deleted after `failed_retention`.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        graphiti_runtime: GraphitiRuntime,
+        batch_size: int = 10,
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        poll_interval: float = 2.0,
+        stats_interval: float = 60.0,
+        failed_retention: timedelta = timedelta(days=7),
+    ):
+        self.session_factory = session_factory
+        self.graphiti_runtime = graphiti_runtime
+        self.queue = EpisodeQueue(session_factory)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.stats_interval = stats_interval
+        self.failed_retention = failed_retention
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._stats_groups: set[str] = set()
+        self._stop = asyncio.Event()
+
+    async def run(self) -> None:
+        await self._recover()
+        last_stats = 0.0
+        loop = asyncio.get_running_loop()
+        while not self._stop.is_set():
+            try:
+                for group_id in await self._ready_groups():
+                    self._start_group(group_id)
+                if loop.time() - last_stats > self.stats_interval:
+                    last_stats = loop.time()
+                    await self.prune_failed()
+                    await self._log_stats()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Episode ingestion loop failed")
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def prune_failed(self) -> int:
+        """Deletes failed episodes enqueued more than `failed_retention` ago."""
+        cutoff = datetime.now(timezone.utc) - self.failed_retention
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(Episode).where(
+                    Episode.status == FAILED, Episode.created_at < cutoff
+                )
+            )
+        if result.rowcount:
+            logger.info("Pruned %d failed episodes", result.rowcount)
+        return result.rowcount
+
+    async def _recover(self) -> None:
+        # Episodes left in processing by a previous run are picked up again.
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Episode)
+                .where(Episode.status == PROCESSING)
+                .values(status=PENDING)
+            )
+
+    async def _ready_groups(self) -> list[str]:
+        # A group is ready when its oldest episode is pending and due, so a
+        # batch waiting for a retry holds back the episodes enqueued after it.
+        now = datetime.now(timezone.utc)
+        heads = (
+            select(Episode.group_id, func.min(Episode.created_at).label("created_at"))
+            .where(Episode.status != FAILED)
+            .group_by(Episode.group_id)
+            .subquery()
+        )
+        async with self.session_factory() as session:
+            group_ids = await session.scalars(
+                select(Episode.group_id)
+                .join(
+                    heads,
+                    (Episode.group_id == heads.c.group_id)
+                    & (Episode.created_at == heads.c.created_at),
+                )
+                .where(Episode.status == PENDING, Episode.next_attempt_at <= now)
+                .distinct()
+            )
+            return [
+                group_id for group_id in group_ids if group_id not in self._in_flight
+            ]
+
+    def _start_group(self, group_id: str) -> None:
+        self._in_flight.add(group_id)
+        task = asyncio.create_task(self._process_group(group_id))
+        self._tasks.add(task)
+
+        def _done(t: asyncio.Task) -> None:
+            self._tasks.discard(t)
+            self._in_flight.discard(group_id)
+
+        task.add_done_callback(_done)
+
+    async def _process_group(self, group_id: str) -> None:
+        async with self._semaphore:
+            episodes = await self._claim(group_id)
+            if not episodes:
+                return
+            try:
+                await self._ingest(group_id, episodes)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to ingest episodes for %s", group_id)
+                await self._retry_later(episodes, repr(e))
+                return
+            async with self.session_factory() as session:
+                await session.execute(
+                    delete(Episode).where(Episode.id.in_([e.id for e in episodes]))
+                )
+            logger.info("Ingested %d episodes for %s", len(episodes), group_id)
+
+    async def _claim(self, group_id: str) -> list[Episode]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Episode)
+                .where(Episode.group_id == group_id, Episode.status == PENDING)
+                .order_by(Episode.created_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            episodes = list(result.scalars().all())
+            for episode in episodes:
+                episode.status = PROCESSING
+                episode.attempts += 1
+            await session.flush()
+            for episode in episodes:
+                session.expunge(episode)
+        return episodes
+
+    async def _ingest(self, group_id: str, episodes: list[Episode]) -> None:
+        graphiti = await self.graphiti_runtime.get()
+        if len(episodes) == 1:
+            episode = episodes[0]
+            await graphiti.add_episode(
+                group_id=group_id,
+                name=episode.name,
+                episode_body=episode.body,
+                source=EpisodeType(episode.source),
+                source_description=episode.source_description,
+                reference_time=episode.reference_time,
+            )
+            return
+        await graphiti.add_episode_bulk(
+            [
+                RawEpisode(
+                    name=episode.name,
+                    content=episode.body,
+                    source=EpisodeType(episode.source),
+                    source_description=episode.source_description,
+                    reference_time=episode.reference_time,
+                )
+                for episode in episodes
+            ],
+            group_id=group_id,
+        )
+
+    async def _retry_later(self, episodes: list[Episode], error: str) -> None:
+        # Episodes of a batch can have different attempts, when a smaller batch
+        # failed before, so each one gets the status and backoff of its own.
+        now = datetime.now(timezone.utc)
+        next_attempt_at = {
+            episode.attempts: now
+            + timedelta(seconds=self.poll_interval * 2**episode.attempts)
+            for episode in episodes
+        }
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Episode)
+                .where(Episode.id.in_([e.id for e in episodes]))
+                .values(
+                    status=case(
+                        (Episode.attempts >= self.max_attempts, FAILED),
+                        else_=PENDING,
+                    ),
+                    next_attempt_at=case(next_attempt_at, value=Episode.attempts),
+                    error=error,
+                )
+            )
+
+    async def _log_stats(self) -> None:
+        groups = set()
+        for stats in await self.queue.stats():
+            logger.info(
+                "Episode queue %s: depth=%d failed=%d lag=%.1fs",
+                stats.group_id,
+                stats.depth,
+                stats.failed,
+                stats.lag_seconds,
+            )
+            EPISODE_QUEUE_DEPTH.set(stats.depth, group=stats.group_id)
+            EPISODE_QUEUE_FAILED.set(stats.failed, group=stats.group_id)
+            EPISODE_QUEUE_LAG.set(stats.lag_seconds, group=stats.group_id)
+            groups.add(stats.group_id)
+        # Groups whose episodes are all ingested or pruned drop out of the stats.
+        for group_id in self._stats_groups - groups:
+            for gauge in (EPISODE_QUEUE_DEPTH, EPISODE_QUEUE_FAILED, EPISODE_QUEUE_LAG):
+                gauge.remove(group=group_id)
+        self._stats_groups = groups
@@ -0,0 +1,74 @@
+import logging
+import time
+from dataclasses import dataclass
+
+from cache import TTLCache
+from memory.runtime import GraphitiRuntime
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class MemoryContext:
+    facts: list[str]
+    latency: float
+    cached: bool
+
+    def to_prompt(self) -> str:
+        return "Things you remember about the user:\n" + "\n".join(
+            f"- {fact}" for fact in self.facts
+        )
+
+
+class MemoryRetriever:
+    """
+    Looks up the facts relevant to a user message in Graphiti.
+
+    Results are cached per user and query, so a repeated question does not
+    search again.
+    """
+
+    def __init__(
+        self,
+        graphiti_runtime: GraphitiRuntime,
+        num_results: int = 10,
+        max_tokens: int = 500,
+        cache_ttl: float = 600,
+    ):
+        self.graphiti_runtime = graphiti_runtime
+        self.num_results = num_results
+        self.max_tokens = max_tokens
+        self._cache: TTLCache[tuple[str, str], list[str]] = TTLCache(
+            maxsize=1024, ttl=cache_ttl
+        )
+
+    async def retrieve(self, group_id: str, query: str) -> MemoryContext:
+        start = time.perf_counter()
+        key = (group_id, query)
+        facts = self._cache.get(key)
+        if facts is not None:
+            return MemoryContext(
+                facts=facts, latency=time.perf_counter() - start, cached=True
+            )
+
+        graphiti = await self.graphiti_runtime.get()
+        edges = await graphiti.search(
+            query, group_ids=[group_id], num_results=self.num_results
+        )
+        facts = self._bounded([edge.fact for edge in edges])
+        self._cache.set(key, facts)
+        latency = time.perf_counter() - start
+        logger.info("Retrieved %d facts for %s in %.3fs", len(facts), group_id, latency)
+        return MemoryContext(facts=facts, latency=latency, cached=False)
+
+    def _bounded(self, facts: list[str]) -> list[str]:
+        budget = self.max_tokens * CHARS_PER_TOKEN
+        bounded: list[str] = []
+        for fact in facts:
+            budget -= len(fact) + 3
+            if budget < 0:
+                break
+            bounded.append(fact)
+        return bounded
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from graphiti_core import Graphiti
+
+logger = logging.getLogger(__name__)
+
+# Bump when the indices or constraints Graphiti needs change.
+SCHEMA_VERSION = 1
+
+
+class GraphitiRuntime:
+    """
+    Process-wide access to Graphiti.
+
+    The Neo4j driver is bound to the event loop it is used on, so there is one
+    Graphiti client per loop, created on first use. Indices and constraints are
+    built by bootstrap() once per database, guarded by a schema version marker
+    stored in Neo4j.
+    """
+
+    def __init__(self, uri: str, user: str, password: str):
+        self.uri = uri
+        self.user = user
+        self.password = password
+        self._clients: dict[asyncio.AbstractEventLoop, "Graphiti"] = {}
+        self._lock = threading.Lock()
+
+    async def get(self) -> "Graphiti":
+        # graphiti_core pulls in neo4j and several LLM SDKs, so it is only
+        # imported once memory is actually used.
+        from graphiti_core import Graphiti  # pylint: disable=import-outside-toplevel
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            graphiti = self._clients.get(loop)
+            if graphiti is None:
+                logger.info("Creating graphiti client")
+                graphiti = Graphiti(self.uri, self.user, self.password)
+                self._clients[loop] = graphiti
+        return graphiti
+
+    async def bootstrap(self) -> None:
+        """
+        Builds the indices and constraints if the schema marker is outdated.
+
+        Building them takes long, so it is started once in the background at
+        startup instead of on the first get(), which runs under the timeout of
+        a memory lookup. Errors are logged, memory works without the indices.
+        """
+        try:
+            graphiti = await self.get()
+            records, _, _ = await graphiti.driver.execute_query(
+                "MATCH (s:RagpileSchema) RETURN s.version AS version"
+            )
+            version = records[0]["version"] if records else None
+            if version == SCHEMA_VERSION:
+                return
+            logger.info(
+                "Building graphiti indices, schema version %s -> %s",
+                version,
+                SCHEMA_VERSION,
+            )
+            await graphiti.build_indices_and_constraints()
+            await graphiti.driver.execute_query(
+                "MERGE (s:RagpileSchema) SET s.version = $version",
+                version=SCHEMA_VERSION,
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to build the graphiti indices")
+
+    async def close(self) -> None:
+        """
+        Closes the clients of all loops, each on the loop it was created on.
+
+        Call it once the threads using memory have stopped.
+        """
+        current = asyncio.get_running_loop()
+        with self._lock:
+            clients = list(self._clients.items())
+            self._clients.clear()
+        for loop, graphiti in clients:
+            if loop is current:
+                await graphiti.close()
+            elif loop.is_closed():
+                logger.warning("Cannot close a graphiti client of a closed loop")
+            elif loop.is_running():
+                await asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(graphiti.close(), loop)
+                )
+            else:
+                # A loop cannot run on a thread that is already running one.
+                await asyncio.to_thread(loop.run_until_complete, graphiti.close())
@@ -1,41 +1,246 @@
+from __future__ import annotations
+
+import asyncio
 import threading
-from asyncio import Queue
+import time
+from asyncio import QueueShutDown
+from collections import deque
 from dataclasses import dataclass
-from typing import Generic, TypeVar
+from typing import TYPE_CHECKING, Any, Generic, Literal, TypeVar
+
+from metrics import Counter, Gauge, Histogram
+from tracing import SpanContext
 
-from langchain_core.messages import BaseMessage
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
 
 T = TypeVar("T")
 
+Overflow = Literal["block", "drop_oldest"]
+
+QUEUE_DEPTH = Gauge("ragpile_queue_depth", "Items waiting per consumer", ["consumer"])
+QUEUE_PUBLISHED = Counter("ragpile_queue_published", "Items put on the queue")
+QUEUE_DROPPED = Counter(
+    "ragpile_queue_dropped", "Items dropped by full consumers", ["consumer"]
+)
+QUEUE_LATENCY = Histogram(
+    "ragpile_queue_latency_seconds",
+    "Time between putting an item and a consumer getting it",
+    ["consumer"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+TELEGRAM_CHANNEL = "telegram"
+
+_Waiter = tuple[asyncio.AbstractEventLoop, asyncio.Future[None]]
+
+
+def _wake(waiters: list[_Waiter]) -> None:
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_resolve, future)
+        except RuntimeError:
+            # The loop of the waiter is already closed.
+            pass
+
+
+def _resolve(future: asyncio.Future[None]) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Subscription(Generic[T]):
+    """
+    The buffer of one consumer.
+
+    Unlike asyncio.Queue it can be used from any thread and event loop. The
+    state is guarded by a threading.Lock and waiters on other loops are woken
+    with call_soon_threadsafe.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1000, overflow: Overflow = "block"):
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._items: deque[tuple[float, T]] = deque()
+        self._lock = threading.Lock()
+        self._getters: list[_Waiter] = []
+        self._putters: list[_Waiter] = []
+        self._shutdown = False
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    async def put(self, item: T, enqueued_at: float | None = None) -> None:
+        """Adds an item, waiting for space when the buffer is full and blocking."""
+        entry = (time.perf_counter() if enqueued_at is None else enqueued_at, item)
+        while True:
+            with self._lock:
+                if self._shutdown:
+                    raise QueueShutDown
+                if len(self._items) >= self.maxsize > 0 and self.overflow == "block":
+                    future = self._add_waiter(self._putters)
+                else:
+                    if len(self._items) >= self.maxsize > 0:
+                        self._items.popleft()
+                        QUEUE_DROPPED.inc(consumer=self.name)
+                    self._items.append(entry)
+                    getters, self._getters = self._getters, []
+                    break
+            await self._wait(future)
+        _wake(getters)
+
+    async def get(self) -> T:
+        return (await self.get_many(1))[0]
+
+    async def get_many(self, max_items: int, timeout: float | None = None) -> list[T]:
+        """
+        Waits for at least one item and returns up to `max_items`.
+
+        Returns an empty list when `timeout` expires first. Raises QueueShutDown
+        once the queue is shut down and drained.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._lock:
+                if self._items:
+                    count = min(max_items, len(self._items))
+                    entries = [self._items.popleft() for _ in range(count)]
+                    putters, self._putters = self._putters, []
+                    break
+                if self._shutdown:
+                    raise QueueShutDown
+                future = self._add_waiter(self._getters)
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                self._remove_waiter(future)
+                return []
+            try:
+                await self._wait(future, remaining)
+            except TimeoutError:
+                return []
+        _wake(putters)
+        now = time.perf_counter()
+        for enqueued_at, _ in entries:
+            QUEUE_LATENCY.observe(now - enqueued_at, consumer=self.name)
+        return [item for _, item in entries]
+
+    def shutdown(self) -> None:
+        """Wakes all waiters, getters still receive the items that are left."""
+        with self._lock:
+            self._shutdown = True
+            waiters = self._getters + self._putters
+            self._getters, self._putters = [], []
+        _wake(waiters)
+
+    def _add_waiter(self, waiters: list[_Waiter]) -> asyncio.Future[None]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiters.append((loop, future))
+        return future
+
+    def _remove_waiter(self, future: asyncio.Future[None]) -> None:
+        # Only the live lists are searched. A list that was swapped out is
+        # being iterated by a waker and must not change under it.
+        with self._lock:
+            for waiters in (self._getters, self._putters):
+                for i, (_, f) in enumerate(waiters):
+                    if f is future:
+                        del waiters[i]
+                        return
+
+    async def _wait(
+        self, future: asyncio.Future[None], timeout: float | None = None
+    ) -> None:
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            self._remove_waiter(future)
+
 
 class FanoutQueue(Generic[T]):
-    def __init__(self):
-        self._queues: dict[str, Queue[T]] = {}
+    """
+    Delivers every item to every registered consumer.
+
+    Producers may run on any thread or event loop. Each consumer has a bounded
+    buffer: with overflow="block" a full buffer makes producers wait, with
+    overflow="drop_oldest" it discards its oldest item instead, which suits
+    consumers that must never slow the producers down.
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self.maxsize = maxsize
+        self._subscriptions: dict[str, Subscription[T]] = {}
         self._lock = threading.Lock()
 
-    def register(self, name: str):
+    def register(
+        self, name: str, maxsize: int | None = None, overflow: Overflow = "block"
+    ) -> Subscription[T]:
+        subscription = Subscription[T](
+            name, self.maxsize if maxsize is None else maxsize, overflow
+        )
         with self._lock:
-            if name in self._queues:
+            if name in self._subscriptions:
                 raise ValueError(f"Queue {name} already exists")
-            self._queues[name] = Queue[T]()
+            self._subscriptions[name] = subscription
+        QUEUE_DEPTH.set_function(subscription.qsize, consumer=name)
+        return subscription
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            subscription = self._subscriptions.pop(name, None)
+        if subscription is not None:
+            subscription.shutdown()
+            QUEUE_DEPTH.remove(consumer=name)
 
     async def get(self, name: str) -> T:
-        return await self._queues[name].get()
+        return await self._subscriptions[name].get()
+
+    async def get_many(
+        self, name: str, max_items: int = 100, timeout: float | None = None
+    ) -> list[T]:
+        return await self._subscriptions[name].get_many(max_items, timeout)
 
     async def put(self, item: T) -> None:
-        for queue in self._queues.values():
-            await queue.put(item)
+        QUEUE_PUBLISHED.inc()
+        enqueued_at = time.perf_counter()
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        for subscription in subscriptions:
+            try:
+                await subscription.put(item, enqueued_at)
+            except QueueShutDown:
+                # The consumer went away while the item was being delivered.
+                pass
 
     async def shutdown(self):
-        for queue in self._queues.values():
-            queue.shutdown()
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        for subscription in subscriptions:
+            subscription.shutdown()
 
 
 @dataclass
 class MessageWithUserId:
     user_id: str
     message: BaseMessage
+    trace_context: SpanContext | None = None
+    thread_id: str | None = None
+    # Where the turn came from, only the Telegram turns are sent to Telegram.
+    channel: str = TELEGRAM_CHANNEL
+
+
+@dataclass
+class AgentEvent:
+    """Something the agent or a job did for a user, for the live views."""
+
+    user_id: str
+    # "tool.start", "tool.end", "job.start" or "job.end".
+    type: str
+    data: dict[str, Any]
+    trace_context: SpanContext | None = None
 
 
-class MessageQueue(FanoutQueue[MessageWithUserId]):
+class MessageQueue(FanoutQueue[MessageWithUserId | AgentEvent]):
     pass
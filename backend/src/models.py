@@ -1,10 +1,18 @@
 from datetime import datetime, timezone
-
-from apscheduler.job import Job
-from sqlalchemy import ForeignKey, Index, PrimaryKeyConstraint, String
+from typing import Any
+
+from sqlalchemy import (
+    JSON,
+    ForeignKey,
+    Index,
+    Integer,
+    PrimaryKeyConstraint,
+    String,
+    Text,
+)
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.sql import Executable, select, update
+from sqlalchemy.sql import Executable, cast, func, literal, select, update
 
 
 class Base(DeclarativeBase):
@@ -55,6 +63,32 @@ class User(Base):
             update(cls).where(cls.id == user.id).values(integrations=user.integrations)
         )
 
+    @classmethod
+    def update_integration(cls, user_id: str, name: str, **values: str) -> Executable:
+        """
+        Sets some fields of one integration with jsonb_set.
+
+        Unlike update_integrations it does not rewrite the other integrations,
+        so it cannot undo a concurrent update of them.
+        """
+        empty = literal({}, postgresql.JSONB)
+        path = postgresql.ARRAY(Text)
+        integrations = func.coalesce(cls.integrations, empty)
+        integration = func.coalesce(integrations[name], empty)
+        for key, value in values.items():
+            integration = func.jsonb_set(
+                integration, literal([key], path), func.to_jsonb(cast(value, Text))
+            )
+        return (
+            update(cls)
+            .where(cls.id == user_id)
+            .values(
+                integrations=func.jsonb_set(
+                    integrations, literal([name], path), integration
+                )
+            )
+        )
+
 
 class Thread(Base):
     __tablename__ = "threads"
@@ -62,6 +96,8 @@ class Thread(Base):
     id: Mapped[str] = mapped_column(String)
     user_id: Mapped[str] = mapped_column(String, ForeignKey("users.id"), nullable=False)
     created_at: Mapped[datetime] = mapped_column(postgresql.TIMESTAMP, nullable=False)
+    # The start of the first message, so listing threads needs no checkpoint.
+    preview: Mapped[str | None] = mapped_column(String, nullable=True)
 
     __table_args__ = (
         PrimaryKeyConstraint("user_id", "id"),
@@ -69,6 +105,20 @@ class Thread(Base):
     )
 
 
+class ThreadActivity(Base):
+    """The current thread of a user and when the user last wrote in it."""
+
+    __tablename__ = "thread_activity"
+
+    user_id: Mapped[str] = mapped_column(
+        String, ForeignKey("users.id"), primary_key=True
+    )
+    thread_id: Mapped[str] = mapped_column(String, nullable=False)
+    last_message_at: Mapped[datetime] = mapped_column(
+        postgresql.TIMESTAMP(timezone=True), nullable=False
+    )
+
+
 class Schedule(Base):
     __tablename__ = "schedules"
 
@@ -79,3 +129,77 @@ class Schedule(Base):
         PrimaryKeyConstraint("user_id", "id"),
         Index("user_id_idx", user_id),
     )
+
+
+class CachedCalendarEvent(Base):
+    """An event of the primary Google calendar of a user, kept by CalendarCache."""
+
+    __tablename__ = "calendar_events"
+
+    user_id: Mapped[str] = mapped_column(String, ForeignKey("users.id"), nullable=False)
+    id: Mapped[str] = mapped_column(String)
+    starts_at: Mapped[datetime] = mapped_column(
+        postgresql.TIMESTAMP(timezone=True), nullable=False
+    )
+    ends_at: Mapped[datetime] = mapped_column(
+        postgresql.TIMESTAMP(timezone=True), nullable=False
+    )
+    # The fields of tools.calendar.CalendarEvent.
+    event: Mapped[dict[str, Any]] = mapped_column(
+        JSON().with_variant(postgresql.JSONB(), "postgresql"), nullable=False
+    )
+
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "id"),
+        Index("calendar_events_user_id_starts_at_idx", user_id, starts_at),
+    )
+
+
+class CalendarSync(Base):
+    """Where the next incremental sync of the calendar of a user starts."""
+
+    __tablename__ = "calendar_sync"
+
+    user_id: Mapped[str] = mapped_column(
+        String, ForeignKey("users.id"), primary_key=True
+    )
+    sync_token: Mapped[str] = mapped_column(String, nullable=False)
+
+
+class ToolResult(Base):
+    __tablename__ = "tool_results"
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    user_id: Mapped[str] = mapped_column(String, ForeignKey("users.id"), nullable=False)
+    tool_name: Mapped[str] = mapped_column(String, nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(postgresql.TIMESTAMP, nullable=False)
+
+    __table_args__ = (Index("tool_results_created_at_idx", created_at),)
+
+
+class Episode(Base):
+    """A Graphiti episode waiting to be ingested in the background."""
+
+    __tablename__ = "episodes"
+
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+    group_id: Mapped[str] = mapped_column(String, nullable=False)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    source: Mapped[str] = mapped_column(String, nullable=False)
+    source_description: Mapped[str] = mapped_column(String, nullable=False)
+    reference_time: Mapped[datetime] = mapped_column(
+        postgresql.TIMESTAMP(timezone=True), nullable=False
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        postgresql.TIMESTAMP(timezone=True), nullable=False
+    )
+    status: Mapped[str] = mapped_column(String, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(
+        postgresql.TIMESTAMP(timezone=True), nullable=False
+    )
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    __table_args__ = (Index("episodes_group_id_created_at_idx", group_id, created_at),)
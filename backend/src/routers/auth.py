@@ -9,11 +9,10 @@ from typing import Annotated, Union
 import requests  # type: ignore
 from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel
-from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from dependencies import get_current_user, get_session, get_telegram_application_token
-from jwt_token import remove_current_user
+from jwt_token import invalidate_cached_user, remove_current_user
 from models import User
 
 auth_router = APIRouter()
@@ -126,9 +125,13 @@ async def callback(
     current_user.integrations[reason.value]["refresh_token_expiry"] = str(
         utc_timestamp + response_json["refresh_token_expires_in"]
     )
-    await session.execute(User.update_integrations(current_user))
-    session.expunge(current_user)
+    await session.execute(
+        User.update_integration(
+            current_user.id, reason.value, **current_user.integrations[reason.value]
+        )
+    )
     await session.commit()
+    invalidate_cached_user(current_user.id)
 
     return ResponseUser.from_user(current_user)
 
@@ -171,10 +174,8 @@ async def telegram_callback(
     )
     current_user.integrations["telegram"]["user_id"] = str(data["id"])
     await session.execute(
-        update(User)
-        .where(User.id == current_user.id)
-        .values(integrations=current_user.integrations)
+        User.update_integration(current_user.id, "telegram", user_id=str(data["id"]))
     )
-    session.expunge(current_user)
     await session.commit()
+    invalidate_cached_user(current_user.id)
     return ResponseUser.from_user(current_user)
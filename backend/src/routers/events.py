@@ -0,0 +1,72 @@
+import json
+import logging
+from asyncio import QueueShutDown
+from typing import Annotated, AsyncIterator
+from uuid import uuid4
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+
+from dependencies import get_current_user, get_message_queue
+from message_queue import AgentEvent, MessageQueue
+from models import User
+from routers.threads import dump_message
+
+events_router = APIRouter()
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_INTERVAL = 15.0
+
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def event_stream(
+    queue: MessageQueue, user_id: str, keepalive_interval: float = KEEPALIVE_INTERVAL
+) -> AsyncIterator[str]:
+    """
+    Streams the messages and events of a user as server-sent events.
+
+    Every connection has its own consumer on the queue. A slow client loses its
+    oldest events instead of slowing the agent down.
+    """
+    name = f"sse:{uuid4().hex}"
+    subscription = queue.register(name, maxsize=100, overflow="drop_oldest")
+    try:
+        while True:
+            try:
+                items = await subscription.get_many(100, timeout=keepalive_interval)
+            except QueueShutDown:
+                return
+            if not items:
+                # Keeps proxies from closing an idle connection.
+                yield ": keepalive\n\n"
+                continue
+            for item in items:
+                if item.user_id != user_id:
+                    continue
+                if isinstance(item, AgentEvent):
+                    yield format_event(item.type, item.data)
+                else:
+                    yield format_event(
+                        "message",
+                        {
+                            "thread_id": item.thread_id,
+                            **dump_message(item.message, False),
+                        },
+                    )
+    finally:
+        queue.unregister(name)
+
+
+@events_router.get("/events")
+async def get_events(
+    current_user: Annotated[User, Depends(get_current_user)],
+    queue: Annotated[MessageQueue, Depends(get_message_queue)],
+):
+    return StreamingResponse(
+        event_stream(queue, current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,248 @@
-from fastapi import APIRouter, Depends
-from openai import OpenAI
-from openai.resources.models import Model, SyncPage
+import asyncio
+import hmac
+import json
+import logging
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Annotated, Any, AsyncIterator, Literal
+from uuid import NAMESPACE_URL, uuid4, uuid5
 
-from dependencies import get_openai_client
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from agent.activity import PREVIEW_LENGTH
+from cache import TTLCache
+from dependencies import (
+    get_agent,
+    get_openai_client,
+    get_openwebui_api_key,
+    get_session,
+)
+from models import Thread, User
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
 
 openai_router = APIRouter()
+logger = logging.getLogger(__name__)
+
+OPENWEBUI_CHANNEL = "openwebui"
+# Listed first, every model answers through the agent.
+AGENT_MODEL = "ragpile"
+
+
+# Mirrors the OpenAI model list, so the openai SDK is not imported with the app.
+class Model(BaseModel):
+    id: str
+    created: int
+    object: Literal["model"] = "model"
+    owned_by: str
+
+
+class ModelList(BaseModel):
+    object: Literal["list"] = "list"
+    data: list[Model]
+
+
+# The upstream model list changes rarely and Open WebUI asks for it often.
+MODELS_CACHE: TTLCache[str, ModelList] = TTLCache(maxsize=1, ttl=600)
+
+
+@openai_router.get("/models", response_model=ModelList)
+async def list_models(openai: Annotated[Any, Depends(get_openai_client)]):
+    models = MODELS_CACHE.get("models")
+    if models is None:
+        models = ModelList(
+            data=[Model(id=AGENT_MODEL, created=0, owned_by="ragpile")]
+            + [
+                Model.model_validate(model.model_dump())
+                async for model in openai.models.list()
+            ]
+        )
+        MODELS_CACHE.set("models", models)
+    return models
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str | list[dict[str, Any]] | None = None
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str
+    messages: list[ChatMessage]
+    stream: bool = False
+
+
+def message_text(message: ChatMessage) -> str:
+    if isinstance(message.content, list):
+        return "".join(
+            part.get("text", "") for part in message.content if part["type"] == "text"
+        )
+    return message.content or ""
+
+
+def to_langchain_messages(messages: list[ChatMessage]) -> list["BaseMessage"]:
+    # pylint: disable-next=import-outside-toplevel
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    types = {"user": HumanMessage, "assistant": AIMessage, "system": SystemMessage}
+    return [
+        types[message.role](content=message_text(message))
+        for message in messages
+        if message.role in types
+    ]
+
+
+def new_messages(messages: list[ChatMessage]) -> list[ChatMessage]:
+    """The messages after the last answer, the thread already has the rest."""
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].role == "assistant":
+            return messages[i + 1 :]
+    return messages
+
+
+def chat_thread_id(chat_id: str) -> str:
+    return uuid5(NAMESPACE_URL, f"openwebui:{chat_id}").hex
+
+
+async def get_openwebui_user(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    api_key: Annotated[str, Depends(get_openwebui_api_key)],
+    authorization: Annotated[str, Header()] = "",
+    x_openwebui_user_email: Annotated[str | None, Header()] = None,
+) -> User:
+    """
+    The user Open WebUI talks for.
+
+    Open WebUI authenticates with the shared API key and forwards the user in
+    headers, which needs ENABLE_FORWARD_USER_INFO_HEADERS.
+    """
+    if not hmac.compare_digest(authorization, f"Bearer {api_key}"):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if not x_openwebui_user_email:
+        raise HTTPException(status_code=400, detail="The user headers are missing")
+    user = await session.scalar(
+        select(User).where(User.email == x_openwebui_user_email).limit(1)
+    )
+    if user is None:
+        raise HTTPException(status_code=403, detail="Unknown user")
+    session.expunge(user)
+    return user
+
+
+async def get_chat_thread(
+    session: AsyncSession, user: User, chat_id: str | None, preview: str
+) -> tuple[str, bool]:
+    """Returns the thread of an Open WebUI chat and whether it is new."""
+    if chat_id is None:
+        thread_id = uuid4().hex
+    else:
+        thread_id = chat_thread_id(chat_id)
+        if await session.get(Thread, (user.id, thread_id)):
+            return thread_id, False
+    session.add(
+        Thread(
+            id=thread_id,
+            user_id=user.id,
+            created_at=datetime.now(),
+            preview=preview[:PREVIEW_LENGTH] or None,
+        )
+    )
+    await session.commit()
+    return thread_id, True
+
+
+def completion_chunk(
+    completion_id: str, model: str, delta: dict[str, str], finish_reason: str | None
+) -> str:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def stream_completion(
+    turn: asyncio.Task, tokens: asyncio.Queue[str | None], model: str
+) -> AsyncIterator[str]:
+    completion_id = f"chatcmpl-{uuid4().hex}"
+    try:
+        yield completion_chunk(completion_id, model, {"role": "assistant"}, None)
+        while (token := await tokens.get()) is not None:
+            yield completion_chunk(completion_id, model, {"content": token}, None)
+        if not turn.cancelled() and turn.exception():
+            logger.error("Chat completion failed", exc_info=turn.exception())
+            yield completion_chunk(
+                completion_id, model, {"content": "\n\nSomething went wrong."}, None
+            )
+        yield completion_chunk(completion_id, model, {}, "stop")
+        yield "data: [DONE]\n\n"
+    finally:
+        # The client went away, the turn is cancelled like a /cancel.
+        turn.cancel()
+
+
+@openai_router.post("/chat/completions")
+async def chat_completions(
+    request: ChatCompletionRequest,
+    user: Annotated[User, Depends(get_openwebui_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    agent: Annotated[Any, Depends(get_agent)],
+    x_openwebui_chat_id: Annotated[str | None, Header()] = None,
+):
+    user_messages = [m for m in request.messages if m.role == "user"]
+    preview = message_text(user_messages[0]) if user_messages else ""
+    thread_id, is_new = await get_chat_thread(
+        session, user, x_openwebui_chat_id, preview
+    )
+    # The thread of a known chat has the history, only the new messages are
+    # sent. A new thread gets the whole conversation.
+    messages = to_langchain_messages(
+        request.messages if is_new else new_messages(request.messages)
+    )
+    if not messages:
+        raise HTTPException(status_code=400, detail="No new message")
+
+    tokens: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def on_token(token: str) -> None:
+        tokens.put_nowait(token)
 
+    turn = asyncio.create_task(
+        agent.send_message(messages, user, thread_id, OPENWEBUI_CHANNEL, on_token)
+    )
+    turn.add_done_callback(lambda _: tokens.put_nowait(None))
+    if request.stream:
+        return StreamingResponse(
+            stream_completion(turn, tokens, request.model),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
-@openai_router.get("/models", response_model=SyncPage[Model])
-async def list_models(openai: OpenAI = Depends(get_openai_client)):
-    return openai.models.list()
+    try:
+        await turn
+    finally:
+        turn.cancel()
+    content = []
+    while (token := tokens.get_nowait()) is not None:
+        content.append(token)
+    return {
+        "id": f"chatcmpl-{uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(content)},
+                "finish_reason": "stop",
+            }
+        ],
+    }
@@ -1,10 +1,7 @@
 import logging
 from datetime import datetime
-from typing import Annotated, Literal, cast
+from typing import TYPE_CHECKING, Annotated, Any, Literal, cast
 
-from apscheduler.job import Job
-from apscheduler.schedulers.base import BaseScheduler
-from apscheduler.triggers.cron import CronTrigger
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy import select
@@ -13,11 +10,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from dependencies import get_current_user, get_scheduler, get_session
 from models import Schedule, User
 
+if TYPE_CHECKING:
+    from apscheduler.job import Job  # type: ignore
+    from apscheduler.triggers.cron import CronTrigger  # type: ignore
+
 schedules_router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-def get_crontab(trigger: CronTrigger) -> str:
+def get_crontab(trigger: "CronTrigger") -> str:
     fields = {f.name: str(f) for f in trigger.fields}
     return f"{fields["minute"]} {fields["hour"]} {fields["day"]} {fields['month']} {fields['day_of_week']}"
 
@@ -32,7 +33,7 @@ class ResponseSchedule(BaseModel):
     state: Literal["paused"] | Literal["running"]
 
     @classmethod
-    def from_job(cls, job: Job, user_id: str) -> "ResponseSchedule":
+    def from_job(cls, job: "Job", user_id: str) -> "ResponseSchedule":
         return cls(
             id=job.id,
             user_id=user_id,
@@ -48,7 +49,7 @@ class ResponseSchedule(BaseModel):
 async def get_schedules(
     current_user: Annotated[User, Depends(get_current_user)],
     session: Annotated[AsyncSession, Depends(get_session)],
-    scheduler: Annotated[BaseScheduler, Depends(get_scheduler)],
+    scheduler: Annotated[Any, Depends(get_scheduler)],
 ) -> list[ResponseSchedule]:
     query = await session.execute(
         select(Schedule).where(Schedule.user_id == current_user.id)
@@ -68,7 +69,7 @@ async def get_schedules(
 async def update_schedule(
     current_user: Annotated[User, Depends(get_current_user)],
     session: Annotated[AsyncSession, Depends(get_session)],
-    scheduler: Annotated[BaseScheduler, Depends(get_scheduler)],
+    scheduler: Annotated[Any, Depends(get_scheduler)],
     schedule_id: str,
     in_schedule: ResponseSchedule,
 ) -> ResponseSchedule:
@@ -76,6 +77,9 @@ async def update_schedule(
     if db_schedule is None:
         raise HTTPException(status_code=404, detail="Schedule not found")
 
+    # pylint: disable-next=import-outside-toplevel
+    from apscheduler.triggers.cron import CronTrigger  # type: ignore
+
     job: Job | None = scheduler.get_job(schedule_id)
     if job is None:
         await session.delete(db_schedule)
@@ -88,8 +92,8 @@ async def update_schedule(
 
     if in_schedule.state == "running" and new_job.next_run_time is None:
         new_job.resume()
-        new_job = cast(Job, scheduler.get_job(schedule_id))
+        new_job = cast("Job", scheduler.get_job(schedule_id))
     elif in_schedule.state == "paused" and new_job.next_run_time is not None:
         new_job.pause()
-        new_job = cast(Job, scheduler.get_job(schedule_id))
+        new_job = cast("Job", scheduler.get_job(schedule_id))
     return ResponseSchedule.from_job(new_job, current_user.id)
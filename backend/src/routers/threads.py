@@ -1,13 +1,11 @@
+import base64
 import logging
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Any
 
-from fastapi import APIRouter, Depends, HTTPException
-from langchain_core.runnables.config import RunnableConfig
-from langgraph.checkpoint.base import Checkpoint
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from dependencies import get_checkpointer, get_current_user, get_session
@@ -21,46 +19,162 @@ class ResponseThread(BaseModel):
     id: str
     user_id: str
     created_at: datetime
+    preview: str | None = None
 
 
-@threads_router.get("/threads", response_model=list[ResponseThread])
+class ResponseThreadPage(BaseModel):
+    threads: list[ResponseThread]
+    # Passed back as `cursor` to get the next page, None on the last page.
+    next_cursor: str | None
+
+
+def encode_cursor(created_at: datetime, thread_id: str) -> str:
+    return base64.urlsafe_b64encode(
+        f"{created_at.isoformat()}|{thread_id}".encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        created_at, thread_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        )
+        return datetime.fromisoformat(created_at), thread_id
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+class ResponseMessages(BaseModel):
+    # The messages, newest first. Each has its position in the thread as
+    # `index`.
+    messages: list[dict[str, Any]]
+    # Passed back as `before` to get older messages, None at the start of the
+    # window.
+    next_cursor: int | None
+
+
+def dump_message(message: Any, include_tool_results: bool) -> dict[str, Any]:
+    dumped = message.model_dump()
+    if dumped["type"] == "tool" and not include_tool_results:
+        dumped["content_length"] = len(str(dumped["content"]))
+        dumped["content"] = None
+    return dumped
+
+
+def window_messages(
+    messages: list[Any],
+    before: int | None,
+    since: int | None,
+    limit: int,
+    include_tool_results: bool,
+) -> ResponseMessages:
+    """
+    Picks the `limit` newest messages before the index `before` and after the
+    index `since`.
+
+    Messages are only ever appended to a thread, so their index is a stable
+    cursor. Tool results are the bulk of a thread, so only their length is
+    returned unless `include_tool_results` is set.
+    """
+    first = 0 if since is None else since + 1
+    end = len(messages) if before is None else min(before, len(messages))
+    start = max(end - limit, first)
+    window = [
+        {"index": index, **dump_message(messages[index], include_tool_results)}
+        for index in range(end - 1, start - 1, -1)
+    ]
+    return ResponseMessages(
+        messages=window, next_cursor=start if start > first else None
+    )
+
+
+@threads_router.get("/threads", response_model=ResponseThreadPage)
 async def get_threads(
     current_user: Annotated[User, Depends(get_current_user)],
     session: Annotated[AsyncSession, Depends(get_session)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
 ):
-    result = await session.execute(
-        select(Thread)
+    # Keyset pagination on (created_at, id), so a page costs the same however
+    # many threads come before it. created_at_desc_idx serves the bound on
+    # created_at, the id only breaks ties.
+    query = (
+        select(Thread.id, Thread.created_at, Thread.preview)
         .where(Thread.user_id == current_user.id)
-        .order_by(Thread.created_at.desc())
+        .order_by(Thread.created_at.desc(), Thread.id.desc())
+        .limit(limit + 1)
     )
-    threads = result.scalars().all()
-
-    return [
-        ResponseThread(
-            id=thread.id,
-            user_id=thread.user_id,
-            created_at=thread.created_at,
+    if cursor:
+        created_at, thread_id = decode_cursor(cursor)
+        query = query.where(
+            Thread.created_at <= created_at,
+            tuple_(Thread.created_at, Thread.id) < tuple_(created_at, thread_id),
         )
-        for thread in threads
-    ]
+    rows = (await session.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return ResponseThreadPage(
+        threads=[
+            ResponseThread(
+                id=row.id,
+                user_id=current_user.id,
+                created_at=row.created_at,
+                preview=row.preview,
+            )
+            for row in rows
+        ],
+        next_cursor=next_cursor,
+    )
+
 
+async def get_user_thread(session: AsyncSession, user: User, thread_id: str) -> Thread:
+    thread = await session.get(Thread, (user.id, thread_id))
+    if thread is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return thread
 
-@threads_router.get("/threads/{thread_id}", response_model=Checkpoint)
+
+@threads_router.get("/threads/{thread_id}", response_model=ResponseThread)
 async def get_thread(
     current_user: Annotated[User, Depends(get_current_user)],
     session: Annotated[AsyncSession, Depends(get_session)],
-    checkpointer: Annotated[AsyncPostgresSaver, Depends(get_checkpointer)],
     thread_id: str,
 ):
-    result = await session.execute(select(Thread).where(Thread.id == thread_id))
-    thread = result.scalars().one()
-    if thread.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Forbidden")
+    thread = await get_user_thread(session, current_user, thread_id)
+    return ResponseThread(
+        id=thread.id,
+        user_id=thread.user_id,
+        created_at=thread.created_at,
+        preview=thread.preview,
+    )
+
+
+@threads_router.get("/threads/{thread_id}/messages", response_model=ResponseMessages)
+async def get_thread_messages(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    checkpointer: Annotated[Any, Depends(get_checkpointer)],
+    thread_id: str,
+    before: Annotated[int | None, Query(ge=0)] = None,
+    since: Annotated[int | None, Query(ge=-1)] = None,
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+    include_tool_results: bool = False,
+):
+    await get_user_thread(session, current_user, thread_id)
 
     checkpoint_tuple = await checkpointer.aget_tuple(
-        RunnableConfig(configurable={"thread_id": thread_id})
+        {"configurable": {"thread_id": thread_id}}
     )
     if not checkpoint_tuple:
         raise HTTPException(status_code=404, detail="Checkpoint not found")
 
-    return checkpoint_tuple.checkpoint
+    return window_messages(
+        checkpoint_tuple.checkpoint["channel_values"].get("messages", []),
+        before,
+        since,
+        limit,
+        include_tool_results,
+    )
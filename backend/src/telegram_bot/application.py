@@ -1,84 +1,322 @@
+import html
+import logging
+import re
+import time
 from asyncio import QueueShutDown
 from dataclasses import dataclass
-from typing import AsyncContextManager, Callable, Coroutine, Generator, cast
+from typing import (
+    AsyncContextManager,
+    Callable,
+    Coroutine,
+    Generator,
+    Iterator,
+    cast,
+)
 
-from langchain_core.messages import HumanMessage
 from sqlalchemy.ext.asyncio import AsyncSession
 from telegram import Bot, Update
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler
 from telegram.ext.filters import LOCATION
 
 from agent.agent import Agent
-from message_queue import MessageQueue
+from agent.inbox import UserInbox
+from jwt_token import invalidate_cached_user
+from message_queue import TELEGRAM_CHANNEL, MessageQueue, MessageWithUserId
+from metrics import Counter, Histogram
 from models import User
+from tracing import get_tracer
+
+TELEGRAM_MESSAGES_SENT = Counter(
+    "ragpile_telegram_messages_sent", "Messages sent to Telegram", ["status"]
+)
+TELEGRAM_SEND_DURATION = Histogram(
+    "ragpile_telegram_send_duration_seconds",
+    "Time to send a message to Telegram, all chunks included",
+)
+TELEGRAM_PLAIN_TEXT_FALLBACKS = Counter(
+    "ragpile_telegram_plain_text_fallbacks",
+    "Chunks sent as plain text because Telegram could not parse their HTML",
+)
+
+logger = logging.getLogger(__name__)
+
+
+# The tags Telegram accepts with parse_mode HTML.
+TELEGRAM_TAGS = frozenset(
+    {
+        "a",
+        "b",
+        "blockquote",
+        "code",
+        "del",
+        "em",
+        "i",
+        "ins",
+        "pre",
+        "s",
+        "span",
+        "strike",
+        "strong",
+        "tg-emoji",
+        "tg-spoiler",
+        "u",
+    }
+)
+# Telegram does not allow other tags inside these, except code inside pre.
+VERBATIM_TAGS = frozenset({"code", "pre"})
+
+# Attribute values are quoted and may contain < and >.
+_HTML_TOKEN = re.compile(
+    r"<(?P<closing>/?)(?P<name>[a-zA-Z][\w-]*)(?:\"[^\"]*\"|'[^']*'|[^'\"<>])*>"
+    r"|(?P<entity>&(?:#\d+|#x[0-9a-fA-F]+|lt|gt|amp|quot);)"
+    r"|[<>&]"
+)
+# Tags, and the halves of a tag a chunk was split in.
+_HTML_TAG = re.compile(r"<(?:\"[^\"]*\"?|'[^']*'?|[^'\"<>])*>?|^[^<>]*>")
+# Telegram only accepts a span that marks a spoiler.
+_SPOILER_SPAN = re.compile(
+    r"<span\s+class\s*=\s*(?:\"tg-spoiler\"|'tg-spoiler'|tg-spoiler)\s*>", re.IGNORECASE
+)
+
+
+def _balance_tags(message: str, allowed: frozenset[str] | None) -> str:
+    """
+    Removes the tags that are not closed and the closing tags that were not
+    opened, in one pass.
+
+    A closing tag that matches the tag under the innermost open one closes
+    both and removes the innermost. With `allowed`, the other tags and stray
+    <, > and & are escaped instead of passed through.
+    """
+    parts: list[str] = []
+    # The open tags, innermost last, with the index of their part.
+    open_tags: list[tuple[str, int]] = []
+    position = 0
+    for match in _HTML_TOKEN.finditer(message):
+        parts.append(message[position : match.start()])
+        position = match.end()
+        token = match.group()
+        name = match["name"]
+        if name is None:
+            if allowed is None or match["entity"]:
+                parts.append(token)
+            else:
+                parts.append(html.escape(token, quote=False))
+            continue
+        closing = bool(match["closing"])
+        if allowed is not None:
+            name = name.lower()
+            if (
+                name not in allowed
+                or _in_verbatim(open_tags, name, closing)
+                or (name == "span" and not _is_spoiler(token, open_tags, closing))
+            ):
+                parts.append(html.escape(token, quote=False))
+                continue
 
-
-def split_message_to_chunks(message: str, chunk_size: int = 4096) -> Generator[str]:
-    chunk_index = 0
-    content = message
-    chunk = content[0:chunk_size]
-    while chunk:
-        yield chunk
-        chunk_index += 1
-        chunk = content[chunk_index * chunk_size : (chunk_index + 1) * chunk_size]
+        if not closing:
+            open_tags.append((name, len(parts)))
+            parts.append(token)
+        elif open_tags and open_tags[-1][0] == name:
+            open_tags.pop()
+            parts.append(token)
+        elif len(open_tags) >= 2 and open_tags[-2][0] == name:
+            parts[open_tags.pop()[1]] = ""
+            open_tags.pop()
+            parts.append(token)
+    parts.append(message[position:])
+    for _, index in open_tags:
+        parts[index] = ""
+    return "".join(parts)
+
+
+def _in_verbatim(open_tags: list[tuple[str, int]], name: str, closing: bool) -> bool:
+    """Whether a tag is text of the code or pre it is in."""
+    if not open_tags or open_tags[-1][0] not in VERBATIM_TAGS:
+        return False
+    if closing:
+        return name not in (tag for tag, _ in open_tags[-2:])
+    return not (open_tags[-1][0] == "pre" and name == "code")
+
+
+def _is_spoiler(token: str, open_tags: list[tuple[str, int]], closing: bool) -> bool:
+    """Whether a span tag opens a spoiler, or closes one that is open."""
+    if closing:
+        return any(tag == "span" for tag, _ in open_tags)
+    return _SPOILER_SPAN.fullmatch(token) is not None
 
 
 def remove_unclosed_tags(message: str) -> str:
-    @dataclass
-    class Tag:
-        start: int
-        end: int
-        name: str
-        name_found: bool
-
-    def remove_tag(m: str, tag: Tag) -> str:
-        return m[: tag.start] + m[tag.end + 1 :]
-
-    tags: list[Tag] = []
-    for i, c in enumerate(message):
-        if c == "<":
-            tags.append(Tag(start=i, end=-1, name="", name_found=False))
-            continue
+    return _balance_tags(message, None)
 
-        if len(tags) == 0:
-            continue
 
-        if c == ">":
-            tags[-1].end = i
-            tags[-1].name_found = True
-            continue
+def sanitize_html(message: str) -> str:
+    """
+    Makes the HTML of the model safe to send with parse_mode HTML.
 
-        if tags[-1].name_found:
-            continue
+    Keeps the balanced tags Telegram supports and escapes everything else, so
+    `List<int>` or `a < b && c` show as written.
+    """
+    return _balance_tags(message, TELEGRAM_TAGS)
 
-        if c == " ":
-            tags[-1].name_found = True
-            continue
 
-        tags[-1].name += c
+def html_to_text(message: str) -> str:
+    """The text of sanitized HTML, for when Telegram rejects it anyway."""
+    return html.unescape(_HTML_TAG.sub("", message))
 
-    open_tags: list[Tag] = []
-    for tag in tags:
-        if tag.name[0] == "/":
-            if len(open_tags) == 0:
-                message = remove_tag(message, tag)
-                continue
 
-            if len(open_tags) >= 1 and open_tags[-1].name == tag.name[1:]:
-                open_tags.pop()
-                continue
+# Telegram counts the text of a message, without the tags, in UTF-16 code units.
+TELEGRAM_MESSAGE_LENGTH = 4096
 
-            if len(open_tags) >= 2 and open_tags[-2].name == tag.name[1:]:
-                unclosed_tag = open_tags.pop()
-                message = remove_tag(message, unclosed_tag)
-                open_tags.pop()
-                continue
-            message = remove_tag(message, tag)
+_BREAK = re.compile(
+    r"(?P<paragraph>\n\s*\n)\s*|(?P<line>\n)\s*|(?P<sentence>(?<=[.!?])\s)\s*|\s+"
+)
+PARAGRAPH, LINE, SENTENCE, WORD = 3, 2, 1, 0
+
+
+@dataclass
+class _Atom:
+    """A piece of HTML a message is never split inside."""
+
+    text: str
+    length: int
+    tag: str | None = None
+    closing: bool = False
+    # Set on whitespace, how good a place it is to split after.
+    priority: int | None = None
+
+
+@dataclass
+class _Break:
+    """A place to split, after the first `part` parts of the chunk."""
+
+    part: int
+    length: int
+    open_tags: tuple[tuple[str, str], ...]
+
+
+def utf16_length(text: str) -> int:
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _text_atoms(text: str) -> Iterator[_Atom]:
+    position = 0
+    for match in _BREAK.finditer(text):
+        if match.start() > position:
+            word = text[position : match.start()]
+            yield _Atom(word, utf16_length(word))
+        if match["paragraph"]:
+            priority = PARAGRAPH
+        elif match["line"]:
+            priority = LINE
+        elif match["sentence"]:
+            priority = SENTENCE
         else:
-            open_tags.append(tag)
-    for tag in open_tags:
-        message = remove_tag(message, tag)
-    return message
+            priority = WORD
+        yield _Atom(match.group(), utf16_length(match.group()), priority=priority)
+        position = match.end()
+    if position < len(text):
+        yield _Atom(text[position:], utf16_length(text[position:]))
+
+
+def _atoms(message: str) -> Iterator[_Atom]:
+    position = 0
+    for match in _HTML_TOKEN.finditer(message):
+        yield from _text_atoms(message[position : match.start()])
+        position = match.end()
+        token = match.group()
+        if match["name"]:
+            yield _Atom(token, 0, match["name"].lower(), bool(match["closing"]))
+        else:
+            # Entities are a single character, numeric ones maybe two units.
+            length = utf16_length(html.unescape(token)) if token.startswith("&#") else 1
+            yield _Atom(token, length)
+    yield from _text_atoms(message[position:])
+
+
+def _cut(text: str, length: int) -> list[str]:
+    """Cuts text into pieces of at most `length` UTF-16 code units."""
+    pieces = []
+    start = units = 0
+    for i, character in enumerate(text):
+        width = 2 if ord(character) > 0xFFFF else 1
+        if units + width > length:
+            pieces.append(text[start:i])
+            start, units = i, 0
+        units += width
+    pieces.append(text[start:])
+    return pieces
+
+
+def _pick_break(breaks: list[_Break | None], chunk_size: int) -> _Break | None:
+    """The best break that keeps the chunk at least half full, else the last."""
+    for brk in reversed(breaks):
+        if brk and brk.length >= chunk_size // 2:
+            return brk
+    return max(filter(None, breaks), key=lambda brk: brk.length, default=None)
+
+
+def split_message_to_chunks(
+    message: str, chunk_size: int = TELEGRAM_MESSAGE_LENGTH
+) -> Generator[str]:
+    """
+    Splits sanitized HTML into chunks Telegram accepts, as they fill up.
+
+    A chunk is split after the last paragraph, line, sentence or word, the
+    first of those that keeps it at least half full, and inside a word only
+    when there is none. Tags and entities are never split. The tags open at a
+    split are closed at the end of the chunk and opened again in the next.
+    """
+    parts: list[str] = []
+    length = 0
+    # The name and the opening tag of the open tags, innermost last.
+    open_tags: list[tuple[str, str]] = []
+    # The last break of each priority in the current chunk.
+    breaks: list[_Break | None] = [None] * 4
+
+    for atom in _atoms(message):
+        while length and length + atom.length > chunk_size:
+            brk = _pick_break(breaks, chunk_size) or _Break(
+                len(parts), length, tuple(open_tags)
+            )
+            closing = "".join(f"</{name}>" for name, _ in reversed(brk.open_tags))
+            chunk = "".join(parts[: brk.part]) + closing
+            if html_to_text(chunk).strip():
+                yield chunk
+            parts = ["".join(tag for _, tag in brk.open_tags)] + parts[brk.part :]
+            length -= brk.length
+            breaks = [
+                (
+                    _Break(b.part - brk.part + 1, b.length - brk.length, b.open_tags)
+                    if b and b.part > brk.part
+                    else None
+                )
+                for b in breaks
+            ]
+
+        if atom.length > chunk_size:
+            *pieces, last = _cut(atom.text, chunk_size)
+            for piece in pieces:
+                closing = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+                yield "".join(parts) + piece + closing
+                parts = ["".join(tag for _, tag in open_tags)]
+            atom = _Atom(last, utf16_length(last), priority=atom.priority)
+
+        parts.append(atom.text)
+        length += atom.length
+        if atom.tag and not atom.closing:
+            open_tags.append((atom.tag, atom.text))
+        elif atom.tag and open_tags and open_tags[-1][0] == atom.tag:
+            open_tags.pop()
+        elif atom.priority is not None:
+            breaks[atom.priority] = _Break(len(parts), length, tuple(open_tags))
+
+    chunk = "".join(parts)
+    if html_to_text(chunk).strip():
+        yield chunk
 
 
 class TelegramApplication(Application):
@@ -89,11 +327,13 @@ class TelegramApplication(Application):
         queue: MessageQueue,
         application: Application,
         session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        inbox: UserInbox,
     ):
         self.application = application
         self.queue = queue
         self.queue.register(self.QUEUE_HANDLE)
         self.session_factory = session_factory
+        self.inbox = inbox
 
     async def send_pending_messages(self) -> None:
         while True:
@@ -101,25 +341,51 @@ class TelegramApplication(Application):
                 message_with_user_id = await self.queue.get(self.QUEUE_HANDLE)
             except QueueShutDown:
                 break
+            if not isinstance(message_with_user_id, MessageWithUserId):
+                continue
+            if message_with_user_id.channel != TELEGRAM_CHANNEL:
+                continue
             if message_with_user_id.message.type == "tool":
                 continue
             if not message_with_user_id.message.content:
                 continue
-            async with self.session_factory() as session:
-                user = cast(User, await session.get(User, message_with_user_id.user_id))
-                if not user:
-                    raise ValueError(
-                        "User could not be found when processing a message in queue. That should not have happened."
+            with get_tracer().span(
+                "telegram.send", parent=message_with_user_id.trace_context
+            ) as span:
+                async with self.session_factory() as session:
+                    user = cast(
+                        User, await session.get(User, message_with_user_id.user_id)
                     )
-                chat_id = user.integrations["telegram"]["effective_chat_id"]
-            for chunk in split_message_to_chunks(
-                str(message_with_user_id.message.content)
-            ):
-                await cast(Bot, self.application.bot).send_message(
-                    chat_id,
-                    chunk,
-                    parse_mode="HTML",
-                )
+                    if not user:
+                        raise ValueError(
+                            "User could not be found when processing a message in queue. That should not have happened."
+                        )
+                    chat_id = user.integrations["telegram"]["effective_chat_id"]
+                chunks = 0
+                start = time.perf_counter()
+                status = "error"
+                try:
+                    for chunk in split_message_to_chunks(
+                        sanitize_html(str(message_with_user_id.message.content))
+                    ):
+                        await self.send_chunk(chat_id, chunk)
+                        chunks += 1
+                    status = "ok"
+                finally:
+                    TELEGRAM_SEND_DURATION.observe(time.perf_counter() - start)
+                    TELEGRAM_MESSAGES_SENT.inc(status=status)
+                span.set_attribute("telegram.chunks", chunks)
+
+    async def send_chunk(self, chat_id: str, chunk: str) -> None:
+        bot = cast(Bot, self.application.bot)
+        try:
+            await bot.send_message(chat_id, chunk, parse_mode="HTML")
+        except BadRequest as exc:
+            if "can't parse entities" not in exc.message.lower():
+                raise
+            logger.warning("Sending a chunk as plain text: %s", exc.message)
+            TELEGRAM_PLAIN_TEXT_FALLBACKS.inc()
+            await bot.send_message(chat_id, html_to_text(chunk))
 
 
 def new_telegram_application(
@@ -127,13 +393,20 @@ def new_telegram_application(
     session_factory: Callable[[], AsyncContextManager[AsyncSession]],
     agent: Agent,
     queue: MessageQueue,
+    base_url: str | None = None,
 ) -> TelegramApplication:
-    application = Application.builder().token(token).build()
+    builder = Application.builder().token(token)
+    if base_url:
+        # Another Bot API server, like the fake one of the benchmarks.
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    inbox = UserInbox(agent)
     application.add_handler(CommandHandler("start", start(session_factory)))
-    application.add_handler(CommandHandler("clear", clear(session_factory)))
+    application.add_handler(CommandHandler("clear", clear(agent, session_factory)))
+    application.add_handler(CommandHandler("cancel", cancel(inbox, session_factory)))
     application.add_handler(MessageHandler(LOCATION, set_location(session_factory)))
-    application.add_handler(MessageHandler(None, reply(agent, session_factory)))
-    return TelegramApplication(queue, application, session_factory)
+    application.add_handler(MessageHandler(None, reply(inbox, session_factory)))
+    return TelegramApplication(queue, application, session_factory, inbox)
 
 
 def start(
@@ -153,40 +426,62 @@ def start(
                 return
             if not update.effective_chat:
                 return
-            user.integrations["telegram"]["effective_chat_id"] = str(
-                update.effective_chat.id
+            await session.execute(
+                User.update_integration(
+                    user.id,
+                    "telegram",
+                    effective_chat_id=str(update.effective_chat.id),
+                )
             )
-            await session.execute(User.update_integrations(user))
-            await update.message.reply_text(user.email)
+        invalidate_cached_user(user.id)
+        await update.message.reply_text(user.email)
 
     return _start
 
 
 def clear(
+    agent: Agent,
     session_factory: Callable[[], AsyncContextManager[AsyncSession]],
 ) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Coroutine[None, None, None]]:
 
     async def _clear(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        assert update.message
+        assert update.message.from_user
         async with session_factory() as session:
-            assert update.message
-            assert update.message.from_user
-            user = cast(
-                User,
-                await session.scalar(
-                    User.select_user_from_telegram_id(update.message.from_user.id)
-                ),
+            user = await session.scalar(
+                User.select_user_from_telegram_id(update.message.from_user.id)
             )
-            if not user:
-                return
-            user.integrations["telegram"]["thread_id"] = ""
-            await session.execute(User.update_integrations(user))
-            await session.commit()
+        if not user:
+            return
+        await agent.activity.reset(user.id)
 
     return _clear
 
 
+def cancel(
+    inbox: UserInbox,
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Coroutine[None, None, None]]:
+
+    async def _cancel(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        assert update.message
+        assert update.message.from_user
+        async with session_factory() as session:
+            user = await session.scalar(
+                User.select_user_from_telegram_id(update.message.from_user.id)
+            )
+        if not user:
+            return
+        if inbox.cancel(user.id):
+            await update.message.reply_text("Cancelled")
+        else:
+            await update.message.reply_text("Nothing to cancel")
+
+    return _cancel
+
+
 def reply(
-    agent: Agent,
+    inbox: UserInbox,
     session_factory: Callable[[], AsyncContextManager[AsyncSession]],
 ) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Coroutine[None, None, None]]:
     async def _reply(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
@@ -194,20 +489,25 @@ def reply(
         assert update.effective_chat
         assert update.message.from_user
 
-        user = None
-        async with session_factory() as session:
-            user = cast(
-                User,
-                await session.scalar(
-                    User.select_user_from_telegram_id(update.message.from_user.id)
-                ),
-            )
-            if not user:
+        with get_tracer().span(
+            "telegram.receive", telegram_user_id=update.message.from_user.id
+        ):
+            user = None
+            async with session_factory() as session:
+                user = cast(
+                    User,
+                    await session.scalar(
+                        User.select_user_from_telegram_id(update.message.from_user.id)
+                    ),
+                )
+                if not user:
+                    return
+                session.expunge(user)
+            if not update.message.text:
                 return
-            session.expunge(user)
-        if not update.message.text:
-            return
-        await agent.send_message([HumanMessage(content=update.message.text)], user)
+            # The turn runs in the background, so the updates that follow,
+            # like /cancel, are handled while it runs.
+            inbox.submit(user, update.message.text)
 
     return _reply
 
@@ -230,14 +530,15 @@ def set_location(
             )
             if not user:
                 return
-            user.integrations["telegram"]["latitude"] = str(
-                update.effective_message.location.latitude
-            )
-            user.integrations["telegram"]["longitude"] = str(
-                update.effective_message.location.longitude
+            location = update.effective_message.location
+            await session.execute(
+                User.update_integration(
+                    user.id,
+                    "telegram",
+                    latitude=str(location.latitude),
+                    longitude=str(location.longitude),
+                )
             )
-
-            await session.execute(User.update_integrations(user))
-            await session.commit()
+        invalidate_cached_user(user.id)
 
     return _set_location
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-import asyncio
+import functools
 import logging
+import time
 from contextlib import contextmanager
 from typing import TYPE_CHECKING, Any
 
@@ -10,6 +11,7 @@ from langchain_core.runnables.config import RunnableConfig
 from langchain_core.tools.base import BaseTool
 from pydantic import PrivateAttr
 
+from metrics import Counter, Histogram
 from models import User
 
 if TYPE_CHECKING:
@@ -17,18 +19,42 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+TOOL_CALLS = Counter("ragpile_tool_calls", "Tool calls", ["tool", "status"])
+TOOL_DURATION = Histogram(
+    "ragpile_tool_duration_seconds", "Duration of tool calls", ["tool"]
+)
+
+
+def _instrumented(name: str, arun: Any) -> Any:
+    @functools.wraps(arun)
+    async def _arun(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = await arun(*args, **kwargs)
+            status = "ok"
+            return result
+        finally:
+            TOOL_DURATION.observe(time.perf_counter() - start, tool=name)
+            TOOL_CALLS.inc(tool=name, status=status)
+
+    return _arun
+
 
 class AsyncBaseTool(BaseTool):
     handle_tool_error: bool = True
     handle_validation_error: bool = True
     verbose: bool = True
     _dependencies: ToolDependencies = PrivateAttr()
-    _bound_user_id: str | None = PrivateAttr(default=None)
     user_confirmaton: bool = False
 
-    def __init__(self, **kwargs: Any) -> None:
-        super().__init__(**kwargs)
-        self._bound_user_id = None
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs: Any) -> None:
+        super().__pydantic_init_subclass__(**kwargs)
+        # Every tool reports its calls, whether it runs in the agent or in a job.
+        if "_arun" in cls.__dict__:
+            name = cls.model_fields["name"].default
+            cls._arun = _instrumented(name, cls.__dict__["_arun"])  # type: ignore
 
     def with_dependencies(self, dependencies: ToolDependencies) -> AsyncBaseTool:
         self._dependencies = dependencies
@@ -47,18 +73,13 @@ class AsyncBaseTool(BaseTool):
             session.expunge(user)
         return user
 
-    def bind_user_id(self, user_id: str) -> None:
-        self._bound_user_id = user_id
-
     def _get_user_id(self, config: RunnableConfig) -> str:
-        if self._bound_user_id:
-            return self._bound_user_id
         return config["configurable"]["user_id"]
 
     def _run(self, *args, **kwargs):
-        return asyncio.get_event_loop().run_until_complete(
-            self._arun(*args, **kwargs, config=RunnableConfig())
-        )
+        # The clients of the tools are bound to the event loop, so a tool cannot
+        # run on a loop of its own. Scheduled jobs call them through JobTool.
+        raise NotImplementedError(f"{self.name} can only be called asynchronously")
 
     def _create_credentials(
         self, user: User, scope: str, integration_key: str
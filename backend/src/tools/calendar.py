@@ -1,16 +1,27 @@
+import asyncio
 import logging
-from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Type
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional, Type
 
 from googleapiclient.discovery import build  # type: ignore
+from googleapiclient.errors import HttpError  # type: ignore
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from models import CachedCalendarEvent, CalendarSync, User
 from tools.base import AsyncBaseTool
 
 logger = logging.getLogger(__name__)
 
+CALENDAR_SCOPE = "https://www.googleapis.com/auth/calendar.events"
+# Google recommends at most 50 requests per batch.
+BATCH_SIZE = 50
+
 
 @dataclass
 class CalendarEvent:
@@ -25,8 +36,216 @@ class CalendarEvent:
     updated: Optional[str]
 
 
-class EmptyInput(BaseModel):
-    pass
+@dataclass
+class BatchEventResult:
+    event: Optional[CalendarEvent]
+    error: Optional[str]
+
+
+def extract_event_data(event: Dict[str, Any]) -> CalendarEvent:
+    start = event.get("start", {})
+    end = event.get("end", {})
+
+    start_time = start.get("dateTime") or start.get("date")
+    end_time = end.get("dateTime") or end.get("date")
+
+    attendees = []
+    if "attendees" in event:
+        attendees = [attendee.get("email", "") for attendee in event["attendees"]]
+
+    return CalendarEvent(
+        id=event.get("id", ""),
+        summary=event.get("summary", ""),
+        description=event.get("description"),
+        start=start_time,
+        end=end_time,
+        location=event.get("location"),
+        attendees=attendees,
+        created=event.get("created"),
+        updated=event.get("updated"),
+    )
+
+
+def parse_event_time(value: Dict[str, str]) -> datetime:
+    """The time of a start or an end, all-day events start at midnight UTC."""
+    if "dateTime" in value:
+        return datetime.fromisoformat(value["dateTime"]).astimezone(timezone.utc)
+    return datetime.fromisoformat(value["date"]).replace(tzinfo=timezone.utc)
+
+
+def parse_time_filter(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def event_body(
+    summary: Optional[str] = None,
+    start_datetime: Optional[str] = None,
+    end_datetime: Optional[str] = None,
+    description: Optional[str] = None,
+    location: Optional[str] = None,
+    attendees: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """The body of an insert, or of a patch with only the given fields."""
+    body: Dict[str, Any] = {}
+    if summary:
+        body["summary"] = summary
+    if start_datetime:
+        body["start"] = {"dateTime": start_datetime, "timeZone": "UTC"}
+    if end_datetime:
+        body["end"] = {"dateTime": end_datetime, "timeZone": "UTC"}
+    if description:
+        body["description"] = description
+    if location:
+        body["location"] = location
+    if attendees:
+        body["attendees"] = [{"email": email} for email in attendees]
+    return body
+
+
+class CalendarCache:
+    """
+    A copy of the primary calendar of each user, kept up to date with
+    incremental syncs.
+
+    The first sync fetches the events from `history` ago on, the next ones
+    only what changed since the sync token of the previous one. Within
+    `max_age` of a sync, reads are served without calling Google.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        max_age: float = 60,
+        history: timedelta = timedelta(days=30),
+    ):
+        self.session_factory = session_factory
+        self.max_age = max_age
+        self.history = history
+        self._synced_at: dict[str, float] = {}
+        self._locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def sync(self, user_id: str, service_factory: Callable[[], Any]) -> None:
+        """Syncs the calendar of a user, unless it was synced within max_age."""
+        async with self._locks[user_id]:
+            synced_at = self._synced_at.get(user_id)
+            if synced_at is not None and time.monotonic() - synced_at < self.max_age:
+                return
+            async with self.session_factory() as session:
+                sync_token = await session.scalar(
+                    select(CalendarSync.sync_token).where(
+                        CalendarSync.user_id == user_id
+                    )
+                )
+            service = service_factory()
+            try:
+                items, next_sync_token = await self._fetch(service, sync_token)
+            except HttpError as exc:
+                if sync_token is None or exc.resp.status != 410:
+                    raise
+                # The sync token expired, the calendar is fetched again.
+                logger.info("Full calendar sync for user %s", user_id)
+                sync_token = None
+                items, next_sync_token = await self._fetch(service, None)
+
+            async with self.session_factory() as session:
+                if sync_token is None:
+                    await session.execute(
+                        delete(CachedCalendarEvent).where(
+                            CachedCalendarEvent.user_id == user_id
+                        )
+                    )
+                await self._apply(session, user_id, items)
+                await session.merge(
+                    CalendarSync(user_id=user_id, sync_token=next_sync_token)
+                )
+            self._synced_at[user_id] = time.monotonic()
+            logger.info("Synced %d calendar changes for user %s", len(items), user_id)
+
+    async def save(self, user_id: str, items: List[Dict[str, Any]]) -> None:
+        """Writes events returned by Google, so they are listed before the next sync."""
+        if not items:
+            return
+        async with self.session_factory() as session:
+            await self._apply(session, user_id, items)
+
+    async def list(
+        self,
+        user_id: str,
+        time_min: datetime,
+        time_max: Optional[datetime] = None,
+        limit: int = 50,
+    ) -> List[CalendarEvent]:
+        """The events that overlap the window, by start time."""
+        query = (
+            select(CachedCalendarEvent.event)
+            .where(
+                CachedCalendarEvent.user_id == user_id,
+                CachedCalendarEvent.ends_at > time_min,
+            )
+            .order_by(CachedCalendarEvent.starts_at)
+            .limit(limit)
+        )
+        if time_max is not None:
+            query = query.where(CachedCalendarEvent.starts_at < time_max)
+        async with self.session_factory() as session:
+            events = (await session.scalars(query)).all()
+        return [CalendarEvent(**event) for event in events]
+
+    async def _fetch(
+        self, service: Any, sync_token: Optional[str]
+    ) -> tuple[List[Dict[str, Any]], str]:
+        params: Dict[str, Any] = {
+            "calendarId": "primary",
+            "singleEvents": True,
+            "maxResults": 250,
+        }
+        if sync_token:
+            params["syncToken"] = sync_token
+        else:
+            params["timeMin"] = (datetime.now(timezone.utc) - self.history).isoformat()
+        items: List[Dict[str, Any]] = []
+        while True:
+            result = await asyncio.to_thread(service.events().list(**params).execute)
+            items.extend(result.get("items", []))
+            if "nextPageToken" not in result:
+                return items, result["nextSyncToken"]
+            params["pageToken"] = result["nextPageToken"]
+
+    async def _apply(
+        self, session: AsyncSession, user_id: str, items: List[Dict[str, Any]]
+    ) -> None:
+        # The last change of an event wins.
+        latest = {item["id"]: item for item in items}
+        await session.execute(
+            delete(CachedCalendarEvent).where(
+                CachedCalendarEvent.user_id == user_id,
+                CachedCalendarEvent.id.in_(list(latest)),
+            )
+        )
+        rows = [
+            {
+                "user_id": user_id,
+                "id": event_id,
+                "starts_at": parse_event_time(item["start"]),
+                "ends_at": parse_event_time(item["end"]),
+                "event": asdict(extract_event_data(item)),
+            }
+            for event_id, item in latest.items()
+            if item.get("status") != "cancelled"
+        ]
+        if rows:
+            await session.execute(insert(CachedCalendarEvent), rows)
+
+
+class ListEventsInput(BaseModel):
+    time_min: Optional[str] = None
+    time_max: Optional[str] = None
+    max_results: int = 50
 
 
 class CreateEventInput(BaseModel):
@@ -38,71 +257,57 @@ class CreateEventInput(BaseModel):
     attendees: Optional[List[str]] = None
 
 
-class CalendarListEventsTool(AsyncBaseTool):
-    name: str = "calendar_list_events"
-    description: str = "List upcoming calendar events from Google Calendar"
-    args_schema: Type[BaseModel] = EmptyInput
-
-    async def _arun(self, config: RunnableConfig) -> List[CalendarEvent]:
-        credentials = self._create_credentials(
-            await self.get_user(config),
-            "https://www.googleapis.com/auth/calendar.events",
-            "calendar",
-        )
-        service = build("calendar", "v3", credentials=credentials)
-
-        now = datetime.now(tz=timezone.utc).isoformat() + "Z"
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=now,
-                maxResults=50,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
+class BatchEventInput(BaseModel):
+    # Updates the event when set, creates one otherwise.
+    event_id: Optional[str] = None
+    summary: Optional[str] = None
+    description: Optional[str] = None
+    start_datetime: Optional[str] = None
+    end_datetime: Optional[str] = None
+    location: Optional[str] = None
+    attendees: Optional[List[str]] = None
 
-        events = events_result.get("items", [])
 
-        if not events:
-            logger.info("No upcoming events found")
-            return []
+class BatchEventsInput(BaseModel):
+    events: List[BatchEventInput]
 
-        calendar_events = []
-        for event in events:
-            event_data = self._extract_event_data(event)
-            calendar_events.append(event_data)
 
-        logger.info("Retrieved %d upcoming events", len(calendar_events))
-        return calendar_events
+class CalendarTool(AsyncBaseTool):
+    def _service(self, user: User) -> Any:
+        credentials = self._create_credentials(user, CALENDAR_SCOPE, "calendar")
+        return build("calendar", "v3", credentials=credentials)
+
+
+class CalendarListEventsTool(CalendarTool):
+    name: str = "calendar_list_events"
+    description: str = (
+        "List events from Google Calendar that overlap the window from time_min "
+        "to time_max, ISO 8601 datetimes. Without them, lists the upcoming events."
+    )
+    args_schema: Type[BaseModel] = ListEventsInput
 
-    def _extract_event_data(self, event: Dict[str, Any]) -> CalendarEvent:
-        start = event.get("start", {})
-        end = event.get("end", {})
-
-        start_time = start.get("dateTime") or start.get("date")
-        end_time = end.get("dateTime") or end.get("date")
-
-        attendees = []
-        if "attendees" in event:
-            attendees = [attendee.get("email", "") for attendee in event["attendees"]]
-
-        return CalendarEvent(
-            id=event.get("id", ""),
-            summary=event.get("summary", ""),
-            description=event.get("description"),
-            start=start_time,
-            end=end_time,
-            location=event.get("location"),
-            attendees=attendees,
-            created=event.get("created"),
-            updated=event.get("updated"),
+    async def _arun(
+        self,
+        config: RunnableConfig,
+        time_min: Optional[str] = None,
+        time_max: Optional[str] = None,
+        max_results: int = 50,
+    ) -> List[CalendarEvent]:
+        user = await self.get_user(config)
+        cache = self.dependencies.calendar_cache
+        await cache.sync(user.id, lambda: self._service(user))
+
+        calendar_events = await cache.list(
+            user.id,
+            parse_time_filter(time_min) or datetime.now(tz=timezone.utc),
+            parse_time_filter(time_max),
+            max_results,
         )
+        logger.info("Retrieved %d calendar events", len(calendar_events))
+        return calendar_events
 
 
-class CalendarCreateEventTool(AsyncBaseTool):
+class CalendarCreateEventTool(CalendarTool):
     name: str = "calendar_create_event"
     description: str = "Create a new event in Google Calendar"
     args_schema: Type[BaseModel] = CreateEventInput
@@ -117,60 +322,79 @@ class CalendarCreateEventTool(AsyncBaseTool):
         attendees: Optional[List[str]],
         config: RunnableConfig,
     ) -> CalendarEvent:
-        credentials = self._create_credentials(
-            await self.get_user(config),
-            "https://www.googleapis.com/auth/calendar.events",
-            "calendar",
+        user = await self.get_user(config)
+        service = self._service(user)
+        body = event_body(
+            summary, start_datetime, end_datetime, description, location, attendees
         )
-        service = build("calendar", "v3", credentials=credentials)
-
-        event_body = {
-            "summary": summary,
-            "start": {"dateTime": start_datetime, "timeZone": "UTC"},
-            "end": {"dateTime": end_datetime, "timeZone": "UTC"},
-        }
-
-        if description:
-            event_body["description"] = description
-
-        if location:
-            event_body["location"] = location
-
-        if attendees:
-            event_body["attendees"] = [{"email": email} for email in attendees]
 
         try:
-            created_event = (
-                service.events().insert(calendarId="primary", body=event_body).execute()
+            created_event = await asyncio.to_thread(
+                service.events().insert(calendarId="primary", body=body).execute
             )
-
-            event_data = self._extract_event_data(created_event)
-            logger.info("Created calendar event: %s", summary)
-            return event_data
-
         except Exception as e:
             logger.error("Error creating calendar event '%s': %s", summary, str(e))
             raise
 
-    def _extract_event_data(self, event: Dict[str, Any]) -> CalendarEvent:
-        start = event.get("start", {})
-        end = event.get("end", {})
-
-        start_time = start.get("dateTime") or start.get("date")
-        end_time = end.get("dateTime") or end.get("date")
-
-        attendees = []
-        if "attendees" in event:
-            attendees = [attendee.get("email", "") for attendee in event["attendees"]]
-
-        return CalendarEvent(
-            id=event.get("id", ""),
-            summary=event.get("summary", ""),
-            description=event.get("description"),
-            start=start_time,
-            end=end_time,
-            location=event.get("location"),
-            attendees=attendees,
-            created=event.get("created"),
-            updated=event.get("updated"),
-        )
+        await self.dependencies.calendar_cache.save(user.id, [created_event])
+        logger.info("Created calendar event: %s", summary)
+        return extract_event_data(created_event)
+
+
+class CalendarBatchEventsTool(CalendarTool):
+    name: str = "calendar_batch_events"
+    description: str = """
+        Create or update several events in Google Calendar at once.
+        An event with an event_id updates that event, only the given fields
+        change. An event without one is created, it needs a summary,
+        start_datetime and end_datetime.
+        The results are in the order of the events, each with the event or an error.
+    """
+    args_schema: Type[BaseModel] = BatchEventsInput
+
+    async def _arun(
+        self, events: List[BatchEventInput], config: RunnableConfig
+    ) -> List[BatchEventResult]:
+        user = await self.get_user(config)
+        service = self._service(user)
+        results: List[Optional[BatchEventResult]] = [None] * len(events)
+        saved: List[Dict[str, Any]] = []
+
+        def callback(request_id: str, response: Any, exception: Any) -> None:
+            index = int(request_id)
+            if exception is not None:
+                results[index] = BatchEventResult(event=None, error=str(exception))
+                return
+            results[index] = BatchEventResult(
+                event=extract_event_data(response), error=None
+            )
+            saved.append(response)
+
+        requests = []
+        for index, event in enumerate(events):
+            body = event_body(
+                **event.model_dump(exclude={"event_id"}, exclude_none=True)
+            )
+            if event.event_id:
+                request = service.events().patch(
+                    calendarId="primary", eventId=event.event_id, body=body
+                )
+            elif event.summary and event.start_datetime and event.end_datetime:
+                request = service.events().insert(calendarId="primary", body=body)
+            else:
+                results[index] = BatchEventResult(
+                    event=None,
+                    error="Needs a summary, start_datetime and end_datetime",
+                )
+                continue
+            requests.append((str(index), request))
+
+        for start in range(0, len(requests), BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id, request in requests[start : start + BATCH_SIZE]:
+                batch.add(request, request_id=request_id)
+            await asyncio.to_thread(batch.execute)
+
+        await self.dependencies.calendar_cache.save(user.id, saved)
+        logger.info("Wrote %d of %d calendar events", len(saved), len(events))
+        return [result for result in results if result is not None]
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import logging
 from dataclasses import dataclass
@@ -40,11 +41,11 @@ class GmailReadUnreadTool(AsyncBaseTool):
             await self.get_user(config), "https://mail.google.com/", "email"
         )
         service = build("gmail", "v1", credentials=credentials)
-        results = (
+        results = await asyncio.to_thread(
             service.users()
             .messages()
             .list(userId="me", q="is:unread in:inbox", maxResults=100)
-            .execute()
+            .execute
         )
 
         messages = results.get("messages", [])
@@ -56,8 +57,8 @@ class GmailReadUnreadTool(AsyncBaseTool):
         unread_emails = []
 
         for message in messages:
-            msg = (
-                service.users().messages().get(userId="me", id=message["id"]).execute()
+            msg = await asyncio.to_thread(
+                service.users().messages().get(userId="me", id=message["id"]).execute
             )
 
             email_data = self._extract_email_data(msg)
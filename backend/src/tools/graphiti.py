@@ -1,10 +1,13 @@
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Type
 
 from graphiti_core.nodes import EpisodeType
 from langchain_core.runnables.config import RunnableConfig
+from langchain_core.tools import ToolException
 from pydantic import BaseModel
 
+from memory.ingestion import EpisodeQueue, EpisodeQueueFullError
 from tools.base import AsyncBaseTool
 
 
@@ -14,17 +17,24 @@ class AddEpisodeInput(BaseModel):
     source: EpisodeType
 
 
+@dataclass
+class QueuedEpisode:
+    queue_depth: int
+
+
 class GraphitiAddEpisode(AsyncBaseTool):
     name: str = "graphiti_add_episode"
     description: str = """
         Add episode to Graphiti a long term graph based memory,
         use this to store memories about the user.
-        An episode can be a user message, an incoming tool response, 
+        An episode can be a user message, an incoming tool response,
         that seems useful to keep in memory etc.
         Use it to store important information about the user,
         that can be used in future conversations.
         Always pass in the messages sent by the user and try to figure out
         important results from tool calls to pass in.
+        The episode is stored in the background, so it may take a little while
+        before it can be recalled.
 
         name: find a short name that best describes the episode
         episode_body: the text of the episode
@@ -34,12 +44,17 @@ class GraphitiAddEpisode(AsyncBaseTool):
 
     async def _arun(
         self, name: str, episode_body: str, source: EpisodeType, config: RunnableConfig
-    ) -> None:
-        await self.dependencies.graphiti.add_episode(
-            group_id=self._get_user_id(config),
-            name=name,
-            episode_body=episode_body,
-            source=source,
-            source_description="",
-            reference_time=datetime.now(timezone.utc),
-        )
+    ) -> QueuedEpisode:
+        try:
+            queue_depth = await EpisodeQueue(self.dependencies.session_factory).enqueue(
+                group_id=self._get_user_id(config),
+                name=name,
+                body=episode_body,
+                source=source,
+                reference_time=datetime.now(timezone.utc),
+            )
+        except EpisodeQueueFullError as e:
+            raise ToolException(
+                f"The memory is busy, try to store this episode later. {e}"
+            ) from e
+        return QueuedEpisode(queue_depth=queue_depth)
@@ -1,9 +1,12 @@
 import logging
+import math
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Optional
 
 import aiohttp
 
+from cache import TTLCache
+
 
 @dataclass
 class Place:
@@ -25,17 +28,44 @@ FIELDS_TEXT_SEARCH = [
 
 FIELDS_PLACE_DETAILS = ["*"]
 
+# Two decimals are roughly a kilometer, close enough to share "near me" results.
+LOCATION_PRECISION = 2
+RADIUS_BUCKET_METERS = 1000
+
 logger = logging.getLogger(__name__)
 
 
+def text_search_cache_key(
+    query: str, location: tuple[float, float], radius: float
+) -> tuple[Any, ...]:
+    return (
+        "text_search",
+        " ".join(query.lower().split()),
+        round(location[0], LOCATION_PRECISION),
+        round(location[1], LOCATION_PRECISION),
+        math.ceil(radius / RADIUS_BUCKET_METERS),
+    )
+
+
 class MapsClient:
-    def __init__(self, session: aiohttp.ClientSession, api_key: str):
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        api_key: str,
+        cache: TTLCache[tuple[Any, ...], Any] | None = None,
+    ):
         self.api_key = api_key
         self.session = session
+        self.cache = cache
 
     async def text_search(
         self, query: str, location: tuple[float, float], radius: float
     ) -> list[Place]:
+        key = text_search_cache_key(query, location, radius)
+        if self.cache is not None and (places := self.cache.get(key)) is not None:
+            logger.info("Text search cache hit for %s", query)
+            return places
+
         res = await self.session.post(
             "https://places.googleapis.com/v1/places:searchText",
             json={
@@ -57,8 +87,8 @@ class MapsClient:
             raise ValueError(
                 f"Text search failed with status code {res.status} and body {payload}"
             )
-        logger.info(payload)
-        return [
+        logger.debug(payload)
+        places = [
             Place(
                 name=place["name"],
                 url=place["googleMapsUri"],
@@ -67,15 +97,26 @@ class MapsClient:
                 rating=place.get("rating"),
                 review_summary="",
             )
-            for place in payload["places"]
+            for place in payload.get("places", [])
         ]
+        logger.info("Text search for %s returned %d places", query, len(places))
+        if self.cache is not None:
+            self.cache.set(key, places)
+        return places
+
+    async def place_details(
+        self, place_name: str, fields: list[str] | None = None
+    ) -> dict:
+        field_mask = ",".join(fields or FIELDS_PLACE_DETAILS)
+        key = ("place_details", place_name, field_mask)
+        if self.cache is not None and (details := self.cache.get(key)) is not None:
+            return details
 
-    async def place_details(self, place_name: str) -> dict:
         res = await self.session.get(
             f"https://places.googleapis.com/v1/{place_name}",
             headers={
                 "X-Goog-Api-Key": self.api_key,
-                "X-Goog-fieldMask": ",".join(FIELDS_PLACE_DETAILS),
+                "X-Goog-fieldMask": field_mask,
             },
         )
         payload = await res.json()
@@ -83,5 +124,7 @@ class MapsClient:
             raise ValueError(
                 f"Place details failed with status code {res.status} and body {payload}"
             )
-        logger.info(payload)
+        logger.debug(payload)
+        if self.cache is not None:
+            self.cache.set(key, payload)
         return payload
@@ -1,6 +1,5 @@
 from typing import List, Type
 
-import aiohttp
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel
 
@@ -26,17 +25,18 @@ class GoogleMapsPlacesSearchTool(AsyncBaseTool):
         self, config: RunnableConfig, query: str, radius: float = 5000.0, **_kwargs
     ) -> List[Place]:
         user = await self.get_user(config)
-        async with aiohttp.ClientSession() as session:
-            client = MapsClient(
-                session=session, api_key=self.dependencies.google_search_api_key
-            )
-            return await client.text_search(
-                query=query,
-                location=(
-                    (
-                        float(user.integrations["telegram"]["latitude"]),
-                        float(user.integrations["telegram"]["longitude"]),
-                    )
-                ),
-                radius=radius,
-            )
+        client = MapsClient(
+            session=self.dependencies.http_session(),
+            api_key=self.dependencies.google_search_api_key,
+            cache=self.dependencies.maps_cache,
+        )
+        return await client.text_search(
+            query=query,
+            location=(
+                (
+                    float(user.integrations["telegram"]["latitude"]),
+                    float(user.integrations["telegram"]["longitude"]),
+                )
+            ),
+            radius=radius,
+        )
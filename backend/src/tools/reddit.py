@@ -1,11 +1,18 @@
+import asyncio
+import time
 from dataclasses import dataclass
 from enum import Enum
 
 from asyncpraw.reddit import Submission
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
+from cache import TTLCache
 from tools.base import AsyncBaseTool
 
+SEARCH_SCAN_LIMIT = 100
+MAX_CONCURRENT_FETCHES = 4
+COMMENTS_CACHE_TTL = 300
+
 
 class TimeFilter(str, Enum):
     ALL = "all"
@@ -19,6 +26,7 @@ class TimeFilter(str, Enum):
 class RedditSearchInput(BaseModel):
     query: str
     time_filter: TimeFilter = TimeFilter.ALL
+    limit: int = 20
 
 
 @dataclass
@@ -40,16 +48,21 @@ class RedditSearchTool(AsyncBaseTool):
     args_schema: type[BaseModel] = RedditSearchInput
 
     async def _arun(
-        self, query: str, time_filter: TimeFilter = TimeFilter.ALL, **kwargs
+        self,
+        query: str,
+        time_filter: TimeFilter = TimeFilter.ALL,
+        limit: int = 20,
+        **kwargs,
     ) -> list[RedditSearchResult]:
         subreddit = await self.dependencies.reddit_client.subreddit("all", fetch=False)
         results: list[RedditSearchResult] = []
+        # The listing is fetched page by page, stop as soon as enough posts pass the filter.
         async for submission in subreddit.search(
             query,
             time_filter=time_filter.value,
             syntax="lucene",
             sort="hot",
-            limit=50,
+            limit=SEARCH_SCAN_LIMIT,
         ):
             if len(submission.selftext) > 3000:
                 continue
@@ -61,32 +74,87 @@ class RedditSearchTool(AsyncBaseTool):
                 subreddit=submission.subreddit.display_name,
             )
             results.append(result)
+            if len(results) >= limit:
+                break
 
         return results
 
 
 class RedditDetailsInput(BaseModel):
-    post_id: str
+    post_id: str | None = None
+    post_ids: list[str] = []
 
 
 @dataclass
 class RedditDetails:
     top_comments: list[str]
+    post_id: str = ""
 
 
 class RedditDetailsTool(AsyncBaseTool):
     name: str = "reddit_details"
     description: str = (
         "Get the details of a post. "
-        "You need to provide an id that you are going to find from the reddit_search tool"
+        "You need to provide an id that you are going to find from the reddit_search tool. "
+        "To get the details of many posts at once, pass their ids in post_ids instead."
     )
     args_schema: type[BaseModel] = RedditDetailsInput
+    _comments_cache: TTLCache[str, list[str]] = PrivateAttr(
+        default_factory=lambda: TTLCache(maxsize=256, ttl=COMMENTS_CACHE_TTL)
+    )
+    _semaphore: asyncio.Semaphore = PrivateAttr(
+        default_factory=lambda: asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    )
+    _rate_limit_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+    # The limits Reddit last reported, and the fetches let through since.
+    _reported_limits: tuple[float, float] | None = PrivateAttr(default=None)
+    _granted: int = PrivateAttr(default=0)
 
-    async def _arun(self, post_id: str, **kwargs) -> RedditDetails:
+    async def _arun(
+        self,
+        post_id: str | None = None,
+        post_ids: list[str] | None = None,
+        **kwargs,
+    ) -> RedditDetails | list[RedditDetails]:
+        if post_id:
+            return await self._get_details(post_id)
+        if not post_ids:
+            raise ValueError("Either post_id or post_ids must be provided")
+        return list(await asyncio.gather(*(self._get_details(id_) for id_ in post_ids)))
+
+    async def _get_details(self, post_id: str) -> RedditDetails:
+        top_comments = self._comments_cache.get(post_id)
+        if top_comments is None:
+            async with self._semaphore:
+                await self._wait_for_rate_limit()
+                top_comments = await self._fetch_comments(post_id)
+            self._comments_cache.set(post_id, top_comments)
+        return RedditDetails(top_comments=top_comments, post_id=post_id)
+
+    async def _wait_for_rate_limit(self) -> None:
+        # The limits only change when a response arrives, so the fetches let
+        # through in the meantime are counted here, under a lock, or all the
+        # concurrent fetches would pass on the last remaining request.
+        async with self._rate_limit_lock:
+            limits = self.dependencies.reddit_client.auth.limits
+            remaining = limits["remaining"]
+            reset_timestamp = limits["reset_timestamp"]
+            if remaining is None or reset_timestamp is None:
+                return
+            reported = (float(remaining), float(reset_timestamp))
+            if reported != self._reported_limits:
+                self._reported_limits = reported
+                self._granted = 0
+            if reported[0] - self._granted < 1:
+                await asyncio.sleep(max(0.0, reported[1] - time.time()))
+                self._granted = 0
+            self._granted += 1
+
+    async def _fetch_comments(self, post_id: str) -> list[str]:
         submission: Submission = await self.dependencies.reddit_client.submission(
             post_id, fetch=False
         )
         submission.comment_limit = 20
         comments = await submission.comments()
         await comments.replace_more(limit=1)
-        return RedditDetails(top_comments=[comment.body for comment in comments])
+        return [comment.body for comment in comments]
@@ -1,22 +1,36 @@
 import asyncio
 import threading
-from dataclasses import dataclass
-from typing import Any, AsyncContextManager, Callable, cast
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncContextManager, Callable, Coroutine, TypeVar, cast
 from uuid import uuid4
 
+from apscheduler.events import (  # type: ignore
+    EVENT_JOB_MISSED,
+    EVENT_JOB_SUBMITTED,
+    JobEvent,
+    JobSubmissionEvent,
+)
 from apscheduler.job import Job
 from apscheduler.schedulers.base import BaseScheduler
 from apscheduler.triggers.cron import CronTrigger
 from langchain.chat_models.base import BaseChatModel
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.runnables.config import RunnableConfig
+from langchain_core.tools.base import BaseTool
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from agent.agent import Agent
+from message_queue import AgentEvent, MessageQueue
+from metrics import Counter, Histogram
 from models import Schedule, User
 from tools.base import AsyncBaseTool
 
+T = TypeVar("T")
+
 
 class SchedulerCreateInput(BaseModel):
     name: str
@@ -30,71 +44,187 @@ class SchedulerCreate:
     id: str
 
 
-local = threading.local()
+JOB_RUNS = Counter("ragpile_scheduler_job_runs", "Scheduled job runs", ["status"])
+JOB_DURATION = Histogram(
+    "ragpile_scheduler_job_duration_seconds",
+    "Duration of scheduled job runs",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+JOB_LAG = Histogram(
+    "ragpile_scheduler_lag_seconds",
+    "Delay between the scheduled run time of a job and the start of the run",
+)
+JOBS_MISSED = Counter("ragpile_scheduler_jobs_missed", "Job runs that were missed")
+
+# Scheduled run times of submitted jobs, until the executor starts them.
+_scheduled_run_times: dict[str, datetime] = {}
+_scheduled_run_times_lock = threading.Lock()
+
 
+def on_job_event(event: JobEvent) -> None:
+    """A scheduler listener for EVENT_JOB_SUBMITTED and EVENT_JOB_MISSED."""
+    if event.code == EVENT_JOB_MISSED:
+        JOBS_MISSED.inc()
+    elif event.code == EVENT_JOB_SUBMITTED:
+        event = cast(JobSubmissionEvent, event)
+        with _scheduled_run_times_lock:
+            _scheduled_run_times[event.job_id] = event.scheduled_run_times[-1]
 
-def run_job(code: str, user_id: str, job_id: str, state: dict[str, Any] = {}) -> None:
-    loop = asyncio.get_event_loop()
 
-    tools: dict[str, AsyncBaseTool] = local.tools
-    for tool in tools.values():
-        tool.bind_user_id(user_id)
+# The threads running the code of jobs, see JOB_EXECUTOR.
+JOB_WORKERS = 4
 
-    agent: Agent = local.agent
-    llm: BaseChatModel = local.llm
-    session_factory: Callable[[], AsyncContextManager[AsyncSession]] = (
-        local.session_factory
+
+@dataclass
+class JobDependencies:
+    tools: list[BaseTool]
+    agent: Agent
+    llm: BaseChatModel
+    session_factory: Callable[[], AsyncContextManager[AsyncSession]]
+    scheduler: BaseScheduler
+    # Tries to take a lock shared by the replicas, the context yields whether
+    # it did. While leadership moves, two schedulers may briefly fire a job.
+    job_lock: Callable[[str], AsyncContextManager[bool]]
+    # Where the start and the end of the runs are published, for live views.
+    events: MessageQueue | None = None
+    # Runs waiting for a thread of JOB_EXECUTOR wait here, before taking their
+    # lock, so a burst of jobs does not hold a pooled connection per run.
+    job_slots: asyncio.Semaphore = field(
+        default_factory=lambda: asyncio.Semaphore(JOB_WORKERS)
     )
-    scheduler: BaseScheduler = local.scheduler
-    job: Job = cast(Job, scheduler.get_job(job_id))
-
-    async def get_user(user_id: str) -> User:
-        async with session_factory() as session:
-            user = await session.get(User, user_id)
-            assert user
-            session.expunge(user)
-            return user
-
-    user = loop.run_until_complete(get_user(user_id))
-
-    def send_message(text: str) -> None:
-        async def _send_message(text: str) -> None:
-            await agent.send_message(
-                [
-                    SystemMessage(
-                        content=f"The following message is message sent form job {job.name}"
-                    ),
-                    AIMessage(content=text),
-                ],
-                user,
+
+
+_job_dependencies: JobDependencies | None = None
+
+# The code of a job is synchronous, so it runs here instead of on the event loop.
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+def set_job_dependencies(dependencies: JobDependencies) -> None:
+    global _job_dependencies  # pylint: disable=global-statement
+    _job_dependencies = dependencies
+
+
+@dataclass
+class JobTool:
+    """
+    A tool as seen by the code of a job.
+
+    The tools and their pooled clients belong to the event loop, so the calls of
+    the job thread are run there. The config carries the user of the job.
+    """
+
+    tool: BaseTool
+    config: RunnableConfig
+    loop: asyncio.AbstractEventLoop
+
+    def run(self, tool_input: dict[str, Any]) -> Any:
+        return asyncio.run_coroutine_threadsafe(
+            self.tool.ainvoke(tool_input, self.config), self.loop
+        ).result()
+
+    invoke = run
+
+
+async def run_job(
+    code: str, user_id: str, job_id: str, state: dict[str, Any] = {}
+) -> None:
+    with _scheduled_run_times_lock:
+        scheduled_run_time = _scheduled_run_times.pop(job_id, None)
+    if scheduled_run_time:
+        JOB_LAG.observe(
+            (datetime.now(timezone.utc) - scheduled_run_time).total_seconds()
+        )
+    assert _job_dependencies, "set_job_dependencies was not called"
+    start = time.perf_counter()
+    status = "error"
+    try:
+        async with (
+            _job_dependencies.job_slots,
+            _job_dependencies.job_lock(f"job:{job_id}") as acquired,
+        ):
+            if not acquired:
+                status = "skipped"
+                return
+            await _publish_job_event(user_id, "job.start", {"job_id": job_id})
+            try:
+                await _run_job(code, user_id, job_id, state)
+                status = "ok"
+            finally:
+                await _publish_job_event(
+                    user_id, "job.end", {"job_id": job_id, "status": status}
+                )
+    finally:
+        JOB_DURATION.observe(time.perf_counter() - start)
+        JOB_RUNS.inc(status=status)
+
+
+async def _publish_job_event(user_id: str, type_: str, data: dict[str, Any]) -> None:
+    dependencies = cast(JobDependencies, _job_dependencies)
+    if dependencies.events:
+        await dependencies.events.put(AgentEvent(user_id, type_, data))
+
+
+async def _run_job(code: str, user_id: str, job_id: str, state: dict[str, Any]) -> None:
+    dependencies = cast(JobDependencies, _job_dependencies)
+    loop = asyncio.get_running_loop()
+
+    async with dependencies.session_factory() as session:
+        user = await session.get(User, user_id)
+        assert user
+        session.expunge(user)
+
+    def run_on_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def _exec() -> None:
+        job: Job = cast(Job, dependencies.scheduler.get_job(job_id))
+
+        def send_message(text: str) -> None:
+            run_on_loop(
+                dependencies.agent.send_message(
+                    [
+                        SystemMessage(
+                            content=f"The following message is message sent form job {job.name}"
+                        ),
+                        AIMessage(content=text),
+                    ],
+                    user,
+                )
             )
 
-        loop.run_until_complete(_send_message(text))
+        def invoke_llm(text: str) -> str:
+            system_message = SystemMessage(
+                content="""
+                You are an assistant, this is a message that is requested in a cron like job.
+                Try to keep them short, because those messages will probably be sent to the user
+                through telegram.
+                """
+            )
+            user_messgae = HumanMessage(content=text)
+            message = run_on_loop(
+                dependencies.llm.ainvoke([system_message, user_messgae])
+            )
+            return str(message.content)
 
-    def invoke_llm(text: str) -> str:
-        system_message = SystemMessage(
-            content="""
-            You are an assistant, this is a message that is requested in a cron like job.
-            Try to keep them short, because those messages will probably be sent to the user
-            through telegram.
-            """
+        config = RunnableConfig(configurable={"user_id": user_id})
+        exec(
+            code,
+            None,
+            {
+                "tools": {
+                    tool.name: JobTool(tool, config, loop)
+                    for tool in dependencies.tools
+                },
+                "user_id": user_id,
+                "send_message": send_message,
+                "invoke_llm": invoke_llm,
+                "state": state,
+            },
         )
-        user_messgae = HumanMessage(content=text)
-        message = llm.invoke([system_message, user_messgae])
-        return str(message.content)
-
-    exec(
-        code,
-        None,
-        {
-            "tools": local.tools,
-            "user_id": user_id,
-            "send_message": send_message,
-            "invoke_llm": invoke_llm,
-            "state": state,
-        },
-    )
-    scheduler.modify_job(job_id, kwargs={**job.kwargs, "state": state})
+        dependencies.scheduler.modify_job(job_id, kwargs={**job.kwargs, "state": state})
+
+    await loop.run_in_executor(JOB_EXECUTOR, _exec)
 
 
 class SchedulerCreateTool(AsyncBaseTool):
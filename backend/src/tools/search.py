@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from dataclasses import dataclass
 from enum import Enum
@@ -56,7 +57,7 @@ class GoogleSearchTool(AsyncBaseTool):
         if time_filter:
             search_params["dateRestrict"] = time_filter.value
 
-        result = service.cse().list(**search_params).execute()
+        result = await asyncio.to_thread(service.cse().list(**search_params).execute)
 
         search_results = []
         items = result.get("items", [])
@@ -0,0 +1,120 @@
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import AsyncContextManager, Callable, Type
+
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ToolResult
+from tools.base import AsyncBaseTool
+
+logger = logging.getLogger(__name__)
+
+
+class ToolResultStore:
+    """
+    Keeps the full payload of compacted tool results out of the graph state.
+
+    Results are kept for `retention`, rows older than that are deleted by the
+    store itself, at most once per `prune_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        retention: timedelta = timedelta(days=7),
+        prune_interval: float = 3600,
+    ):
+        self.session_factory = session_factory
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._last_prune: float | None = None
+
+    async def save_many(
+        self, user_id: str, tool_name: str, contents: dict[str, str]
+    ) -> None:
+        if not contents:
+            return
+        now = datetime.now()
+        async with self.session_factory() as session:
+            await session.execute(
+                insert(ToolResult),
+                [
+                    {
+                        "id": ref,
+                        "user_id": user_id,
+                        "tool_name": tool_name,
+                        "content": content,
+                        "created_at": now,
+                    }
+                    for ref, content in contents.items()
+                ],
+            )
+        if (
+            self._last_prune is None
+            or time.monotonic() - self._last_prune > self.prune_interval
+        ):
+            self._last_prune = time.monotonic()
+            await self.prune()
+
+    async def prune(self) -> int:
+        """Deletes the results older than the retention and returns how many."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(ToolResult).where(
+                    ToolResult.created_at < datetime.now() - self.retention
+                )
+            )
+        if result.rowcount:
+            logger.info("Pruned %d tool results", result.rowcount)
+        return result.rowcount
+
+    async def get(self, user_id: str, ref: str) -> str | None:
+        async with self.session_factory() as session:
+            return await session.scalar(
+                select(ToolResult.content).where(
+                    ToolResult.id == ref, ToolResult.user_id == user_id
+                )
+            )
+
+
+class ToolResultFetchInput(BaseModel):
+    ref: str
+    offset: int = 0
+    length: int = 8000
+
+
+@dataclass
+class ToolResultChunk:
+    ref: str
+    offset: int
+    total_length: int
+    content: str
+
+
+class ToolResultFetchTool(AsyncBaseTool):
+    name: str = "tool_result_fetch"
+    description: str = (
+        "Large tool results are truncated and marked with a ref. "
+        "Use this tool with that ref to read the full text, "
+        "optionally passing an offset and a length to read it in pieces."
+    )
+    args_schema: Type[BaseModel] = ToolResultFetchInput
+
+    async def _arun(
+        self, ref: str, config: RunnableConfig, offset: int = 0, length: int = 8000
+    ) -> ToolResultChunk:
+        store = ToolResultStore(self.dependencies.session_factory)
+        content = await store.get(self._get_user_id(config), ref)
+        if content is None:
+            raise ValueError(f"No tool result found for ref {ref}")
+        return ToolResultChunk(
+            ref=ref,
+            offset=offset,
+            total_length=len(content),
+            content=content[offset : offset + length],
+        )
@@ -1,20 +1,28 @@
-from dataclasses import dataclass
-from typing import AsyncContextManager, Callable, List, cast
+from dataclasses import dataclass, field
+from typing import Any, AsyncContextManager, Callable, List, cast
 
+import aiohttp
 from apscheduler.schedulers.base import BaseScheduler
 from asyncpraw import Reddit
-from graphiti_core import Graphiti
 from langchain_core.tools import BaseTool
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import TTLCache
+from tools.base import AsyncBaseTool
 from tools.browser import BrowserTool
-from tools.calendar import CalendarCreateEventTool, CalendarListEventsTool
+from tools.calendar import (
+    CalendarBatchEventsTool,
+    CalendarCache,
+    CalendarCreateEventTool,
+    CalendarListEventsTool,
+)
 from tools.email import GmailReadUnreadTool
 from tools.graphiti import GraphitiAddEpisode
 from tools.maps.tool import GoogleMapsPlacesSearchTool
 from tools.reddit import RedditDetailsTool, RedditSearchTool
 from tools.scheduler import SchedulerCreateTool
 from tools.search import GoogleSearchTool
+from tools.tool_results import ToolResultFetchTool
 
 
 @dataclass
@@ -25,8 +33,28 @@ class ToolDependencies:
     google_search_api_key: str
     google_search_engine_id: str
     scheduler: BaseScheduler
-    graphiti: Graphiti
     reddit_client: Reddit
+    maps_cache: TTLCache[tuple[Any, ...], Any] = field(
+        default_factory=lambda: TTLCache(maxsize=1024, ttl=1800)
+    )
+    calendar_cache: CalendarCache = field(init=False)
+    _http_session: aiohttp.ClientSession | None = field(default=None, init=False)
+
+    def __post_init__(self) -> None:
+        self.calendar_cache = CalendarCache(self.session_factory)
+
+    def http_session(self) -> aiohttp.ClientSession:
+        """A pooled session shared by the tools, created lazily on the running loop."""
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+            )
+        return self._http_session
+
+    async def close(self) -> None:
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
 
 
 class Toolkit:
@@ -41,6 +69,7 @@ class Toolkit:
                 # Calendar tools
                 CalendarListEventsTool().with_dependencies(self.dependencies),
                 CalendarCreateEventTool().with_dependencies(self.dependencies),
+                CalendarBatchEventsTool().with_dependencies(self.dependencies),
                 # Email tools
                 GmailReadUnreadTool().with_dependencies(self.dependencies),
                 # Search tools
@@ -56,5 +85,17 @@ class Toolkit:
                 RedditDetailsTool().with_dependencies(self.dependencies),
                 # Google maps
                 GoogleMapsPlacesSearchTool().with_dependencies(self.dependencies),
+                # Tool results
+                ToolResultFetchTool().with_dependencies(self.dependencies),
             ],
         )
+
+
+async def close_tools(tools: list[BaseTool]) -> None:
+    dependencies = {
+        id(tool.dependencies): tool.dependencies
+        for tool in tools
+        if isinstance(tool, AsyncBaseTool)
+    }
+    for tool_dependencies in dependencies.values():
+        await tool_dependencies.close()
@@ -0,0 +1,380 @@
+"""
+Lightweight tracing of agent turns.
+
+Spans are kept in a context variable, so nested `span()` blocks and the tasks
+they create form one trace. Sampling is decided once per trace from the trace
+id, unsampled spans cost a context variable lookup and nothing else. Finished
+spans are exported in batches from a background thread, as OTLP/JSON lines.
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import IO, Any, Iterator, Protocol, Sequence
+
+logger = logging.getLogger(__name__)
+
+AttributeValue = str | int | float | bool
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "context",
+        "parent_span_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "events",
+        "status",
+        "status_message",
+    )
+
+    def __init__(
+        self, name: str, context: SpanContext, parent_span_id: str | None = None
+    ):
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: dict[str, AttributeValue] = {}
+        self.events: list[tuple[str, int, dict[str, AttributeValue]]] = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    @property
+    def recording(self) -> bool:
+        return self.context.sampled
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: AttributeValue | None) -> None:
+        if self.recording and value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict[str, AttributeValue | None]) -> None:
+        if self.recording:
+            for key, value in attributes.items():
+                self.set_attribute(key, value)
+
+    def set_error(self, message: str) -> None:
+        if self.recording:
+            self.status = STATUS_ERROR
+            self.status_message = message
+
+    def record_exception(self, exc: BaseException) -> None:
+        if not self.recording:
+            return
+        self.set_error(repr(exc))
+        self.events.append(
+            (
+                "exception",
+                time.time_ns(),
+                {"exception.type": type(exc).__name__, "exception.message": str(exc)},
+            )
+        )
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: Sequence[Span]) -> None: ...
+
+    def shutdown(self) -> None: ...
+
+
+def _otlp_value(value: AttributeValue) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, AttributeValue]) -> list[dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+def to_otlp_json(spans: Sequence[Span], service_name: str) -> dict[str, Any]:
+    """Encodes spans as an OTLP/JSON ExportTraceServiceRequest."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes({"service.name": service_name})
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [
+                            {
+                                "traceId": span.context.trace_id,
+                                "spanId": span.context.span_id,
+                                "parentSpanId": span.parent_span_id or "",
+                                "name": span.name,
+                                "kind": 1,
+                                "startTimeUnixNano": str(span.start_ns),
+                                "endTimeUnixNano": str(span.end_ns),
+                                "attributes": _otlp_attributes(span.attributes),
+                                "events": [
+                                    {
+                                        "name": name,
+                                        "timeUnixNano": str(time_ns),
+                                        "attributes": _otlp_attributes(attributes),
+                                    }
+                                    for name, time_ns, attributes in span.events
+                                ],
+                                "status": {
+                                    "code": span.status,
+                                    "message": span.status_message,
+                                },
+                            }
+                            for span in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class StreamSpanExporter:
+    """Writes one OTLP/JSON request per line to a stream."""
+
+    def __init__(self, stream: IO[str], service_name: str = "ragpile"):
+        self.stream = stream
+        self.service_name = service_name
+
+    def export(self, spans: Sequence[Span]) -> None:
+        self.stream.write(json.dumps(to_otlp_json(spans, self.service_name)) + "\n")
+        self.stream.flush()
+
+    def shutdown(self) -> None:
+        pass
+
+
+class ConsoleSpanExporter(StreamSpanExporter):
+    def __init__(self, service_name: str = "ragpile"):
+        super().__init__(sys.stdout, service_name)
+
+
+class FileSpanExporter(StreamSpanExporter):
+    def __init__(self, path: str, service_name: str = "ragpile"):
+        # pylint: disable-next=consider-using-with
+        super().__init__(open(path, "a", encoding="utf-8"), service_name)
+
+    def shutdown(self) -> None:
+        self.stream.close()
+
+
+class BatchSpanProcessor:
+    """
+    Buffers finished spans and exports them from a background thread.
+
+    When the buffer is full new spans are dropped, so a slow exporter never
+    blocks the event loops that produce them.
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        max_queue_size: int = 2048,
+        max_batch_size: int = 512,
+        interval: float = 5.0,
+    ):
+        self.exporter = exporter
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._spans: deque[Span] = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            if len(self._spans) >= self.max_queue_size:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+            if len(self._spans) >= self.max_batch_size:
+                self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        while True:
+            with self._lock:
+                batch = [
+                    self._spans.popleft()
+                    for _ in range(min(self.max_batch_size, len(self._spans)))
+                ]
+            if not batch:
+                return
+            try:
+                self.exporter.export(batch)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to export %d spans", len(batch))
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self.exporter.shutdown()
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+_UNSAMPLED = Span("unsampled", SpanContext("0" * 32, "0" * 16, False))
+
+
+class Tracer:
+    """
+    Creates spans and hands the sampled ones to the processor.
+
+    `sample_rate` is the fraction of traces that are recorded. A tracer without
+    a processor records nothing.
+    """
+
+    def __init__(
+        self, processor: BatchSpanProcessor | None = None, sample_rate: float = 1.0
+    ):
+        self.processor = processor
+        self.sample_rate = sample_rate if processor else 0.0
+        self._threshold = int(self.sample_rate * 2**64)
+
+    def _sampled(self, trace_id: str) -> bool:
+        # Derived from the trace id, so every span of a trace gets the same answer.
+        return int(trace_id[16:], 16) < self._threshold
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        parent: SpanContext | None = None,
+        **attributes: AttributeValue | None,
+    ) -> Iterator[Span]:
+        """
+        Starts a span as a child of `parent` or of the current span.
+
+        Exceptions raised in the block are recorded on the span and re-raised.
+        """
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        if parent is not None and not parent.sampled or self._threshold == 0:
+            token = _current_span.set(_UNSAMPLED)
+            try:
+                yield _UNSAMPLED
+            finally:
+                _current_span.reset(token)
+            return
+
+        if parent is None:
+            trace_id = f"{random.getrandbits(128):032x}"
+            context = SpanContext(trace_id, new_span_id(), self._sampled(trace_id))
+        else:
+            context = SpanContext(parent.trace_id, new_span_id(), True)
+        span = Span(name, context, parent.span_id if parent else None)
+        span.set_attributes(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if span.recording and self.processor is not None:
+                self.processor.on_end(span)
+
+    def shutdown(self) -> None:
+        if self.processor is not None:
+            self.processor.shutdown()
+
+
+def new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+def current_span() -> Span:
+    """The active span, or a non recording span when there is none."""
+    return _current_span.get() or _UNSAMPLED
+
+
+def current_span_context() -> SpanContext | None:
+    """The context to pass on to work that continues the trace elsewhere."""
+    span = _current_span.get()
+    return span.context if span is not None else None
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> Tracer:
+    """Installs `tracer` process wide and returns the previous one."""
+    global _tracer  # pylint: disable=global-statement
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def configure_tracing() -> Tracer:
+    """
+    Installs a tracer configured from the environment.
+
+    TRACING_EXPORTER is one of none (default), console or file, TRACING_FILE is
+    the path used by the file exporter and TRACING_SAMPLE_RATE the fraction of
+    traces that are recorded.
+    """
+    exporter_name = os.environ.get("TRACING_EXPORTER", "none")
+    sample_rate = float(os.environ.get("TRACING_SAMPLE_RATE", "0.1"))
+    exporter: SpanExporter
+    if exporter_name == "console":
+        exporter = ConsoleSpanExporter()
+    elif exporter_name == "file":
+        exporter = FileSpanExporter(os.environ.get("TRACING_FILE", "traces.jsonl"))
+    elif exporter_name == "none":
+        return get_tracer()
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER {exporter_name}")
+    logger.info("Tracing %.0f%% of turns to %s", sample_rate * 100, exporter_name)
+    tracer = Tracer(BatchSpanProcessor(exporter), sample_rate=sample_rate)
+    set_tracer(tracer)
+    return tracer
@@ -0,0 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from agent.activity import ThreadActivityTracker
+from dependencies import create_session_factory
+from models import Thread, ThreadActivity
+
+
+def test_messages_reuse_the_thread_until_it_is_reset(tmp_path: Path):
+    async def _run() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+        async with engine.begin() as connection:
+            await connection.run_sync(
+                Thread.metadata.create_all,
+                [Thread.__table__, ThreadActivity.__table__],
+            )
+        session_factory = asynccontextmanager(create_session_factory(engine))
+        tracker = ThreadActivityTracker(session_factory)
+        try:
+            first = await tracker.current_thread_id("user")
+            assert await tracker.current_thread_id("user") == first
+            await tracker.flush()
+            async with session_factory() as session:
+                activity = await session.get(ThreadActivity, "user")
+                assert activity is not None
+                assert activity.thread_id == first
+                assert await session.scalar(select(func.count(Thread.id))) == 1
+
+            await tracker.reset("user")
+            second = await tracker.current_thread_id("user")
+            assert second != first
+            async with session_factory() as session:
+                assert await session.scalar(select(func.count(Thread.id))) == 2
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_run())
@@ -0,0 +1,82 @@
+import asyncio
+from dataclasses import dataclass
+
+from agent.compaction import CompactionPolicy, ToolResultCompactor
+
+
+@dataclass
+class Message:
+    id: str
+    body: str
+    labels: list[str]
+
+
+class InMemoryStore:
+    def __init__(self):
+        self.contents: dict[str, str] = {}
+
+    async def save_many(self, _user_id: str, _tool_name: str, contents: dict):
+        self.contents.update(contents)
+
+
+def compact(output, policy: CompactionPolicy) -> tuple[str, InMemoryStore]:
+    store = InMemoryStore()
+    compactor = ToolResultCompactor(store, {"tool": policy})  # type: ignore
+    return asyncio.run(compactor.compact("tool", output, "user")), store
+
+
+def test_small_result_is_untouched():
+    content, store = compact([Message("1", "hi", ["INBOX"])], CompactionPolicy())
+    assert content == "[Message(id='1', body='hi', labels=['INBOX'])]"
+    assert not store.contents
+
+
+def test_long_fields_are_truncated_and_fields_dropped():
+    body = "x" * 50
+    content, store = compact(
+        [Message("1", body, ["INBOX"])],
+        CompactionPolicy(max_field_chars=10, drop_fields=("labels",)),
+    )
+    (ref,) = store.contents
+    assert store.contents[ref] == body
+    assert content == (
+        f"[Message(id='1', body='xxxxxxxxxx... [truncated 40 chars, ref={ref}]')]"
+    )
+
+
+def test_dict_values_are_compacted_like_fields():
+    body = "x" * 50
+    content, store = compact(
+        [{"id": "1", "body": body, "labels": ["INBOX"]}],
+        CompactionPolicy(max_field_chars=10, drop_fields=("labels",)),
+    )
+    (ref,) = store.contents
+    assert store.contents[ref] == body
+    assert content == (
+        f'[{{"id": "1", "body": "xxxxxxxxxx... [truncated 40 chars, ref={ref}]"}}]'
+    )
+
+
+def test_lists_are_cut_to_the_budget():
+    messages = [Message(str(i), "y" * 30, []) for i in range(20)]
+    content, store = compact(messages, CompactionPolicy(budget_tokens=50))
+    assert len(content) <= 200
+    assert content.startswith("[Message(id='0'")
+    assert "OmittedResults(count=" in content
+    (ref,) = store.contents
+    assert "Message(id='19'" in store.contents[ref]
+
+
+class FailingStore:
+    async def save_many(self, _user_id: str, _tool_name: str, _contents: dict):
+        raise ConnectionError("database is down")
+
+
+def test_result_is_kept_when_the_store_fails():
+    compactor = ToolResultCompactor(
+        FailingStore(), {"tool": CompactionPolicy(max_field_chars=10)}  # type: ignore
+    )
+    content = asyncio.run(
+        compactor.compact("tool", [Message("1", "z" * 50, [])], "user")
+    )
+    assert content.startswith("[Message(id='1', body='zzzzzzzzzz... [truncated 40")
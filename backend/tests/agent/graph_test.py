@@ -0,0 +1,111 @@
+import asyncio
+import logging
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+from agent import agent
+from agent.agent import Agent, retrieve_memory
+from agent.graph import completion
+from memory.retrieval import MemoryContext
+from message_queue import MessageQueue
+from models import User
+
+MESSAGES: list[BaseMessage] = [HumanMessage(content="where do I live?")]
+
+
+class FakeRetriever:
+    def __init__(self, facts: list[str] | None, delay: float = 0):
+        self.facts = facts
+        self.delay = delay
+        self.queries: list[str] = []
+
+    async def retrieve(self, group_id: str, query: str):
+        self.queries.append(query)
+        await asyncio.sleep(self.delay)
+        if self.facts is None:
+            raise ConnectionError("neo4j is down")
+        return MemoryContext(facts=self.facts, latency=0.01, cached=False)
+
+
+def run_completion(
+    retriever: FakeRetriever,
+) -> tuple[list[BaseMessage], AIMessage]:
+    prompts: list[list[BaseMessage]] = []
+
+    def llm(messages: list[BaseMessage]) -> AIMessage:
+        prompts.append(messages)
+        return AIMessage(content="ok")
+
+    async def _run() -> dict:
+        memory = asyncio.create_task(retrieve_memory(retriever, "user", MESSAGES))  # type: ignore
+        config = RunnableConfig(
+            configurable={"user_id": "user", "thread_id": "thread", "memory": memory}
+        )
+        node = completion(RunnableLambda(llm))  # type: ignore
+        return await node({"messages": MESSAGES}, config)
+
+    result = asyncio.run(_run())
+    return prompts[0], result["messages"][0]
+
+
+def test_facts_are_injected_in_the_prompt():
+    retriever = FakeRetriever(["The user lives in Athens"])
+    prompt, response = run_completion(retriever)
+    assert retriever.queries == ["where do I live?"]
+    assert "- The user lives in Athens" in str(prompt[1].content)
+    assert response.response_metadata["memory_retrieval_ms"] == 10
+
+
+def test_retrieval_failure_does_not_fail_the_turn():
+    prompt, response = run_completion(FakeRetriever(None))
+    assert [m.type for m in prompt] == ["system", "human"]
+    assert response.content == "ok"
+
+
+def test_slow_retrieval_is_a_warning(monkeypatch, caplog):
+    monkeypatch.setattr(agent, "MEMORY_RETRIEVAL_TIMEOUT", 0.01)
+    prompt, _ = run_completion(FakeRetriever(["late"], delay=1))
+    assert [m.type for m in prompt] == ["system", "human"]
+    (record,) = [r for r in caplog.records if r.name == "agent.agent"]
+    assert record.levelno == logging.WARNING
+    assert record.exc_info is None
+
+
+class FakeGraph:
+    def __init__(self, updates: list[dict]):
+        self.updates = updates
+
+    async def astream(self, _input, _config, stream_mode):
+        for update in self.updates:
+            yield "updates", update
+
+
+def test_every_message_of_an_update_is_published():
+    calls = AIMessage(
+        content="",
+        tool_calls=[
+            {"name": "search", "args": {}, "id": "1"},
+            {"name": "search", "args": {}, "id": "2"},
+        ],
+    )
+    results = [
+        ToolMessage(content="one", tool_call_id="1"),
+        ToolMessage(content="two", tool_call_id="2"),
+    ]
+    graph = FakeGraph(
+        [
+            {"completion": {"messages": [calls]}},
+            {"tools": {"messages": results}},
+            {"tools": {"messages": []}},
+        ]
+    )
+
+    async def _run() -> list[BaseMessage]:
+        queue = MessageQueue()
+        subscription = queue.register("test", maxsize=0)
+        turn = Agent(graph, None, queue)  # type: ignore
+        await turn.send_message(MESSAGES, User(id="user"), thread_id="thread")
+        return [item.message for item in await subscription.get_many(10, timeout=0)]
+
+    assert asyncio.run(_run()) == [calls, *results]
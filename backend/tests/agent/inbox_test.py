@@ -0,0 +1,66 @@
+import asyncio
+
+from langchain_core.messages import BaseMessage
+
+from agent.inbox import UserInbox
+from models import User
+
+
+class FakeAgent:
+    def __init__(self, duration: float = 0.05):
+        self.duration = duration
+        self.turns: list[str] = []
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = 0
+
+    async def send_message(self, messages: list[BaseMessage], _user: User) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.duration)
+            self.turns.append(str(messages[0].content))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.running -= 1
+
+
+def test_messages_are_coalesced_and_turns_serialised():
+    agent = FakeAgent()
+    user = User(id="user")
+
+    async def _run() -> None:
+        inbox = UserInbox(agent, debounce=0.02)  # type: ignore
+        inbox.submit(user, "hi")
+        inbox.submit(user, "are you there?")
+        await asyncio.sleep(0.04)
+        # Arrive while the first turn runs.
+        inbox.submit(user, "one more")
+        inbox.submit(user, "and another")
+        await asyncio.sleep(0.2)
+        await inbox.close()
+
+    asyncio.run(_run())
+    assert agent.turns == ["hi\n\nare you there?", "one more\n\nand another"]
+    assert agent.max_running == 1
+
+
+def test_cancel_stops_the_running_turn_and_drops_waiting_messages():
+    agent = FakeAgent(duration=10)
+    user = User(id="user")
+
+    async def _run() -> bool:
+        inbox = UserInbox(agent, debounce=0.01)  # type: ignore
+        inbox.submit(user, "research everything")
+        await asyncio.sleep(0.05)
+        inbox.submit(user, "and then this")
+        cancelled = inbox.cancel("user")
+        await asyncio.sleep(0.05)
+        assert not inbox.cancel("user")
+        return cancelled
+
+    assert asyncio.run(_run())
+    assert agent.cancelled == 1
+    assert agent.turns == []
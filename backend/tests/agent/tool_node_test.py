@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables.config import RunnableConfig
+from langchain_core.tools.base import BaseTool
+from pydantic import BaseModel
+
+from agent.tool_node import ParallelToolNode
+
+
+class SleepInput(BaseModel):
+    seconds: float
+
+
+class SleepTool(BaseTool):
+    name: str = "sleep"
+    description: str = "Sleeps"
+    args_schema: type = SleepInput
+
+    def _run(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def _arun(self, seconds: float, **_kwargs) -> str:
+        await asyncio.sleep(seconds)
+        return f"slept {seconds}"
+
+
+class FailingTool(BaseTool):
+    name: str = "fail"
+    description: str = "Fails"
+    args_schema: type = SleepInput
+
+    def _run(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def _arun(self, seconds: float, **_kwargs) -> str:
+        raise RuntimeError("boom")
+
+
+def tool_call(name: str, seconds: float, call_id: str) -> dict:
+    return {"name": name, "args": {"seconds": seconds}, "id": call_id}
+
+
+def run_node(node: ParallelToolNode, calls: list[dict]) -> tuple[list, float]:
+    state = {"messages": [AIMessage(content="", tool_calls=calls)]}
+    config = RunnableConfig(configurable={"user_id": "user"})
+    start = time.perf_counter()
+    result = asyncio.run(node(state, config))
+    return result["messages"], time.perf_counter() - start
+
+
+def test_multi_call_turn_takes_as_long_as_the_slowest_call():
+    node = ParallelToolNode([SleepTool()])
+    messages, elapsed = run_node(
+        node,
+        [
+            tool_call("sleep", 0.2, "1"),
+            tool_call("sleep", 0.2, "2"),
+            tool_call("sleep", 0.3, "3"),
+        ],
+    )
+    assert [m.content for m in messages] == ["slept 0.2", "slept 0.2", "slept 0.3"]
+    assert elapsed < 0.5
+
+
+def test_per_tool_concurrency_limit():
+    node = ParallelToolNode([SleepTool()], tool_concurrency={"sleep": 1})
+    _, elapsed = run_node(
+        node, [tool_call("sleep", 0.1, "1"), tool_call("sleep", 0.1, "2")]
+    )
+    assert elapsed >= 0.2
+
+
+def test_partial_results_on_failure_and_timeout():
+    node = ParallelToolNode([SleepTool(), FailingTool()], timeout=0.1)
+    messages, _ = run_node(
+        node,
+        [
+            tool_call("sleep", 0.0, "1"),
+            tool_call("fail", 0.0, "2"),
+            tool_call("sleep", 1.0, "3"),
+            tool_call("missing", 0.0, "4"),
+        ],
+    )
+    assert [m.tool_call_id for m in messages] == ["1", "2", "3", "4"]
+    assert [m.status for m in messages] == ["success", "error", "error", "error"]
+    assert "timed out" in messages[2].content
+
+
+def test_per_user_limit_and_idle_users_are_forgotten():
+    node = ParallelToolNode([SleepTool()], user_concurrency=1)
+    _, elapsed = run_node(
+        node, [tool_call("sleep", 0.1, "1"), tool_call("sleep", 0.1, "2")]
+    )
+    assert elapsed >= 0.2
+    assert not node._user_semaphores  # pylint: disable=protected-access
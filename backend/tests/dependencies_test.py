@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import dependencies
+
+HEAVY_MODULES = {
+    "apscheduler",
+    "asyncpraw",
+    "googleapiclient",
+    "graphiti_core",
+    "langchain",
+    "langchain_core",
+    "langgraph",
+    "neo4j",
+    "openai",
+    "telegram",
+}
+
+
+def test_app_imports_without_environment():
+    env = {"PATH": os.environ.get("PATH", ""), "PYTHONPATH": os.pathsep.join(sys.path)}
+    code = (
+        "import sys, app; "
+        "print(*sorted({m.split('.')[0] for m in sys.modules} & set(sys.argv[1:])))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code, *HEAVY_MODULES],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == []
+
+
+def test_providers_are_cached(monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "secret")
+    dependencies.get_token_manager.cache_clear()
+    try:
+        assert dependencies.get_token_manager() is dependencies.get_token_manager()
+        assert dependencies.get_message_queue() is dependencies.get_message_queue()
+    finally:
+        dependencies.get_token_manager.cache_clear()
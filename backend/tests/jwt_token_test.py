@@ -0,0 +1,70 @@
+import asyncio
+
+import jwt
+import pytest
+from fastapi import HTTPException, Response
+
+from jwt_token import (
+    USER_CACHE,
+    Token,
+    TokenManager,
+    get_current_user_factory,
+    invalidate_cached_user,
+)
+from models import User
+
+
+class FakeSession:
+    def __init__(self):
+        self.gets = 0
+
+    async def get(self, _model, user_id: str) -> User:
+        self.gets += 1
+        return User(id=user_id, email="user@example.com", integrations={})
+
+
+def sign(token_manager: TokenManager, token: Token) -> str:
+    return jwt.encode(
+        {"id": token.user_id, "exp": token.exp}, token_manager.secret, "HS256"
+    )
+
+
+def test_decoded_tokens_are_cached_until_they_expire(monkeypatch):
+    token_manager = TokenManager("secret")
+    token = Token("user")
+    signed = sign(token_manager, token)
+    assert token_manager.decode_token(signed).user_id == "user"
+
+    monkeypatch.setattr(jwt, "decode", lambda *_args, **_kwargs: pytest.fail())
+    cached = token_manager.decode_token(signed)
+    assert cached.user_id == "user"
+
+    cached.exp = 0
+    with pytest.raises(jwt.ExpiredSignatureError):
+        token_manager.decode_token(signed)
+
+
+def test_users_are_cached_until_invalidated():
+    USER_CACHE.clear()
+    token_manager = TokenManager("secret")
+    session = FakeSession()
+    get_current_user = get_current_user_factory(
+        lambda: token_manager, None  # type: ignore
+    )
+    signed = sign(token_manager, Token("user"))
+
+    async def _get() -> User:
+        return await get_current_user(Response(), session, signed)  # type: ignore
+
+    first = asyncio.run(_get())
+    first.integrations["telegram"] = {"user_id": "1"}
+    second = asyncio.run(_get())
+    assert session.gets == 1
+    assert second.integrations == {}
+
+    invalidate_cached_user("user")
+    asyncio.run(_get())
+    assert session.gets == 2
+
+    with pytest.raises(HTTPException):
+        asyncio.run(get_current_user(Response(), session, None))  # type: ignore
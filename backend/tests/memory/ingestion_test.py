@@ -0,0 +1,207 @@
+import asyncio
+import math
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import pytest
+from graphiti_core.nodes import EpisodeType
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from dependencies import create_session_factory
+from memory.ingestion import (
+    EPISODE_QUEUE_DEPTH,
+    EPISODE_QUEUE_FAILED,
+    EPISODE_QUEUE_LAG,
+    FAILED,
+    PENDING,
+    EpisodeIngestionWorker,
+    EpisodeQueue,
+    EpisodeQueueFullError,
+    GroupQueueStats,
+)
+from models import Episode
+
+
+class FakeGraphiti:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batches: list[tuple[str, list[str]]] = []
+
+    async def add_episode(self, group_id: str, name: str, **_kwargs) -> None:
+        if self.fail:
+            raise ConnectionError("neo4j is down")
+        self.batches.append((group_id, [name]))
+
+    async def add_episode_bulk(self, episodes, group_id: str) -> None:
+        if self.fail:
+            raise ConnectionError("neo4j is down")
+        self.batches.append((group_id, [episode.name for episode in episodes]))
+
+
+class FakeRuntime:
+    def __init__(self, graphiti: FakeGraphiti):
+        self.graphiti = graphiti
+
+    async def get(self) -> FakeGraphiti:
+        return self.graphiti
+
+
+def run_with_database(tmp_path: Path, test: Callable[..., Awaitable[None]]) -> None:
+    async def _run() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+        async with engine.begin() as connection:
+            await connection.run_sync(Episode.metadata.create_all, [Episode.__table__])
+        try:
+            await test(asynccontextmanager(create_session_factory(engine)))
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_run())
+
+
+async def run_worker_until(worker: EpisodeIngestionWorker, condition) -> None:
+    task = asyncio.create_task(worker.run())
+    try:
+        async with asyncio.timeout(5):
+            while not await condition():
+                await asyncio.sleep(0.01)
+    finally:
+        worker.stop()
+        await task
+
+
+async def enqueue(queue: EpisodeQueue, group_id: str, name: str) -> int:
+    return await queue.enqueue(group_id, name, "body", EpisodeType.message)
+
+
+async def pending(session_factory, expected: int) -> bool:
+    async with session_factory() as session:
+        count = await session.scalar(select(func.count()).select_from(Episode))
+    return count == expected
+
+
+def test_episodes_of_a_group_are_ingested_in_order(tmp_path):
+    graphiti = FakeGraphiti()
+
+    async def _test(session_factory) -> None:
+        queue = EpisodeQueue(session_factory)
+        for name in ["a0", "a1", "a2"]:
+            await enqueue(queue, "a", name)
+        for name in ["b0", "b1"]:
+            await enqueue(queue, "b", name)
+        worker = EpisodeIngestionWorker(
+            session_factory,
+            FakeRuntime(graphiti),  # type: ignore
+            batch_size=2,
+            poll_interval=0.01,
+            stats_interval=math.inf,
+        )
+        await run_worker_until(worker, lambda: pending(session_factory, 0))
+
+    run_with_database(tmp_path, _test)
+    assert [names for group, names in graphiti.batches if group == "a"] == [
+        ["a0", "a1"],
+        ["a2"],
+    ]
+    assert [names for group, names in graphiti.batches if group == "b"] == [
+        ["b0", "b1"]
+    ]
+
+
+def test_episodes_fail_after_max_attempts_and_are_pruned(tmp_path):
+    async def _test(session_factory) -> None:
+        await enqueue(EpisodeQueue(session_factory), "a", "a0")
+        worker = EpisodeIngestionWorker(
+            session_factory,
+            FakeRuntime(FakeGraphiti(fail=True)),  # type: ignore
+            max_attempts=2,
+            poll_interval=0.01,
+            stats_interval=math.inf,
+            failed_retention=timedelta(0),
+        )
+
+        async def _failed() -> bool:
+            async with session_factory() as session:
+                status = await session.scalar(select(Episode.status))
+            return status == FAILED
+
+        await run_worker_until(worker, _failed)
+        async with session_factory() as session:
+            attempts, error = (
+                await session.execute(select(Episode.attempts, Episode.error))
+            ).one()
+        assert attempts == 2
+        assert error == "ConnectionError('neo4j is down')"
+
+        assert await worker.prune_failed() == 1
+        assert await pending(session_factory, 0)
+
+    run_with_database(tmp_path, _test)
+
+
+def test_failed_batch_backs_off_per_episode(tmp_path):
+    async def _test(session_factory) -> None:
+        queue = EpisodeQueue(session_factory)
+        await enqueue(queue, "a", "a0")
+        await enqueue(queue, "a", "a1")
+        async with session_factory() as session:
+            await session.execute(
+                update(Episode).where(Episode.name == "a0").values(attempts=1)
+            )
+        worker = EpisodeIngestionWorker(
+            session_factory,
+            FakeRuntime(FakeGraphiti(fail=True)),  # type: ignore
+            batch_size=2,
+            max_attempts=2,
+        )
+        await worker._process_group("a")  # pylint: disable=protected-access
+        async with session_factory() as session:
+            rows = await session.execute(
+                select(Episode.name, Episode.status, Episode.next_attempt_at).order_by(
+                    Episode.name
+                )
+            )
+            (_, status0, retry0), (_, status1, retry1) = rows.all()
+        assert (status0, status1) == (FAILED, PENDING)
+        assert retry0 - retry1 == timedelta(seconds=worker.poll_interval * 2)
+
+    run_with_database(tmp_path, _test)
+
+
+def test_enqueue_refuses_a_full_group(tmp_path):
+    async def _test(session_factory) -> None:
+        queue = EpisodeQueue(session_factory, max_pending_per_group=2)
+        assert await enqueue(queue, "a", "a0") == 1
+        assert await enqueue(queue, "a", "a1") == 2
+        with pytest.raises(EpisodeQueueFullError):
+            await enqueue(queue, "a", "a2")
+        assert await enqueue(queue, "b", "b0") == 1
+
+    run_with_database(tmp_path, _test)
+
+
+def test_queue_stats_are_exported_per_group(tmp_path, monkeypatch):
+    # SQLite returns naive datetimes, so the stats are faked here.
+    stats = [GroupQueueStats("stats-a", depth=2, failed=1, lag_seconds=3.0)]
+
+    async def _stats() -> list[GroupQueueStats]:
+        return stats
+
+    async def _test(session_factory) -> None:
+        worker = EpisodeIngestionWorker(
+            session_factory, FakeRuntime(FakeGraphiti())  # type: ignore
+        )
+        monkeypatch.setattr(worker.queue, "stats", _stats)
+        await worker._log_stats()  # pylint: disable=protected-access
+        assert EPISODE_QUEUE_DEPTH.value(group="stats-a") == 2
+        assert EPISODE_QUEUE_FAILED.value(group="stats-a") == 1
+        assert EPISODE_QUEUE_LAG.value(group="stats-a") == 3.0
+
+        stats.clear()
+        await worker._log_stats()  # pylint: disable=protected-access
+        assert "stats-a" not in EPISODE_QUEUE_DEPTH.render()
+
+    run_with_database(tmp_path, _test)
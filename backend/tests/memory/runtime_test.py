@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import graphiti_core
+
+from memory.runtime import SCHEMA_VERSION, GraphitiRuntime
+
+
+class FakeDriver:
+    def __init__(self):
+        self.version: int | None = None
+
+    async def execute_query(self, query: str, **params):
+        if query.startswith("MERGE"):
+            self.version = params["version"]
+            return [], None, None
+        return ([{"version": self.version}] if self.version else []), None, None
+
+
+class FakeGraphiti:
+    driver = FakeDriver()
+    builds = 0
+    closed_on: list[asyncio.AbstractEventLoop] = []
+
+    def __init__(self, *_args):
+        self.loop = asyncio.get_running_loop()
+
+    async def build_indices_and_constraints(self) -> None:
+        FakeGraphiti.builds += 1
+
+    async def close(self) -> None:
+        assert asyncio.get_running_loop() is self.loop
+        FakeGraphiti.closed_on.append(self.loop)
+
+
+def new_runtime(monkeypatch) -> GraphitiRuntime:
+    monkeypatch.setattr(graphiti_core, "Graphiti", FakeGraphiti)
+    monkeypatch.setattr(FakeGraphiti, "driver", FakeDriver())
+    monkeypatch.setattr(FakeGraphiti, "builds", 0)
+    monkeypatch.setattr(FakeGraphiti, "closed_on", [])
+    return GraphitiRuntime("bolt://neo4j", "user", "password")
+
+
+def test_bootstrap_builds_the_indices_once(monkeypatch):
+    runtime = new_runtime(monkeypatch)
+
+    async def _run() -> None:
+        await runtime.bootstrap()
+        await runtime.bootstrap()
+
+    asyncio.run(_run())
+    assert FakeGraphiti.builds == 1
+    assert FakeGraphiti.driver.version == SCHEMA_VERSION
+
+
+def test_close_closes_the_clients_of_other_loops(monkeypatch):
+    runtime = new_runtime(monkeypatch)
+    # Like the scheduler thread, which keeps its loop between jobs.
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(
+        target=lambda: other_loop.run_until_complete(runtime.get())
+    )
+    thread.start()
+    thread.join()
+
+    async def _run() -> asyncio.AbstractEventLoop:
+        await runtime.get()
+        await runtime.close()
+        return asyncio.get_running_loop()
+
+    main_loop = asyncio.run(_run())
+    other_loop.close()
+    assert set(FakeGraphiti.closed_on) == {other_loop, main_loop}
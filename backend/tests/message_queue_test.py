@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from message_queue import QUEUE_DROPPED, FanoutQueue, QueueShutDown
+
+
+def test_producers_on_many_threads_lose_nothing():
+    producers, per_producer = 16, 500
+    queue = FanoutQueue[tuple[int, int, float]](maxsize=64)
+    queue.register("consumer")
+
+    def _produce(producer: int) -> None:
+        async def _run() -> None:
+            for i in range(per_producer):
+                await queue.put((producer, i, time.perf_counter()))
+
+        asyncio.run(_run())
+
+    async def _consume() -> tuple[list[tuple[int, int, float]], float]:
+        received: list[tuple[int, int, float]] = []
+        max_delay = 0.0
+        while len(received) < producers * per_producer:
+            batch = await queue.get_many("consumer", max_items=50, timeout=5)
+            assert batch, "delivery stalled"
+            now = time.perf_counter()
+            max_delay = max(max_delay, max(now - sent for _, _, sent in batch))
+            received.extend(batch)
+        return received, max_delay
+
+    threads = [threading.Thread(target=_produce, args=(p,)) for p in range(producers)]
+    for thread in threads:
+        thread.start()
+    received, max_delay = asyncio.run(_consume())
+    for thread in threads:
+        thread.join()
+
+    for producer in range(producers):
+        sequence = [i for p, i, _ in received if p == producer]
+        assert sequence == list(range(per_producer))
+    assert max_delay < 1.0
+
+
+def test_full_consumer_blocks_producers():
+    queue = FanoutQueue[int](maxsize=2)
+    queue.register("consumer")
+
+    async def _run() -> list[int]:
+        await queue.put(1)
+        await queue.put(2)
+        blocked = asyncio.create_task(queue.put(3))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        first = await queue.get("consumer")
+        await asyncio.wait_for(blocked, 1)
+        return [first] + await queue.get_many("consumer")
+
+    assert asyncio.run(_run()) == [1, 2, 3]
+
+
+def test_drop_oldest_consumer_never_blocks():
+    queue = FanoutQueue[int]()
+    queue.register("events", maxsize=2, overflow="drop_oldest")
+
+    async def _run() -> list[int]:
+        for i in range(5):
+            await queue.put(i)
+        return await queue.get_many("events")
+
+    assert asyncio.run(_run()) == [3, 4]
+    assert QUEUE_DROPPED.value(consumer="events") >= 3
+
+
+def test_shutdown_wakes_a_consumer_on_another_thread():
+    queue = FanoutQueue[int]()
+    queue.register("consumer")
+    result: list[BaseException] = []
+
+    def _consume() -> None:
+        async def _run() -> None:
+            await queue.get("consumer")
+
+        try:
+            asyncio.run(_run())
+        except QueueShutDown as e:
+            result.append(e)
+
+    thread = threading.Thread(target=_consume)
+    thread.start()
+    time.sleep(0.05)
+    asyncio.run(queue.shutdown())
+    thread.join(timeout=1)
+
+    assert not thread.is_alive()
+    assert len(result) == 1
+
+
+def test_get_many_times_out_empty():
+    queue = FanoutQueue[int]()
+    queue.register("consumer")
+    assert asyncio.run(queue.get_many("consumer", timeout=0.01)) == []
+    with pytest.raises(ValueError):
+        queue.register("consumer")
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+from typing import Type
+
+from langchain_core.runnables.config import RunnableConfig
+from langchain_core.tools import ToolException
+from pydantic import BaseModel
+
+from metrics import Counter, Histogram, Registry
+from tools.base import TOOL_CALLS, AsyncBaseTool
+
+
+def test_metrics_are_consistent_across_threads():
+    registry = Registry()
+    counter = Counter("test_events", "Events", ["kind"], registry=registry)
+    histogram = Histogram(
+        "test_latency_seconds", "Latency", buckets=(0.1, 1), registry=registry
+    )
+
+    def _work():
+        for _ in range(1000):
+            counter.inc(kind="a")
+            histogram.observe(0.5)
+
+    threads = [threading.Thread(target=_work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value(kind="a") == 8000
+    assert histogram.count() == 8000
+    text = registry.render()
+    assert 'test_events_total{kind="a"} 8000.0' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 0.0' in text
+    assert 'test_latency_seconds_bucket{le="1.0"} 8000.0' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 8000.0' in text
+
+
+class EchoInput(BaseModel):
+    text: str
+
+
+class EchoTool(AsyncBaseTool):
+    name: str = "test_echo"
+    description: str = "Echoes the text"
+    args_schema: Type[BaseModel] = EchoInput
+
+    async def _arun(self, text: str, config: RunnableConfig) -> str:
+        if text == "fail":
+            raise ToolException("failed")
+        return text
+
+
+def test_tool_calls_are_counted():
+    tool = EchoTool()
+    assert asyncio.run(tool.ainvoke({"text": "hi"})) == "hi"
+    assert asyncio.run(tool.ainvoke({"text": "fail"})) == "failed"
+
+    assert TOOL_CALLS.value(tool="test_echo", status="ok") == 1
+    assert TOOL_CALLS.value(tool="test_echo", status="error") == 1
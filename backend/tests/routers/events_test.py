@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from message_queue import AgentEvent, MessageQueue, MessageWithUserId
+from routers.events import event_stream
+
+
+def parse(chunk: str) -> tuple[str, dict]:
+    event, data = chunk.strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_events_of_the_user_are_streamed():
+    async def _run() -> tuple[list[str], int]:
+        queue = MessageQueue()
+        stream = event_stream(queue, "user", keepalive_interval=0.05)
+        chunks = [await anext(stream)]  # Registers the consumer.
+        await queue.put(AgentEvent("other", "tool.start", {"tool": "search"}))
+        await queue.put(AgentEvent("user", "tool.start", {"tool": "search"}))
+        await queue.put(
+            MessageWithUserId(
+                "user", ToolMessage(content="x" * 100, tool_call_id="1"), None, "t"
+            )
+        )
+        await queue.put(MessageWithUserId("user", AIMessage(content="hi"), None, "t"))
+        for _ in range(3):
+            chunks.append(await anext(stream))
+        await stream.aclose()
+        return chunks, len(queue._subscriptions)
+
+    chunks, consumers = asyncio.run(_run())
+    assert chunks[0] == ": keepalive\n\n"
+    events = [parse(chunk) for chunk in chunks[1:]]
+    assert events[0] == ("tool.start", {"tool": "search"})
+    assert events[1][1]["content"] is None
+    assert events[1][1]["content_length"] == 100
+    assert events[2][0] == "message"
+    assert events[2][1]["thread_id"] == "t"
+    assert events[2][1]["content"] == "hi"
+    assert consumers == 0
@@ -0,0 +1,89 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from dependencies import create_session_factory
+from models import Thread, User
+from routers.openai_wrapper import (
+    ChatCompletionRequest,
+    ChatMessage,
+    chat_completions,
+)
+
+
+class FakeAgent:
+    def __init__(self):
+        self.turns: list[tuple[list[str], str, str]] = []
+
+    async def send_message(self, messages, user, thread_id, channel, on_token):
+        self.turns.append(([m.text() for m in messages], thread_id, channel))
+        for token in ["Hello", " there"]:
+            await on_token(token)
+
+
+def test_chats_map_to_threads_and_stream_tokens(tmp_path: Path):
+    user = User(id="user", email="user@example.com")
+    agent = FakeAgent()
+
+    async def _run() -> list[str]:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+        async with engine.begin() as connection:
+            await connection.run_sync(Thread.metadata.create_all, [Thread.__table__])
+        session_factory = asynccontextmanager(create_session_factory(engine))
+        chunks = []
+        try:
+            async with session_factory() as session:
+                response = await chat_completions(
+                    ChatCompletionRequest(
+                        model="ragpile",
+                        messages=[ChatMessage(role="user", content="hi")],
+                        stream=True,
+                    ),
+                    user,
+                    session,
+                    agent,
+                    "chat",
+                )
+                async for chunk in response.body_iterator:
+                    chunks.append(chunk)
+            async with session_factory() as session:
+                response = await chat_completions(
+                    ChatCompletionRequest(
+                        model="ragpile",
+                        messages=[
+                            ChatMessage(role="user", content="hi"),
+                            ChatMessage(role="assistant", content="Hello there"),
+                            ChatMessage(
+                                role="user",
+                                content=[{"type": "text", "text": "how are you?"}],
+                            ),
+                        ],
+                    ),
+                    user,
+                    session,
+                    agent,
+                    "chat",
+                )
+        finally:
+            await engine.dispose()
+        assert response["choices"][0]["message"]["content"] == "Hello there"
+        return chunks
+
+    chunks = asyncio.run(_run())
+    assert chunks[-1] == "data: [DONE]\n\n"
+    deltas = [json.loads(c.removeprefix("data: "))["choices"][0] for c in chunks[:-1]]
+    assert [d["delta"].get("content") for d in deltas] == [
+        None,
+        "Hello",
+        " there",
+        None,
+    ]
+    assert deltas[-1]["finish_reason"] == "stop"
+    (first, first_thread, channel), (second, second_thread, _) = agent.turns
+    assert first == ["hi"]
+    assert second == ["how are you?"]
+    assert first_thread == second_thread
+    assert channel == "openwebui"
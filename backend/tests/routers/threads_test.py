@@ -0,0 +1,76 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from dependencies import create_session_factory
+from models import Thread, User
+from routers.threads import get_threads, window_messages
+
+
+def test_threads_are_paginated_newest_first(tmp_path: Path):
+    user = User(id="user")
+    start = datetime(2026, 1, 1)
+
+    async def _run() -> list[list[str]]:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+        async with engine.begin() as connection:
+            await connection.run_sync(Thread.metadata.create_all, [Thread.__table__])
+        session_factory = asynccontextmanager(create_session_factory(engine))
+        async with session_factory() as session:
+            # Two threads share a created_at, so the id breaks the tie.
+            for i, created_at in enumerate([0, 1, 1, 2, 3]):
+                session.add(
+                    Thread(
+                        id=f"thread-{i}",
+                        user_id=user.id if i else "other",
+                        created_at=start + timedelta(hours=created_at),
+                        preview=f"message {i}",
+                    )
+                )
+        pages: list[list[str]] = []
+        cursor = None
+        try:
+            async with session_factory() as session:
+                while True:
+                    page = await get_threads(user, session, cursor, limit=2)
+                    pages.append([thread.id for thread in page.threads])
+                    cursor = page.next_cursor
+                    if cursor is None:
+                        break
+                with pytest.raises(HTTPException):
+                    await get_threads(user, session, "not a cursor", limit=2)
+        finally:
+            await engine.dispose()
+        return pages
+
+    assert asyncio.run(_run()) == [["thread-4", "thread-3"], ["thread-2", "thread-1"]]
+
+
+def test_messages_are_windowed_newest_first():
+    messages = [
+        HumanMessage(content="hi"),
+        AIMessage(content="", tool_calls=[{"name": "t", "args": {}, "id": "1"}]),
+        ToolMessage(content="x" * 1000, tool_call_id="1"),
+        AIMessage(content="hello"),
+    ]
+
+    page = window_messages(messages, None, None, 2, False)
+    assert [m["index"] for m in page.messages] == [3, 2]
+    assert page.messages[1]["content"] is None
+    assert page.messages[1]["content_length"] == 1000
+    assert page.next_cursor == 2
+
+    page = window_messages(messages, page.next_cursor, None, 2, False)
+    assert [m["index"] for m in page.messages] == [1, 0]
+    assert page.next_cursor is None
+
+    page = window_messages(messages, None, 1, 50, True)
+    assert [m["index"] for m in page.messages] == [3, 2]
+    assert page.messages[1]["content"] == "x" * 1000
+    assert page.next_cursor is None
@@ -1,6 +1,18 @@
+import asyncio
+from types import SimpleNamespace
+
 import pytest
+from telegram.error import BadRequest
 
-from telegram_bot.application import remove_unclosed_tags
+from message_queue import MessageQueue
+from telegram_bot.application import (
+    TelegramApplication,
+    html_to_text,
+    remove_unclosed_tags,
+    sanitize_html,
+    split_message_to_chunks,
+    utf16_length,
+)
 
 
 @pytest.mark.parametrize(
@@ -16,3 +28,83 @@ from telegram_bot.application import remove_unclosed_tags
 )
 def test_remove_unclosed_tags(message: str, result: str):
     assert remove_unclosed_tags(message) == result
+
+
+@pytest.mark.parametrize(
+    "message,result",
+    [
+        ('<b>bold</b> <a href="https://x.y">link</a>', None),
+        ("<b><i>text</b></i>", "<b>text</b>"),
+        ("List<int> & a < b > c", "List&lt;int&gt; &amp; a &lt; b &gt; c"),
+        ("&amp; &#39; &nbsp;", "&amp; &#39; &amp;nbsp;"),
+        (
+            "<ul><li>item</li></ul><br/>",
+            "&lt;ul&gt;&lt;li&gt;item&lt;/li&gt;&lt;/ul&gt;&lt;br/&gt;",
+        ),
+        ("<code><b>x</b></code>", "<code>&lt;b&gt;x&lt;/b&gt;</code>"),
+        ('<pre><code class="language-python">x</code></pre>', None),
+        ("<B>text</B>", None),
+        ('<a href="https://x.y/?a=<b>">link</a>', None),
+        ("<a href='x>y'>link</a> <b>x</b>", None),
+        ('<span class="tg-spoiler">secret</span>', None),
+        (
+            '<span style="color:red">red</span>',
+            '&lt;span style="color:red"&gt;red&lt;/span&gt;',
+        ),
+    ],
+)
+def test_sanitize_html(message: str, result: str | None):
+    assert sanitize_html(message) == (message if result is None else result)
+
+
+def test_split_message_prefers_the_best_break():
+    message = "a" * 30 + "\n\n" + "b" * 30 + ". " + "c" * 20 + " d"
+
+    # The paragraph break would leave the first chunk less than half full.
+    assert list(split_message_to_chunks(message, 70)) == [
+        "a" * 30 + "\n\n" + "b" * 30 + ". ",
+        "c" * 20 + " d",
+    ]
+    assert list(split_message_to_chunks(message, 100)) == [message]
+
+
+def test_split_message_reopens_tags():
+    message = '<b>bold <a href="x">' + "link " * 20 + "</a></b> &amp; after"
+
+    chunks = list(split_message_to_chunks(message, 40))
+
+    assert chunks[1].startswith('<b><a href="x">')
+    assert all(remove_unclosed_tags(chunk) == chunk for chunk in chunks)
+    assert all(utf16_length(html_to_text(chunk)) <= 40 for chunk in chunks)
+    assert "".join(html_to_text(chunk) for chunk in chunks) == html_to_text(message)
+
+
+def test_split_message_counts_utf16():
+    chunks = list(split_message_to_chunks("😀" * 3000))
+
+    assert [utf16_length(chunk) for chunk in chunks] == [4096, 1904]
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent: list[tuple[str, str | None]] = []
+
+    async def send_message(self, _chat_id, text: str, parse_mode=None):
+        if parse_mode == "HTML" and text.count("<") != text.count(">"):
+            raise BadRequest("Can't parse entities: unclosed start tag")
+        self.sent.append((text, parse_mode))
+
+
+def test_send_chunk_falls_back_to_plain_text():
+    bot = FakeBot()
+    telegram = TelegramApplication(MessageQueue(), SimpleNamespace(bot=bot), None, None)
+
+    asyncio.run(telegram.send_chunk("1", "<b>fine &amp; bold</b>"))
+    asyncio.run(telegram.send_chunk("1", "<b>split &lt; in <i"))
+
+    assert bot.sent == [
+        ("<b>fine &amp; bold</b>", "HTML"),
+        ("split < in ", None),
+    ]
+    assert html_to_text('ref="x">a &gt; b</i>') == "a > b"
+    assert html_to_text('<a href="a>b">link</a> <a href="c') == "link "
@@ -0,0 +1,197 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from googleapiclient.errors import HttpError
+from langchain_core.runnables.config import RunnableConfig
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from dependencies import create_session_factory
+from models import CachedCalendarEvent, CalendarSync, User
+from tools.calendar import CalendarBatchEventsTool, CalendarCache
+
+
+def event(event_id: str, day: int, **fields: Any) -> dict[str, Any]:
+    return {
+        "id": event_id,
+        "summary": f"event {event_id}",
+        "start": {"dateTime": f"2026-03-{day:02}T10:00:00+02:00"},
+        "end": {"dateTime": f"2026-03-{day:02}T11:00:00+02:00"},
+        **fields,
+    }
+
+
+class FakeRequest:
+    def __init__(self, execute):
+        self.execute = execute
+
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests: list[tuple[str, FakeRequest]] = []
+
+    def add(self, request: FakeRequest, request_id: str) -> None:
+        self.requests.append((request_id, request))
+
+    def execute(self) -> None:
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except ValueError as exc:
+                self.callback(request_id, None, exc)
+
+
+class FakeService:
+    """The events of a calendar, with pages of one event and sync tokens."""
+
+    def __init__(self, pages: dict[str | None, list[dict[str, Any]]]):
+        # The changes returned for each sync token, None for a full sync.
+        self.pages = pages
+        self.lists: list[dict[str, Any]] = []
+        self.batches = 0
+
+    def events(self) -> "FakeService":
+        return self
+
+    def list(self, **params: Any) -> FakeRequest:
+        self.lists.append(params)
+        token = params.get("syncToken")
+        if token not in self.pages:
+            raise HttpError(SimpleNamespace(status=410, reason="Gone"), b"")
+        items = self.pages[token]
+        page = int(params.get("pageToken", 0))
+        result: dict[str, Any] = {"items": items[page : page + 1]}
+        if page + 1 < len(items):
+            result["nextPageToken"] = str(page + 1)
+        else:
+            result["nextSyncToken"] = f"{token or ''}+"
+        return FakeRequest(lambda: result)
+
+    def insert(self, calendarId: str, body: dict[str, Any]) -> FakeRequest:
+        return FakeRequest(lambda: {"id": body["summary"], **body})
+
+    def patch(self, calendarId: str, eventId: str, body: dict[str, Any]) -> FakeRequest:
+        def execute():
+            if eventId == "missing":
+                raise ValueError("Not Found")
+            return event(eventId, 5, **body)
+
+        return FakeRequest(execute)
+
+    def new_batch_http_request(self, callback) -> FakeBatch:
+        self.batches += 1
+        return FakeBatch(callback)
+
+
+def cache_tables(tmp_path: Path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+
+    async def create() -> None:
+        async with engine.begin() as connection:
+            await connection.run_sync(
+                CachedCalendarEvent.metadata.create_all,
+                [CachedCalendarEvent.__table__, CalendarSync.__table__],
+            )
+
+    return engine, create
+
+
+def test_calendar_is_synced_incrementally(tmp_path: Path):
+    service = FakeService(
+        {
+            None: [event("a", 1), event("b", 2), event("c", 3)],
+            "+": [
+                {"id": "b", "status": "cancelled"},
+                event("c", 4, summary="moved"),
+            ],
+        }
+    )
+    window = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+    async def _run() -> list[list[tuple[str, str]]]:
+        engine, create = cache_tables(tmp_path)
+        await create()
+        cache = CalendarCache(
+            asynccontextmanager(create_session_factory(engine)), max_age=0
+        )
+        listed = []
+        try:
+            for _ in range(3):
+                await cache.sync("user", lambda: service)
+                events = await cache.list("user", window)
+                listed.append([(e.id, e.summary) for e in events])
+            # Listed from the cache, within the window.
+            events = await cache.list(
+                "user", window, datetime(2026, 3, 3, tzinfo=timezone.utc)
+            )
+            listed.append([(e.id, e.summary) for e in events])
+        finally:
+            await engine.dispose()
+        return listed
+
+    assert asyncio.run(_run()) == [
+        [("a", "event a"), ("b", "event b"), ("c", "event c")],
+        [("a", "event a"), ("c", "moved")],
+        # The token "++" is unknown, like an expired one, so it syncs again.
+        [("a", "event a"), ("b", "event b"), ("c", "event c")],
+        [("a", "event a"), ("b", "event b")],
+    ]
+    assert [params.get("syncToken") for params in service.lists] == (
+        [None] * 3 + ["+"] * 2 + ["++"] + [None] * 3
+    )
+
+
+def test_batch_tool_writes_through_to_the_cache(tmp_path: Path):
+    service = FakeService({None: []})
+
+    class Tool(CalendarBatchEventsTool):
+        async def get_user(self, config: RunnableConfig) -> User:
+            return User(id="user")
+
+        def _service(self, user: User) -> FakeService:
+            return service
+
+    async def _run():
+        engine, create = cache_tables(tmp_path)
+        await create()
+        session_factory = asynccontextmanager(create_session_factory(engine))
+        cache = CalendarCache(session_factory)
+        tool = Tool().with_dependencies(
+            SimpleNamespace(session_factory=session_factory, calendar_cache=cache)
+        )
+        try:
+            results = await tool.ainvoke(
+                {
+                    "events": [
+                        {
+                            "summary": "new",
+                            "start_datetime": "2026-03-02T09:00:00+00:00",
+                            "end_datetime": "2026-03-02T10:00:00+00:00",
+                        },
+                        {"event_id": "existing", "summary": "renamed"},
+                        {"event_id": "missing", "summary": "gone"},
+                        {"summary": "no times"},
+                    ]
+                },
+                RunnableConfig(configurable={"user_id": "user"}),
+            )
+            cached = await cache.list("user", datetime(2026, 3, 1, tzinfo=timezone.utc))
+        finally:
+            await engine.dispose()
+        return results, cached
+
+    results, cached = asyncio.run(_run())
+
+    assert [result.event.summary if result.event else None for result in results] == [
+        "new",
+        "renamed",
+        None,
+        None,
+    ]
+    assert results[2].error == "Not Found"
+    assert service.batches == 1
+    assert [event.id for event in cached] == ["new", "existing"]
@@ -0,0 +1,46 @@
+import asyncio
+
+from cache import TTLCache
+from tools.maps.client import MapsClient
+
+
+class FakeResponse:
+    ok = True
+    status = 200
+
+    async def json(self) -> dict:
+        return {
+            "places": [
+                {
+                    "name": "places/1",
+                    "googleMapsUri": "https://maps.google.com/?cid=1",
+                    "displayName": {"text": "Coffee"},
+                    "primaryType": "cafe",
+                }
+            ]
+        }
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = 0
+
+    async def post(self, *_args, **_kwargs) -> FakeResponse:
+        self.calls += 1
+        return FakeResponse()
+
+
+def test_text_search_is_cached_per_neighbourhood():
+    session = FakeSession()
+    client = MapsClient(session, "key", TTLCache(maxsize=10, ttl=60))  # type: ignore
+
+    async def search(query: str, location: tuple[float, float], radius: float):
+        return await client.text_search(query, location, radius)
+
+    first = asyncio.run(search("coffee near me", (37.9838, 23.7275), 5000))
+    second = asyncio.run(search("Coffee  near me", (37.9841, 23.7279), 4800))
+    assert first == second
+    assert session.calls == 1
+
+    asyncio.run(search("coffee near me", (38.2466, 21.7346), 5000))
+    assert session.calls == 2
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from tools.reddit import (
+    MAX_CONCURRENT_FETCHES,
+    RedditDetails,
+    RedditDetailsTool,
+    RedditSearchTool,
+)
+
+
+class FakeComments(list):
+    async def replace_more(self, limit: int) -> None:
+        pass
+
+
+class FakeSubmission:
+    def __init__(self, client: "FakeReddit", post_id: str):
+        self.client = client
+        self.post_id = post_id
+        self.comment_limit = 0
+
+    async def comments(self) -> FakeComments:
+        self.client.fetches += 1
+        self.client.in_flight += 1
+        self.client.max_in_flight = max(
+            self.client.max_in_flight, self.client.in_flight
+        )
+        await asyncio.sleep(0.01)
+        self.client.in_flight -= 1
+        return FakeComments([SimpleNamespace(body=f"comment on {self.post_id}")])
+
+
+class FakeSubreddit:
+    def __init__(self, client: "FakeReddit"):
+        self.client = client
+
+    async def search(self, _query: str, **_kwargs):
+        for i in range(100):
+            self.client.scanned += 1
+            yield SimpleNamespace(
+                id=str(i),
+                title=f"post {i}",
+                selftext="x" * (5000 if i % 2 else 10),
+                url=f"https://reddit.com/{i}",
+                subreddit=SimpleNamespace(display_name="all"),
+            )
+
+
+class FakeReddit:
+    def __init__(self, remaining: float | None = 100, reset_in: float = 0.0):
+        self.fetches = 0
+        self.scanned = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.auth = SimpleNamespace(
+            limits={"remaining": remaining, "reset_timestamp": time.time() + reset_in}
+        )
+
+    async def submission(self, post_id: str, fetch: bool) -> FakeSubmission:
+        assert not fetch
+        return FakeSubmission(self, post_id)
+
+    async def subreddit(self, _name: str, fetch: bool) -> FakeSubreddit:
+        assert not fetch
+        return FakeSubreddit(self)
+
+
+def details_tool(client: FakeReddit) -> RedditDetailsTool:
+    tool = RedditDetailsTool()
+    tool.with_dependencies(SimpleNamespace(reddit_client=client))  # type: ignore
+    return tool
+
+
+def test_search_stops_once_enough_posts_pass_the_filter():
+    client = FakeReddit()
+    tool = RedditSearchTool()
+    tool.with_dependencies(SimpleNamespace(reddit_client=client))  # type: ignore
+
+    results = asyncio.run(tool.ainvoke({"query": "python", "limit": 3}))
+
+    assert [r.id for r in results] == ["0", "2", "4"]
+    assert client.scanned == 5
+
+
+def test_batch_details_are_fetched_concurrently_within_the_bound():
+    client = FakeReddit()
+    post_ids = [str(i) for i in range(10)]
+
+    results = asyncio.run(details_tool(client).ainvoke({"post_ids": post_ids}))
+
+    assert [r.post_id for r in results] == post_ids
+    assert results[3] == RedditDetails(top_comments=["comment on 3"], post_id="3")
+    assert client.max_in_flight == MAX_CONCURRENT_FETCHES
+
+
+def test_details_are_cached():
+    client = FakeReddit()
+    tool = details_tool(client)
+
+    async def _run():
+        await tool.ainvoke({"post_id": "1"})
+        await tool.ainvoke({"post_ids": ["1", "2"]})
+
+    asyncio.run(_run())
+    assert client.fetches == 2
+
+
+def test_fetches_wait_for_the_rate_limit_to_reset():
+    client = FakeReddit(remaining=0, reset_in=0.2)
+    start = time.perf_counter()
+    asyncio.run(details_tool(client).ainvoke({"post_id": "1"}))
+    assert time.perf_counter() - start >= 0.15
+
+    client = FakeReddit(remaining=None)
+    start = time.perf_counter()
+    asyncio.run(details_tool(client).ainvoke({"post_id": "1"}))
+    assert time.perf_counter() - start < 0.15
+
+
+def test_concurrent_fetches_share_the_last_remaining_request():
+    client = FakeReddit(remaining=1, reset_in=0.2)
+    start = time.perf_counter()
+    asyncio.run(details_tool(client).ainvoke({"post_ids": ["1", "2", "3", "4"]}))
+    assert time.perf_counter() - start >= 0.15
+    assert client.fetches == 4
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables.config import RunnableConfig
+from langchain_core.tools.base import BaseTool
+from pydantic import BaseModel
+
+from models import User
+from tools.scheduler import (
+    JOB_RUNS,
+    JOB_WORKERS,
+    JobDependencies,
+    run_job,
+    set_job_dependencies,
+)
+
+
+class EchoInput(BaseModel):
+    text: str
+
+
+class EchoTool(BaseTool):
+    name: str = "echo"
+    description: str = "Echoes"
+    args_schema: type = EchoInput
+    calls: list[tuple[str, int]] = []
+
+    def _run(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def _arun(self, text: str, config: RunnableConfig) -> str:
+        self.calls.append((config["configurable"]["user_id"], threading.get_ident()))
+        return text.upper()
+
+
+class FakeAgent:
+    def __init__(self):
+        self.sent: list[tuple[list[BaseMessage], str]] = []
+
+    async def send_message(self, messages: list[BaseMessage], user: User) -> None:
+        self.sent.append((messages, user.id))
+
+
+class FakeLLM:
+    async def ainvoke(self, messages: list[BaseMessage]) -> AIMessage:
+        return AIMessage(content=f"summary of {messages[-1].content}")
+
+
+class FakeSession:
+    async def get(self, _model, user_id: str) -> User:
+        return User(id=user_id)
+
+    def expunge(self, _user: User) -> None:
+        pass
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.kwargs: dict = {}
+
+    def get_job(self, job_id: str):
+        return SimpleNamespace(id=job_id, name="news", kwargs={"code": ""})
+
+    def modify_job(self, _job_id: str, kwargs: dict) -> None:
+        self.kwargs = kwargs
+
+
+@asynccontextmanager
+async def session_factory():
+    yield FakeSession()
+
+
+held_locks: set[str] = set()
+
+
+@asynccontextmanager
+async def job_lock(name: str):
+    if name in held_locks:
+        yield False
+        return
+    held_locks.add(name)
+    try:
+        yield True
+    finally:
+        held_locks.discard(name)
+
+
+CODE = """
+result = tools["echo"].run({"text": "hello"})
+send_message(invoke_llm(result))
+state["runs"] = state.get("runs", 0) + 1
+"""
+
+
+def set_fakes() -> tuple[EchoTool, FakeAgent, FakeScheduler]:
+    tool, agent, scheduler = EchoTool(), FakeAgent(), FakeScheduler()
+    set_job_dependencies(
+        JobDependencies(
+            tools=[tool],
+            agent=agent,  # type: ignore
+            llm=FakeLLM(),  # type: ignore
+            session_factory=session_factory,  # type: ignore
+            scheduler=scheduler,  # type: ignore
+            job_lock=job_lock,
+        )
+    )
+    return tool, agent, scheduler
+
+
+def test_job_code_runs_off_the_loop_and_calls_back_into_it():
+    tool, agent, scheduler = set_fakes()
+
+    async def _run() -> int:
+        await run_job(CODE, "user", "job", {})
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(_run())
+
+    assert tool.calls == [("user", loop_thread)]
+    ((messages, user_id),) = agent.sent
+    assert user_id == "user"
+    assert messages[-1].content == "summary of HELLO"
+    assert scheduler.kwargs["state"] == {"runs": 1}
+
+
+def test_job_is_skipped_while_another_replica_runs_it():
+    tool, _, _ = set_fakes()
+    held_locks.add("job:job")
+    try:
+        asyncio.run(run_job(CODE, "user", "job", {}))
+    finally:
+        held_locks.clear()
+    assert tool.calls == []
+    assert JOB_RUNS.value(status="skipped") >= 1
+
+
+def test_burst_of_jobs_holds_at_most_one_lock_per_worker():
+    _, agent, scheduler = set_fakes()
+    held = {"now": 0, "max": 0}
+
+    @asynccontextmanager
+    async def counting_lock(_name: str):
+        held["now"] += 1
+        held["max"] = max(held["max"], held["now"])
+        try:
+            yield True
+        finally:
+            held["now"] -= 1
+
+    async def _run() -> None:
+        set_job_dependencies(
+            JobDependencies(
+                tools=[],
+                agent=agent,  # type: ignore
+                llm=FakeLLM(),  # type: ignore
+                session_factory=session_factory,  # type: ignore
+                scheduler=scheduler,  # type: ignore
+                job_lock=counting_lock,
+            )
+        )
+        await asyncio.gather(
+            *(
+                run_job("import time\ntime.sleep(0.02)", "user", f"job-{i}", {})
+                for i in range(JOB_WORKERS * 3)
+            )
+        )
+
+    asyncio.run(_run())
+
+    assert held["max"] == JOB_WORKERS
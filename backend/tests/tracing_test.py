@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from tracing import (
+    BatchSpanProcessor,
+    FileSpanExporter,
+    Tracer,
+    current_span_context,
+)
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def shutdown(self):
+        pass
+
+
+def test_spans_nest_across_tasks():
+    exporter = ListExporter()
+    tracer = Tracer(BatchSpanProcessor(exporter), sample_rate=1.0)
+
+    async def child(name):
+        with tracer.span(name):
+            await asyncio.sleep(0)
+
+    async def main():
+        with tracer.span("turn", user_id="u") as turn:
+            await asyncio.gather(child("a"), child("b"))
+        return turn
+
+    turn = asyncio.run(main())
+    tracer.shutdown()
+
+    by_name = {span.name: span for span in exporter.spans}
+    assert set(by_name) == {"turn", "a", "b"}
+    assert by_name["a"].parent_span_id == turn.context.span_id
+    assert by_name["b"].context.trace_id == turn.context.trace_id
+    assert by_name["turn"].attributes == {"user_id": "u"}
+
+
+def test_unsampled_traces_are_not_exported():
+    exporter = ListExporter()
+    tracer = Tracer(BatchSpanProcessor(exporter), sample_rate=0.0)
+    with tracer.span("turn"):
+        with tracer.span("child") as child:
+            child.set_attribute("ignored", 1)
+        context = current_span_context()
+    tracer.shutdown()
+
+    assert not exporter.spans
+    assert context is not None and not context.sampled
+
+
+def test_exceptions_are_recorded_and_exported_as_otlp_json(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(BatchSpanProcessor(FileSpanExporter(str(path))), sample_rate=1.0)
+    try:
+        with tracer.span("tool.call", tool="google_search"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    tracer.shutdown()
+
+    request = json.loads(path.read_text().splitlines()[0])
+    (span,) = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert span["name"] == "tool.call"
+    assert span["status"]["code"] == 2
+    assert span["attributes"] == [
+        {"key": "tool", "value": {"stringValue": "google_search"}}
+    ]
+    assert span["events"][0]["name"] == "exception"
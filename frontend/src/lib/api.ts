@@ -1,4 +1,10 @@
-import { Schedule, TelegramUser, Thread, ThreadItem, User } from '@/models'
+import {
+  Schedule,
+  TelegramUser,
+  ThreadMessages,
+  ThreadPage,
+  User,
+} from '@/models'
 
 function validateResponse(res: Response): Response {
   if (!res.ok) {
@@ -52,13 +58,32 @@ export async function telegramCallback(
   return await validateResponse(res).json()
 }
 
-export async function getThreads(): Promise<ThreadItem[]> {
-  const res = await fetch('/ragpile/api/threads', { method: 'GET' })
+export async function getThreads(cursor?: string): Promise<ThreadPage> {
+  const query = cursor ? '?cursor=' + encodeURIComponent(cursor) : ''
+  const res = await fetch('/ragpile/api/threads' + query, { method: 'GET' })
   return await validateResponse(res).json()
 }
 
-export async function getThread(id: string): Promise<Thread> {
-  const res = await fetch('/ragpile/api/threads/' + id, { method: 'GET' })
+type MessagesQuery = {
+  before?: number
+  since?: number
+  limit?: number
+  includeToolResults?: boolean
+}
+
+export async function getThreadMessages(
+  id: string,
+  query: MessagesQuery = {}
+): Promise<ThreadMessages> {
+  const params = new URLSearchParams()
+  if (query.before !== undefined) params.set('before', String(query.before))
+  if (query.since !== undefined) params.set('since', String(query.since))
+  if (query.limit !== undefined) params.set('limit', String(query.limit))
+  if (query.includeToolResults) params.set('include_tool_results', 'true')
+  const res = await fetch(
+    '/ragpile/api/threads/' + id + '/messages?' + params.toString(),
+    { method: 'GET' }
+  )
   return await validateResponse(res).json()
 }
 
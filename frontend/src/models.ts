@@ -23,31 +23,39 @@ export type ThreadItem = {
   id: string
   user_id: string
   created_at: string
+  preview: string | null
 }
 
-export type Thread = {
-  id: string
-  ts: string
-  channel_values: {
-    messages: {
-      content: string
-      type: 'human' | 'ai' | 'tool'
-      tool_calls: {
-        id: string
-        name: string
-        args: Map<string, string>
-      }[]
-      usage_metadata?: {
-        input_tokens: number
-        output_tokens: number
-      }
-      response_metadata: {
-        model_name: string
-      }
-    }[]
+export type ThreadPage = {
+  threads: ThreadItem[]
+  next_cursor: string | null
+}
+
+export type ThreadMessage = {
+  index: number
+  content: string | null
+  // Set instead of the content on tool results, unless they were requested.
+  content_length?: number
+  type: 'human' | 'ai' | 'tool'
+  tool_calls: {
+    id: string
+    name: string
+    args: Map<string, string>
+  }[]
+  usage_metadata?: {
+    input_tokens: number
+    output_tokens: number
+  }
+  response_metadata: {
+    model_name: string
   }
 }
 
+export type ThreadMessages = {
+  messages: ThreadMessage[]
+  next_cursor: number | null
+}
+
 export type ToolContent = {
   type: string
   attributes: Map<string, string>
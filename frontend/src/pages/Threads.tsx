@@ -6,41 +6,125 @@ import { Skeleton } from '@/components/ui/skeleton'
 import { costForModel } from '@/constants'
 import { useApi } from '@/hooks/use-api'
 import {
-  getThread as apiGetThread,
+  getThreadMessages as apiGetThreadMessages,
   getThreads as apiGetThreads,
 } from '@/lib/api'
-import { Thread, ThreadItem, parseToolContent } from '@/models'
+import {
+  ThreadItem,
+  ThreadMessage,
+  ThreadMessages,
+  ThreadPage,
+  parseToolContent,
+} from '@/models'
 
 import { Layout } from './Layout'
 
 export default function Threads() {
-  const [selectedThread, setSelectedThread] = useState<Thread | null>(null)
+  // The loaded messages of the selected thread, oldest first.
+  const [messages, setMessages] = useState<ThreadMessage[]>([])
+  const [olderCursor, setOlderCursor] = useState<number | null>(null)
   const { threadId: selectedThreadId } = useParams()
   const navigate = useNavigate()
-  const {
-    data: threads,
-    loading: threadsLoading,
-    fn: getThreads,
-  } = useApi<ThreadItem[], typeof apiGetThreads>(apiGetThreads, true)
-  const { loading: threadLoading, fn: getThread } = useApi(apiGetThread)
+  const [threads, setThreads] = useState<ThreadItem[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const { loading: threadsLoading, fn: getThreads } = useApi<
+    ThreadPage,
+    typeof apiGetThreads
+  >(apiGetThreads, true)
+  const { loading: threadLoading, fn: getThreadMessages } = useApi<
+    ThreadMessages,
+    typeof apiGetThreadMessages
+  >(apiGetThreadMessages)
 
   useEffect(() => {
+    setMessages([])
+    setOlderCursor(null)
     if (selectedThreadId) {
-      getThread(selectedThreadId).then(setSelectedThread)
-    } else {
-      setSelectedThread(null)
+      getThreadMessages(selectedThreadId).then((page) => {
+        setMessages([...page.messages].reverse())
+        setOlderCursor(page.next_cursor)
+      })
     }
   }, [selectedThreadId])
 
+  // Set by the live events, for each message the agent adds to a thread.
+  const [updatedThread, setUpdatedThread] = useState<{ id: string } | null>(
+    null
+  )
+
   useEffect(() => {
-    getThreads()
+    const source = new EventSource('/ragpile/api/events')
+    source.addEventListener('message', (event) => {
+      setUpdatedThread({ id: JSON.parse(event.data).thread_id })
+    })
+    return () => source.close()
   }, [])
 
-  const costs = useMemo(() => {
-    if (!selectedThread) {
-      return []
+  useEffect(() => {
+    if (!updatedThread) {
+      return
+    }
+    if (!threads.some((thread) => thread.id === updatedThread.id)) {
+      loadThreads()
+    }
+    if (updatedThread.id !== selectedThreadId) {
+      return
+    }
+    const last = messages.length > 0 ? messages[messages.length - 1].index : -1
+    apiGetThreadMessages(selectedThreadId, { since: last, limit: 200 }).then(
+      (page) => {
+        setMessages((prev) => {
+          const lastLoaded = prev.length > 0 ? prev[prev.length - 1].index : -1
+          const newer = page.messages.filter((m) => m.index > lastLoaded)
+          return [...prev, ...newer.reverse()]
+        })
+      }
+    )
+  }, [updatedThread])
+
+  const loadOlderMessages = () => {
+    if (!selectedThreadId || olderCursor === null) {
+      return
+    }
+    getThreadMessages(selectedThreadId, { before: olderCursor }).then(
+      (page) => {
+        setMessages((prev) => [...[...page.messages].reverse(), ...prev])
+        setOlderCursor(page.next_cursor)
+      }
+    )
+  }
+
+  const loadToolResult = (index: number) => {
+    if (!selectedThreadId) {
+      return
     }
-    const costs = selectedThread.channel_values.messages.map((message) => {
+    apiGetThreadMessages(selectedThreadId, {
+      before: index + 1,
+      since: index - 1,
+      includeToolResults: true,
+    }).then((page) => {
+      setMessages((prev) =>
+        prev.map((message) =>
+          message.index === index ? page.messages[0] : message
+        )
+      )
+    })
+  }
+
+  const loadThreads = (cursor?: string) =>
+    getThreads(cursor).then((page) => {
+      setThreads((prev) =>
+        cursor ? [...prev, ...page.threads] : page.threads
+      )
+      setNextCursor(page.next_cursor)
+    })
+
+  useEffect(() => {
+    loadThreads()
+  }, [])
+
+  const costs = useMemo(() => {
+    const costs = messages.map((message) => {
       if (!message.response_metadata.model_name) {
         return 0
       }
@@ -57,7 +141,7 @@ export default function Threads() {
       return 0
     })
     return costs
-  }, [selectedThread])
+  }, [messages])
 
   const formatDate = (dateString: string) => {
     return new Date(dateString).toLocaleString()
@@ -72,13 +156,13 @@ export default function Threads() {
           </CardHeader>
           <CardContent className="p-0 overflow-auto">
             <div className="max-h-full">
-              {threadsLoading ? (
+              {threadsLoading && threads.length === 0 ? (
                 <div className="space-y-2 p-4">
                   {[...Array(5)].map((_, i) => (
                     <Skeleton key={i} className="h-16 w-full" />
                   ))}
                 </div>
-              ) : threads && threads.length > 0 ? (
+              ) : threads.length > 0 ? (
                 <div className="space-y-1">
                   {threads.map((thread: ThreadItem) => (
                     <button
@@ -90,14 +174,23 @@ export default function Threads() {
                           : ''
                       }`}
                     >
-                      <div className="font-medium text-sm text-gray-600">
-                        Thread {thread.id.slice(0, 8)}...
+                      <div className="font-medium text-sm text-gray-600 truncate">
+                        {thread.preview || `Thread ${thread.id.slice(0, 8)}...`}
                       </div>
                       <div className="text-xs text-gray-500 mt-1">
                         {formatDate(thread.created_at)}
                       </div>
                     </button>
                   ))}
+                  {nextCursor && (
+                    <button
+                      onClick={() => loadThreads(nextCursor)}
+                      disabled={threadsLoading}
+                      className="w-full p-4 text-sm text-blue-600 hover:bg-gray-50"
+                    >
+                      {threadsLoading ? 'Loading...' : 'Load more'}
+                    </button>
+                  )}
                 </div>
               ) : (
                 <div className="p-4 text-center text-gray-500">
@@ -120,116 +213,133 @@ export default function Threads() {
             </CardTitle>
           </CardHeader>
           <CardContent>
-            {threadLoading ? (
+            {threadLoading && messages.length === 0 ? (
               <div className="space-y-4">
                 <Skeleton className="h-4 w-3/4" />
                 <Skeleton className="h-4 w-1/2" />
                 <Skeleton className="h-4 w-2/3" />
               </div>
-            ) : selectedThread ? (
+            ) : messages.length > 0 ? (
               <div className="space-y-4 max-h-[calc(100vh-300px)] overflow-y-auto">
-                {selectedThread.channel_values.messages.map(
-                  (message, index) => (
-                    <div
-                      key={index}
-                      className={`p-4 rounded-lg ${
-                        message.type === 'human'
-                          ? 'bg-blue-50 ml-4'
-                          : 'bg-gray-50 mr-4'
-                      }`}
-                    >
-                      <div className="flex items-center gap-2 mb-2">
-                        <span
-                          className={`text-xs font-medium px-2 py-1 rounded ${
-                            message.type === 'human'
-                              ? 'bg-blue-100 text-blue-800'
-                              : 'bg-gray-100 text-gray-800'
-                          }`}
-                        >
-                          {message.type === 'human'
-                            ? 'You'
-                            : 'Assistant' + ' (' + message.type + ')'}
+                {olderCursor !== null && (
+                  <button
+                    onClick={loadOlderMessages}
+                    disabled={threadLoading}
+                    className="w-full p-2 text-sm text-blue-600 hover:bg-gray-50"
+                  >
+                    {threadLoading ? 'Loading...' : 'Load older messages'}
+                  </button>
+                )}
+                {messages.map((message, index) => (
+                  <div
+                    key={message.index}
+                    className={`p-4 rounded-lg ${
+                      message.type === 'human'
+                        ? 'bg-blue-50 ml-4'
+                        : 'bg-gray-50 mr-4'
+                    }`}
+                  >
+                    <div className="flex items-center gap-2 mb-2">
+                      <span
+                        className={`text-xs font-medium px-2 py-1 rounded ${
+                          message.type === 'human'
+                            ? 'bg-blue-100 text-blue-800'
+                            : 'bg-gray-100 text-gray-800'
+                        }`}
+                      >
+                        {message.type === 'human'
+                          ? 'You'
+                          : 'Assistant' + ' (' + message.type + ')'}
+                      </span>
+                      {costs[index] > 0 && (
+                        <span className="text-xs text-gray-500 bg-gray-100 px-2 py-1 rounded">
+                          ${costs[index].toFixed(4)}
                         </span>
-                        {costs[index] > 0 && (
-                          <span className="text-xs text-gray-500 bg-gray-100 px-2 py-1 rounded">
-                            ${costs[index].toFixed(4)}
-                          </span>
-                        )}
-                      </div>
-                      <div className="text-sm text-gray-900 whitespace-pre-wrap break-all overflow-hidden">
-                        {message.type !== 'tool' && message.content}
-                        {message.tool_calls &&
-                          message.tool_calls.map((tool_call) => (
+                      )}
+                    </div>
+                    <div className="text-sm text-gray-900 whitespace-pre-wrap break-all overflow-hidden">
+                      {message.type !== 'tool' && message.content}
+                      {message.tool_calls &&
+                        message.tool_calls.map((tool_call) => (
+                          <div
+                            key={tool_call.id}
+                            className="mt-3 p-3 bg-amber-50 border border-amber-200 rounded-md"
+                          >
+                            <div className="flex items-center gap-2 mb-2">
+                              <span className="text-xs font-medium px-2 py-1 bg-amber-100 text-amber-800 rounded">
+                                🔧 Tool Call
+                              </span>
+                              <span className="text-sm font-medium text-amber-900">
+                                {tool_call.name}
+                              </span>
+                            </div>
+                            {tool_call.args &&
+                              Object.keys(tool_call.args).length > 0 && (
+                                <div className="space-y-1">
+                                  <div className="text-xs font-medium text-amber-700 mb-1">
+                                    Arguments:
+                                  </div>
+                                  {Object.entries(tool_call.args).map(
+                                    ([key, value]) => (
+                                      <div key={key} className="text-xs">
+                                        <span className="font-medium text-amber-800">
+                                          {key}:
+                                        </span>{' '}
+                                        <span className="text-amber-700 font-mono bg-amber-100 px-1 rounded">
+                                          {value}
+                                        </span>
+                                      </div>
+                                    )
+                                  )}
+                                </div>
+                              )}
+                          </div>
+                        ))}
+                      {message.type === 'tool' && message.content === null && (
+                        <button
+                          onClick={() => loadToolResult(message.index)}
+                          className="mt-3 text-xs text-emerald-700 underline"
+                        >
+                          Show tool response ({message.content_length}{' '}
+                          characters)
+                        </button>
+                      )}
+                      {message.type === 'tool' &&
+                        message.content !== null &&
+                        parseToolContent(String(message.content)).map(
+                          (toolContent, toolIndex) => (
                             <div
-                              key={tool_call.id}
-                              className="mt-3 p-3 bg-amber-50 border border-amber-200 rounded-md"
+                              key={`${toolContent.type}-${toolIndex}`}
+                              className="mt-3 p-3 bg-emerald-50 border border-emerald-200 rounded-md"
                             >
                               <div className="flex items-center gap-2 mb-2">
-                                <span className="text-xs font-medium px-2 py-1 bg-amber-100 text-amber-800 rounded">
-                                  🔧 Tool Call
+                                <span className="text-xs font-medium px-2 py-1 bg-emerald-100 text-emerald-800 rounded">
+                                  🔄 Tool Response
                                 </span>
-                                <span className="text-sm font-medium text-amber-900">
-                                  {tool_call.name}
+                                <span className="text-sm font-medium text-emerald-900">
+                                  {toolContent.type}
                                 </span>
                               </div>
-                              {tool_call.args &&
-                                Object.keys(tool_call.args).length > 0 && (
-                                  <div className="space-y-1">
-                                    <div className="text-xs font-medium text-amber-700 mb-1">
-                                      Arguments:
-                                    </div>
-                                    {Object.entries(tool_call.args).map(
-                                      ([key, value]) => (
-                                        <div key={key} className="text-xs">
-                                          <span className="font-medium text-amber-800">
-                                            {key}:
-                                          </span>{' '}
-                                          <span className="text-amber-700 font-mono bg-amber-100 px-1 rounded">
-                                            {value}
-                                          </span>
-                                        </div>
-                                      )
-                                    )}
+                              <div className="space-y-1">
+                                {Array.from(
+                                  toolContent.attributes.entries()
+                                ).map(([key, value]) => (
+                                  <div key={key} className="text-xs">
+                                    <span className="font-medium text-emerald-800">
+                                      {key}:
+                                    </span>{' '}
+                                    <span className="text-emerald-700 font-mono bg-emerald-100 px-1 rounded">
+                                      {value}
+                                    </span>
                                   </div>
-                                )}
-                            </div>
-                          ))}
-                        {message.type === 'tool' &&
-                          parseToolContent(String(message.content)).map(
-                            (toolContent, toolIndex) => (
-                              <div
-                                key={`${toolContent.type}-${toolIndex}`}
-                                className="mt-3 p-3 bg-emerald-50 border border-emerald-200 rounded-md"
-                              >
-                                <div className="flex items-center gap-2 mb-2">
-                                  <span className="text-xs font-medium px-2 py-1 bg-emerald-100 text-emerald-800 rounded">
-                                    🔄 Tool Response
-                                  </span>
-                                  <span className="text-sm font-medium text-emerald-900">
-                                    {toolContent.type}
-                                  </span>
-                                </div>
-                                <div className="space-y-1">
-                                  {Array.from(
-                                    toolContent.attributes.entries()
-                                  ).map(([key, value]) => (
-                                    <div key={key} className="text-xs">
-                                      <span className="font-medium text-emerald-800">
-                                        {key}:
-                                      </span>{' '}
-                                      <span className="text-emerald-700 font-mono bg-emerald-100 px-1 rounded">
-                                        {value}
-                                      </span>
-                                    </div>
-                                  ))}
-                                </div>
+                                ))}
                               </div>
-                            )
-                          )}
-                      </div>
+                            </div>
+                          )
+                        )}
                     </div>
-                  )
-                )}
+                  </div>
+                ))}
               </div>
             ) : (
               <div className="flex items-center justify-center h-32 text-gray-500">